@@ -29,6 +29,15 @@ angular.module('dcmetrometricsApp')
         $scope.key_statuses = $scope.unitData.key_statuses;
         var stationCode = data.station_code;
 
+        // Load the full status history when the statuses or the calendar are shown.
+        $scope.$watch(function() {
+          return $scope.showStatuses() || $scope.showCalendar();
+        }, function(show) {
+          if (show) {
+            unitService.loadHistory(data);
+          }
+        });
+
         // Get the station data for this unit.
         directory.get_directory().then(function(stationDirectory) {
           // console.log("Have directory data: ", stationDirectory);
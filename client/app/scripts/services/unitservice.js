@@ -129,7 +129,69 @@ angular.module('dcmetrometricsApp')
       return ks;
     };
 
+    // Convert the statuses loaded so far, and compute the days
+    // with outages, inspections and rehabs for the calendar view.
+    var processStatuses = function(data) {
+
+      data.statuses_objs = data.statuses.map(function(d) {
+        if(d) {
+          return new UnitStatus(d); 
+        }
+        return null;
+      });
+
+      computeOutageDays(data);
+      computeInspectionDays(data);
+      computeRehabDays(data);
+
+    };
+
+    // Request a chunk of the status history listed in the unit summary's
+    // manifest. Each chunk is only requested once.
+    var loadChunk = function(data, i) {
+      if (!data.history_requests[i]) {
+        data.history_requests[i] = $http.get(data.history[i].url, { cache: true })
+          .then(function(response) {
+            data.history_statuses[i] = response.data.statuses;
+          });
+      }
+      return data.history_requests[i];
+    };
+
+    // Load chunks of the status history, by index in the manifest, and merge the
+    // statuses of all loaded chunks into data.statuses. The chunks are in
+    // descending order of time, so the first chunk holds the most recent statuses.
+    var loadChunks = function(data, indices) {
+      var requests = indices.map(function(i) { return loadChunk(data, i); });
+      return $q.all(requests).then(function() {
+        var statuses = [];
+        var numLoaded = 0;
+        data.history.forEach(function(chunk, i) {
+          if (data.history_statuses[i]) {
+            statuses = statuses.concat(data.history_statuses[i]);
+            numLoaded += 1;
+          }
+        });
+        data.statuses = statuses;
+        data.history_complete = (numLoaded === data.history.length);
+        processStatuses(data);
+        return data;
+      });
+    };
+
+    // Load the unit's full status history, for the status table and the calendar.
+    // Returns a promise that gives the unit data.
+    this.loadHistory = function(data) {
+      if (!data.history || data.history_complete) {
+        return $q.when(data);
+      }
+      return loadChunks(data, data.history.map(function(chunk, i) { return i; }));
+    };
+
     // TOD: Consider using Unit factory?
+    // The unit data is resolved with the unit summary and its history manifest.
+    // The most recent chunk of the status history is loaded in the background,
+    // and the rest is loaded by loadHistory when it is needed.
     this.getUnitData = function(unitId) {
 
       
@@ -144,26 +206,29 @@ angular.module('dcmetrometricsApp')
 
       var url = "/json/units/" + unitId + ".json";
       $http.get(url, { cache: true })
-        .success( function(data) {
+        .then( function(response) {
 
-          data.statuses_objs = data.statuses.map(function(d) {
-            if(d) {
-              return new UnitStatus(d); 
-            }
-            return null;
-          });
-          convertKeyStatuses(data);
+          var data = response.data;
 
+          convertKeyStatuses(data);
           fixDateToBreakCount(data);
-          computeOutageDays(data);
-          computeInspectionDays(data);
-          computeRehabDays(data);
 
+          if (data.history) {
+            data.statuses = [];
+            data.history_requests = [];
+            data.history_statuses = [];
+            data.history_complete = (data.history.length === 0);
+          }
+          processStatuses(data);
 
           unitToData[unitId] = data;
           deferred.resolve(data);
-        })
-        .error(function() {
+
+          if (data.history && data.history.length) {
+            loadChunks(data, [0]);
+          }
+
+        }, function() {
           deferred.reject();
         });
 
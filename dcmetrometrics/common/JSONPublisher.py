@@ -0,0 +1,113 @@
+"""
+common.JSONPublisher
+
+Publish the static JSON files for the website from a greenlet, so that
+writing the files does not add to the latency of an app tick.
+
+The app marks files as dirty (a unit's json, the station directory, the recent
+updates). The publisher greenlet coalesces the dirty marks and writes each
+dirty file once per round, with at least min_interval seconds between rounds.
+A burst of changes therefore produces a single rewrite of the station directory.
+"""
+from collections import OrderedDict
+
+import gevent
+from gevent.event import Event
+
+import logging
+logger = logging.getLogger('JSONPublisher')
+
+class JSONPublisher(object):
+    """
+    Coalescing, rate limited publisher of the static JSON files written by a JSONWriter.
+    """
+
+    def __init__(self, json_writer, min_interval = 10.0, profiler = None):
+        """
+        json_writer: The JSONWriter used to write the files.
+        min_interval: Minimum number of seconds between publishing rounds.
+        profiler: An optional tickMetrics.TickProfiler, used to count the files written.
+        """
+        self.json_writer = json_writer
+        self.min_interval = min_interval
+        self.profiler = profiler
+        self.dirty = OrderedDict() # key -> (write function, args)
+        self.greenlet = None
+        self._event = Event()
+
+    def __len__(self):
+        return len(self.dirty)
+
+    def mark_dirty(self, key, func, *args):
+        """
+        Mark a file as dirty. The file is written with func(*args) in the next round.
+        If the key is already dirty, it is only written once, with the latest args.
+        """
+        self.dirty[key] = (func, args)
+        self._event.set()
+
+    def unit_dirty(self, unit):
+        self.mark_dirty(('unit', unit.unit_id), self.json_writer.write_unit, unit)
+
+    def directory_dirty(self, units = None):
+        """
+        units: The units of the station directory. If None, they are loaded from the database.
+        """
+        self.mark_dirty('station_directory', self.json_writer.write_station_directory, units)
+
+    def recent_updates_dirty(self):
+        self.mark_dirty('recent_updates', self.json_writer.write_recent_updates)
+
+    def hotcars_dirty(self):
+        self.mark_dirty('hotcars', self.json_writer.write_hotcars)
+
+    def _count(self, name, n = 1):
+        if self.profiler is not None and n:
+            self.profiler.count(name, n)
+
+    def publish(self):
+        """
+        Write all dirty files. Return the number of files written.
+        A file which fails to write is marked dirty again, unless it was
+        marked dirty while it was being written.
+        """
+        dirty, self.dirty = self.dirty, OrderedDict()
+        written = 0
+        for key, (func, args) in dirty.iteritems():
+            try:
+                func(*args)
+                written += 1
+            except Exception as e:
+                logger.error('Caught exception when publishing %s: %s'%(str(key), str(e)))
+                self._count('json_publish_errors')
+                if key not in self.dirty:
+                    self.dirty[key] = (func, args)
+        self._count('json_files_written', written)
+        if self.dirty:
+            self._event.set()
+        return written
+
+    def _run(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+            self.publish()
+            gevent.sleep(self.min_interval)
+
+    def start(self):
+        """
+        Start the publisher greenlet.
+        """
+        if self.greenlet is None or self.greenlet.dead:
+            self.greenlet = gevent.spawn(self._run)
+        return self.greenlet
+
+    def stop(self, flush = True):
+        """
+        Stop the publisher greenlet. If flush is True, write the remaining dirty files.
+        """
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
+        if flush:
+            self.publish()
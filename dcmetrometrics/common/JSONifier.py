@@ -1,18 +1,122 @@
 """
 Methods to convert an oect to json for the web.
+
+Files are written atomically (to a temporary file which is renamed over
+the target), along with a precompressed .gz copy for the static file server.
+A file whose content has not changed is not rewritten, so that its
+mtime stays stable for HTTP caching.
+
+Large exports (e.g. all hot car reports) are encoded and written
+incrementally with iter_json_array and JSONWriter.write_file_stream,
+so that memory use does not grow with the size of the collection.
+The bulk writers read raw documents through rawWebJSON.WebJSONProjection
+instead of hydrating mongoengine documents.
 """
 from json import JSONEncoder, dumps
+import json
 import datetime
 import os
+import gzip
+import hashlib
+import tempfile
+from cStringIO import StringIO
 from .utils import mkdir_p
 from datetime import timedelta
 from collections import defaultdict
+from itertools import chain
 
 
 from ..eles.models import (Unit, UnitStatus, KeyStatuses, Station, DailyServiceReport, SystemServiceReport)
 from ..hotcars.models import (HotCarReport, Temperature)
 from ..common.WebJSONMixin import WebJSONMixin
 from ..common.metroTimes import tzutc, isNaive, toUtc
+from ..common.rawWebJSON import WebJSONProjection
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+class AtomicFile(object):
+  """
+  A file which is written to a temporary file in the target directory.
+  commit() renames the temporary file over the target, so that a reader sees
+  either the old or the new file but never a partially written file.
+  discard() removes the temporary file.
+  """
+
+  def __init__(self, outpath):
+    self.outpath = outpath
+    outdir, fname = os.path.split(outpath)
+    fd, self.tmp_path = tempfile.mkstemp(prefix = '.%s.'%fname, suffix = '.tmp', dir = outdir)
+    self.fout = os.fdopen(fd, 'wb')
+
+  def write(self, data):
+    self.fout.write(data)
+
+  def flush(self):
+    self.fout.flush()
+
+  def commit(self):
+    try:
+      self.fout.flush()
+      os.fsync(self.fout.fileno())
+      self.fout.close()
+      os.chmod(self.tmp_path, 0644)
+      os.rename(self.tmp_path, self.outpath)
+    except:
+      self.discard()
+      raise
+
+  def discard(self):
+    self.fout.close()
+    if os.path.exists(self.tmp_path):
+      os.remove(self.tmp_path)
+
+def write_atomic(outpath, data):
+  """
+  Write data to outpath, so that a reader sees either the old or the new
+  file but never a partially written file.
+  """
+  f = AtomicFile(outpath)
+  try:
+    f.write(data)
+  except:
+    f.discard()
+    raise
+  f.commit()
+
+def gzip_stream(fout):
+  """
+  Return a file-like object which writes gzip compressed data to fout.
+  The header timestamp is zeroed so the output only depends on the data.
+  """
+  return gzip.GzipFile(fileobj = fout, mode = 'wb', compresslevel = 9, mtime = 0)
+
+def gzip_data(data):
+  """
+  Compress data with gzip.
+  """
+  buf = StringIO()
+  gz = gzip_stream(buf)
+  gz.write(data)
+  gz.close()
+  return buf.getvalue()
+
+class BrotliStream(object):
+  """
+  A file-like object which writes brotli compressed data to fout.
+  """
+
+  def __init__(self, fout):
+    self.fout = fout
+    self.compressor = brotli.Compressor()
+
+  def write(self, data):
+    self.fout.write(self.compressor.process(data))
+
+  def close(self):
+    self.fout.write(self.compressor.finish())
 
 class WebJSONEncoder(JSONEncoder):
   """JSON Encoder for DC Metro Metrics data types.
@@ -38,46 +142,259 @@ class WebJSONEncoder(JSONEncoder):
     return JSONEncoder.default(self, o)
 
 
+def iter_json_array(items, cls = WebJSONEncoder):
+  """
+  Encode an iterable as a json array, one element at a time.
+  Yields the same text as dumps(list(items), cls = cls), without
+  holding all of the items or the full string in memory.
+  """
+  encoder = cls()
+  yield '['
+  first = True
+  for item in items:
+    if not first:
+      yield encoder.item_separator
+    first = False
+    yield encoder.encode(item)
+  yield ']'
+
+
+# Raw document projections for the bulk writers.
+UNIT_STATUS_WEB_JSON = WebJSONProjection(UnitStatus)
+HOT_CAR_REPORT_WEB_JSON = WebJSONProjection(HotCarReport)
+
+def statuses_web_json(statuses):
+  """
+  Convert loaded UnitStatus documents to their web json dicts,
+  reading the document data directly.
+  """
+  for s in statuses:
+    yield UNIT_STATUS_WEB_JSON.convert_document(s) if isinstance(s, UnitStatus) else s
+
+
 class JSONWriter(object):
   """Write Unit and Station JSON static files.
   """
 
-  def __init__(self, basedir = None):
+  def __init__(self, basedir = None, write_gzip = True, write_brotli = False):
+    """
+    write_gzip: Write a precompressed .gz copy next to each file.
+    write_brotli: Write a precompressed .br copy next to each file.
+                  Requires the brotli module.
+    """
     self.basedir = os.path.abspath(basedir) if basedir else os.getcwd()
+    self.write_gzip = write_gzip
+    self.write_brotli = write_brotli
+    if write_brotli and brotli is None:
+      raise ImportError('write_brotli requires the brotli module.')
+    self._digests = {} # path -> sha1 of the last content written
+    self.num_written = 0
+    self.num_skipped = 0
+
+  def _compressed_paths(self, outpath):
+    """
+    Return (path, compress function, stream constructor) for each compressed copy.
+    """
+    ret = []
+    if self.write_gzip:
+      ret.append((outpath + '.gz', gzip_data, gzip_stream))
+    if self.write_brotli:
+      ret.append((outpath + '.br', brotli.compress, BrotliStream))
+    return ret
+
+  def _file_digest(self, path):
+    if not os.path.exists(path):
+      return None
+    with open(path, 'rb') as f:
+      return hashlib.sha1(f.read()).hexdigest()
+
+  def _is_unchanged(self, outpath, digest, compressed):
+    last_digest = self._digests.get(outpath, None)
+    if last_digest is None:
+      last_digest = self._file_digest(outpath)
+    if digest == last_digest and os.path.exists(outpath) and \
+       all(os.path.exists(c[0]) for c in compressed):
+      self._digests[outpath] = digest
+      self.num_skipped += 1
+      return True
+    return False
+
+  def write_file(self, outdir, fname, jdata):
+    """
+    Write json data to outdir/fname, along with its compressed copies.
+    The files are not rewritten if the content has not changed.
+    Return True if the files were written.
+    """
+    mkdir_p(outdir)
+    outpath = os.path.join(outdir, fname)
 
-  def write_unit(self, unit, statuses = None):
+    if isinstance(jdata, unicode):
+      jdata = jdata.encode('utf-8')
 
-    # Get the key statuses
-    unit.statuses = statuses if statuses else unit.get_statuses() # Attach the statuses to the unit so they are written.
+    digest = hashlib.sha1(jdata).hexdigest()
+    compressed = self._compressed_paths(outpath)
+    if self._is_unchanged(outpath, digest, compressed):
+      return False
 
-    data = unit;
-    
-    jdata = dumps(data, cls = WebJSONEncoder)
+    # Write the compressed copies first, so that they are never older than the file.
+    for path, compress, stream in compressed:
+      write_atomic(path, compress(jdata))
+    write_atomic(outpath, jdata)
+    self._digests[outpath] = digest
+    self.num_written += 1
+    return True
 
-    # Create the directory if necessary
-    outdir = os.path.join(self.basedir, 'json', 'units')
+  def write_file_stream(self, outdir, fname, chunks):
+    """
+    Write an iterable of json text chunks (e.g. from iter_json_array) to outdir/fname,
+    along with its compressed copies. The chunks are written to temporary files as
+    they are produced, which replace the files at the end unless the content has not changed.
+    Return True if the files were written.
+    """
     mkdir_p(outdir)
-
-    fname = '%s.json'%(unit.unit_id)
     outpath = os.path.join(outdir, fname)
+    compressed = self._compressed_paths(outpath)
+
+    sha1 = hashlib.sha1()
+    files = []
+    try:
+      fout = AtomicFile(outpath)
+      files.append(fout)
+      streams = []
+      for path, compress, stream in compressed:
+        f = AtomicFile(path)
+        files.append(f)
+        streams.append(stream(f))
+
+      for chunk in chunks:
+        if isinstance(chunk, unicode):
+          chunk = chunk.encode('utf-8')
+        sha1.update(chunk)
+        fout.write(chunk)
+        for s in streams:
+          s.write(chunk)
+      for s in streams:
+        s.close()
+    except:
+      for f in files:
+        f.discard()
+      raise
+
+    digest = sha1.hexdigest()
+    if self._is_unchanged(outpath, digest, compressed):
+      for f in files:
+        f.discard()
+      return False
+
+    # Commit the compressed copies first, so that they are never older than the file.
+    for f in files[1:] + files[:1]:
+      f.commit()
+    self._digests[outpath] = digest
+    self.num_written += 1
+    return True
+
+  def _unit_history_dir(self, unit_id):
+    return os.path.join(self.basedir, 'json', 'units', unit_id)
+
+  def _read_unit_manifest(self, unit_id):
+    """
+    Read the history manifest from the unit summary file written previously.
+    Return None if there is no summary file, or it has no manifest.
+    """
+    path = os.path.join(self.basedir, 'json', 'units', '%s.json'%unit_id)
+    if not os.path.exists(path):
+      return None
+    try:
+      with open(path, 'rb') as f:
+        return json.load(f).get('history', None)
+    except ValueError:
+      return None
+
+  def write_unit_history(self, unit_id, statuses):
+    """
+    Write the history chunks for a unit: json/units/<unit_id>/<year>.json
+    holds the statuses which started in that year (UTC), in descending order of time.
+    statuses should be in descending order of time.
+
+    Chunks whose content has not changed are not rewritten.
+    Return the manifest entries for the chunks, in descending order of year.
+    """
+    year_to_statuses = defaultdict(list)
+    for s in statuses:
+      year_to_statuses[toUtc(s.time, allow_naive = True).year].append(s)
+
+    outdir = self._unit_history_dir(unit_id)
+    manifest = []
+    for year in sorted(year_to_statuses.keys(), reverse = True):
+      ss = year_to_statuses[year]
+      fname = '%i.json'%year
+      header = '{"unit_id": %s, "year": %i, "statuses": '%(dumps(unit_id), year)
+      self.write_file_stream(outdir, fname, chain([header], iter_json_array(statuses_web_json(ss)), ['}']))
+      manifest.append({'year' : year,
+                       'url' : '/json/units/%s/%s'%(unit_id, fname),
+                       'num_statuses' : len(ss),
+                       'first_time' : ss[-1].time,
+                       'last_time' : ss[0].time})
+    return manifest
 
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+  def write_unit(self, unit, statuses = None):
+    """
+    Write the json for a unit. The unit's status history is split into yearly
+    chunks (see write_unit_history), and json/units/<unit_id>.json holds the
+    unit summary (key statuses, performance summary) with a 'history' manifest
+    listing the chunks.
+
+    statuses: The full status history of the unit, in descending order of time.
+              If None, only the statuses in the most recent chunk of the existing
+              manifest (or newer) are loaded, and only those chunks are rewritten.
+    """
+    manifest = []
+    if statuses is None:
+      old_manifest = self._read_unit_manifest(unit.unit_id)
+      if old_manifest:
+        since_year = max(c['year'] for c in old_manifest)
+        statuses = unit.get_statuses_since(datetime.datetime(since_year, 1, 1, tzinfo = tzutc))
+        manifest = [c for c in old_manifest if c['year'] < since_year]
+      else:
+        statuses = unit.get_statuses()
+
+    manifest = self.write_unit_history(unit.unit_id, statuses) + manifest
+
+    data = unit.to_web_json()
+    data.pop('statuses', None)
+    data['history'] = manifest
+    jdata = dumps(data, cls = WebJSONEncoder)
 
-  def write_station_directory(self):
+    outdir = os.path.join(self.basedir, 'json', 'units')
+    fname = '%s.json'%(unit.unit_id)
+    self.write_file(outdir, fname, jdata)
 
-    sd = Station.get_station_directory()
+  def write_units(self):
+    """
+    Write json for all units, loading the statuses
+    for all units with a single query.
+    """
+    from ..eles.dbUtils import iter_unit_statuses
+    unit_id_to_unit = dict((unit.unit_id, unit) for unit in Unit.objects.no_cache())
+    for unit_id, statuses in iter_unit_statuses():
+      unit = unit_id_to_unit.pop(unit_id, None)
+      if unit is not None:
+        self.write_unit(unit, statuses)
+
+    # Units without any statuses
+    for unit in unit_id_to_unit.itervalues():
+      self.write_unit(unit, [])
+
+  def write_station_directory(self, units = None):
+    """
+    Write the station directory. If units is None, all units are loaded from the database.
+    """
+    sd = Station.get_station_directory(units = units)
     jdata = dumps(sd, cls = WebJSONEncoder)
 
-    # Create the directory if necessary
     outdir = os.path.join(self.basedir, 'json')
-    mkdir_p(outdir)
-
     fname = '%s.json'%('station_directory')
-    outpath = os.path.join(outdir, fname)
-
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    self.write_file(outdir, fname, jdata)
 
 
   def write_recent_updates(self):
@@ -85,52 +402,36 @@ class JSONWriter(object):
     Write a list of recent status changes
     """
 
-    recent = list(UnitStatus.objects.order_by('-time')[:20])
+    recent = list(UNIT_STATUS_WEB_JSON.find(sort = [('time', -1)], limit = 20))
     jdata = dumps(recent, cls = WebJSONEncoder)
 
-    # Create the directory if necessary
     outdir = os.path.join(self.basedir, 'json')
-    mkdir_p(outdir)
-
     fname = 'recent_updates.json'
-    outpath = os.path.join(outdir, fname)
-
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    self.write_file(outdir, fname, jdata)
 
   def write_hotcars(self):
     """
     Write all hot car reports
     """
-    recent = list(HotCarReport.objects.order_by('-time').select_related())
-    jdata = dumps(recent, cls = WebJSONEncoder)
-
-    # Create the directory if necessary
+    reports = HOT_CAR_REPORT_WEB_JSON.find(sort = [('time', -1)])
     outdir = os.path.join(self.basedir, 'json')
-    mkdir_p(outdir)
-
     fname = 'hotcar_reports.json'
-    outpath = os.path.join(outdir, fname)
-
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    self.write_file_stream(outdir, fname, iter_json_array(reports))
 
   def write_hotcars_by_day(self):
     """
     Write hot car counts by day.
     """
-    all_reports = list(HotCarReport.objects.order_by('time').select_related())
+    # Only the report times are needed, so the reports are not loaded or dereferenced.
     day_to_count = defaultdict(int)
-
-    for r in all_reports:
-      r.time.replace(tzinfo=tzutc)
+    for r in HotCarReport.objects.order_by('time').only('time').no_cache():
       day_to_count[r.time.date()] += 1
 
     day_to_temp = dict((t.date.date(), t.max_temp) for t in Temperature.objects.order_by('date'))
 
     # Create time series for both temperate and counts
-    first_day = all_reports[0].time.date()
-    last_day = all_reports[-1].time.date()
+    first_day = min(day_to_count)
+    last_day = max(day_to_count)
 
     def gen_days(s, e):
       d = s
@@ -148,15 +449,9 @@ class JSONWriter(object):
 
     jdata = dumps(ret, cls = WebJSONEncoder)
 
-    # Create the directory if necessary
     outdir = os.path.join(self.basedir, 'json')
-    mkdir_p(outdir)
-
     fname = 'hotcars_by_day.json'
-    outpath = os.path.join(outdir, fname)
-
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    self.write_file(outdir, fname, jdata)
 
   def write_daily_system_service_report(self, day = None, report = None):
 
@@ -175,15 +470,9 @@ class JSONWriter(object):
 
     jdata = dumps(ret, cls = WebJSONEncoder)
 
-    # Create the directory if necessary
     outdir = os.path.join(self.basedir, 'json', 'daily_system_service_reports')
-    mkdir_p(outdir)
-
     fname = '%s.json'%(day_string.replace('-', '_'))
-    outpath = os.path.join(outdir, fname)
-
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    self.write_file(outdir, fname, jdata)
 
 
 
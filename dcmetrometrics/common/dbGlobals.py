@@ -128,6 +128,20 @@ def connect():
     from mongoengine import connect
     connect('MetroEscalators', host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USERNAME, password=MONGODB_PASSWORD)
 
+def reconnect():
+    """
+    Reconnect to the database via mongoengine. This should be called in a forked
+    worker process, since the connection and the collections cached on the
+    document classes are inherited from the parent process and cannot be shared.
+    """
+    from mongoengine.connection import disconnect
+    from mongoengine.base.common import _document_registry
+    disconnect()
+    for doc_cls in _document_registry.itervalues():
+        if getattr(doc_cls, '_collection', None) is not None:
+            doc_cls._collection = None
+    connect()
+
 _G = None # Global object
 def G():
     """Return a shared global object which maintains the escalator and elevator directory in memory.
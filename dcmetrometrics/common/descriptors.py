@@ -8,6 +8,18 @@
 #              computed once on the first access. All future accesses
 #              returned the computed value. This is similar to using
 #              the @property decorator.
+#
+# ComputeOnceProfiler: Records cache hits, misses and compute time
+#              for each computeOnce property, when enabled with
+#              enable_profiling.
+
+import sys
+import time
+from collections import defaultdict
+
+# Marks an attribute which has not been set or computed. None and other
+# falsy values are valid attribute values.
+_NOT_SET = object()
 
 
 ######################################################
@@ -19,13 +31,13 @@ class setOnce(object):
         self.default = default
 
     def __get__(self, instance, cls):
-        if not instance:
+        if instance is None:
             raise AttributeError('Can only access property through instance')
         return getattr(instance, self.name, self.default)
 
     # Only allow the attribute to be set once
     def __set__(self, instance, value):
-        if not getattr(instance, self.name, None):
+        if getattr(instance, self.name, _NOT_SET) is _NOT_SET:
             setattr(instance, self.name, value)
             return
         raise AttributeError('Attribute is read-only.')
@@ -50,13 +62,18 @@ class computeOnce(object):
         self.fget = fget
 
     def __get__(self, instance, cls):
-        if not instance:
+        if instance is None:
             raise AttributeError('Can only access property through instance')
 
-        retVal = getattr(instance, self.name, None)
-        if retVal is None:
-            retVal = self.fget(instance)
+        retVal = getattr(instance, self.name, _NOT_SET)
+        if retVal is _NOT_SET:
+            if _profiler is None:
+                retVal = self.fget(instance)
+            else:
+                retVal = _profiler.compute(self.fget, instance)
             setattr(instance, self.name, retVal)
+        elif _profiler is not None:
+            _profiler.hit(self.fget, instance)
         return retVal
 
     def __set__(self, instance, value):
@@ -64,3 +81,78 @@ class computeOnce(object):
 
     def __delete__(self, instance):
         raise AttributeError('Attribute is read-only')
+
+
+######################################################
+# Profiling of computeOnce properties.
+#
+# Profiling is off by default. When enabled, every access to a computeOnce
+# property is counted as a hit (cached) or a miss (computed), and the time
+# spent computing is accumulated for each class and property. Compute times
+# are cumulative: they include the time of other properties computed
+# along the way.
+class ComputeOnceProfiler(object):
+
+    def __init__(self):
+        # (class name, property name) -> [hits, misses, compute seconds]
+        self.stats = defaultdict(lambda: [0, 0, 0.0])
+
+    def _key(self, fget, instance):
+        return (instance.__class__.__name__, fget.__name__)
+
+    def hit(self, fget, instance):
+        self.stats[self._key(fget, instance)][0] += 1
+
+    def compute(self, fget, instance):
+        start = time.time()
+        try:
+            return fget(instance)
+        finally:
+            stat = self.stats[self._key(fget, instance)]
+            stat[1] += 1
+            stat[2] += time.time() - start
+
+    def reset(self):
+        self.stats.clear()
+
+    def report(self, limit = None):
+        """
+        Return a table of the profiled properties, sorted by compute time.
+        """
+        rows = sorted(self.stats.iteritems(), key = lambda kv: kv[1][2], reverse = True)
+        if limit is not None:
+            rows = rows[:limit]
+        lines = ['%-50s %10s %10s %12s'%('property', 'hits', 'misses', 'seconds')]
+        for (cls_name, name), (hits, misses, seconds) in rows:
+            lines.append('%-50s %10i %10i %12.3f'%('%s.%s'%(cls_name, name), hits, misses, seconds))
+        return '\n'.join(lines)
+
+    def write(self, handle = sys.stdout, limit = None):
+        handle.write(self.report(limit) + '\n')
+
+_profiler = None
+
+def enable_profiling():
+    """
+    Start profiling computeOnce properties. Return the profiler.
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = ComputeOnceProfiler()
+    return _profiler
+
+def disable_profiling():
+    """
+    Stop profiling computeOnce properties. Return the profiler, with the
+    stats collected so far.
+    """
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    return profiler
+
+def get_profiler():
+    """
+    Return the active profiler, or None if profiling is not enabled.
+    """
+    return _profiler
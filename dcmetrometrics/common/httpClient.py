@@ -0,0 +1,203 @@
+"""
+common.httpClient
+
+A shared HTTP layer for the WMATA and Wunderground APIs.
+
+HttpClient: Makes GET requests through a transport which keeps connections
+            alive between ticks (a pooled requests.Session by default).
+            Failed requests are retried with jittered exponential backoff,
+            requests are made conditional (ETag/If-Modified-Since) when the
+            server supports it, and the latency of each endpoint is tracked.
+
+EndpointStats: Request counts and a rolling latency history for an endpoint.
+
+get_client: Return the HttpClient shared by this process.
+"""
+import time
+import random
+from collections import deque, OrderedDict
+from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .tickMetrics import monotonic, percentile
+
+import logging
+logger = logging.getLogger('HttpClient')
+
+DEFAULT_TIMEOUT = 10.0 # seconds
+DEFAULT_POOL_SIZE = 4
+
+# Response status codes which are retried.
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+# Exceptions which are retried.
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+def make_session(pool_size = DEFAULT_POOL_SIZE):
+    """
+    Make a requests.Session which keeps up to pool_size connections alive for each host.
+    Retries are handled by the HttpClient, so the adapter does not retry.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = 0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+###############################################################################
+class EndpointStats(object):
+    """
+    Request counts and recent latencies for an endpoint.
+    """
+
+    def __init__(self, history = 100):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.not_modified = 0
+        self.latencies = deque(maxlen = history)
+
+    def summary(self):
+        latencies = list(self.latencies)
+        return OrderedDict([('requests', self.requests),
+                            ('errors', self.errors),
+                            ('retries', self.retries),
+                            ('not_modified', self.not_modified),
+                            ('latency_p50', percentile(latencies, 50)),
+                            ('latency_p95', percentile(latencies, 95)),
+                            ('latency_last', latencies[-1] if latencies else None)])
+
+
+###############################################################################
+class HttpClient(object):
+    """
+    Make HTTP GET requests with retries, conditional requests and latency tracking.
+    """
+
+    def __init__(self, transport = None, retries = 2, backoff = 0.5, max_backoff = 8.0,
+                 conditional = True, sleep = time.sleep, rand = random.random):
+        """
+        transport: An object with the interface of requests.Session.request.
+                   Defaults to a pooled requests.Session.
+        retries: Number of times to retry a request after a connection error, a timeout,
+                 or a response with a status in RETRY_STATUS_CODES.
+        backoff: Delay before the first retry, in seconds. The delay doubles for each retry
+                 (up to max_backoff) and is jittered by +/- 50%.
+        conditional: If True, send If-None-Match/If-Modified-Since with requests to a
+                     url which has previously returned an ETag or Last-Modified header.
+        """
+        self.transport = transport if transport is not None else make_session()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.conditional = conditional
+        self.sleep = sleep
+        self.rand = rand
+        self.endpoint_stats = OrderedDict() # endpoint -> EndpointStats
+        self._validators = {} # request key -> (etag, last modified, response)
+
+    def _stats(self, endpoint):
+        stats = self.endpoint_stats.get(endpoint, None)
+        if stats is None:
+            stats = self.endpoint_stats[endpoint] = EndpointStats()
+        return stats
+
+    def _delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        return delay * (0.5 + self.rand())
+
+    @staticmethod
+    def _request_key(url, params):
+        return (url, tuple(sorted((params or {}).iteritems())))
+
+    def get(self, url, params = None, headers = None, timeout = DEFAULT_TIMEOUT,
+            endpoint = None, conditional = None):
+        """
+        Make a GET request and return the requests.Response.
+
+        endpoint: The name used for the latency statistics. Defaults to the host
+                  and path of the url. Pass a name for urls which contain secrets.
+        conditional: Override the client's conditional setting for this request.
+
+        If the server responds 304 Not Modified to a conditional request, the
+        previous response is returned with its not_modified attribute set to True.
+        The last response is returned if the retries are exhausted with a retryable
+        status code. Connection errors and timeouts are raised after the last retry.
+        """
+        if endpoint is None:
+            parsed = urlparse(url)
+            endpoint = parsed.netloc + parsed.path
+        if conditional is None:
+            conditional = self.conditional
+
+        stats = self._stats(endpoint)
+        headers = dict(headers or {})
+        key = self._request_key(url, params)
+        cached = self._validators.get(key, None) if conditional else None
+        if cached is not None:
+            etag, last_modified, cached_response = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        attempt = 0
+        while True:
+            stats.requests += 1
+            start = monotonic()
+            try:
+                r = self.transport.request('GET', url, params = params, headers = headers, timeout = timeout)
+            except RETRY_EXCEPTIONS as e:
+                stats.errors += 1
+                if attempt >= self.retries:
+                    raise
+                logger.warning('Request to %s failed: %s. Retrying.'%(endpoint, str(e)))
+            else:
+                stats.latencies.append(monotonic() - start)
+                if r.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    break
+                stats.errors += 1
+                logger.warning('Request to %s returned status %i. Retrying.'%(endpoint, r.status_code))
+            stats.retries += 1
+            self.sleep(self._delay(attempt))
+            attempt += 1
+
+        if r.status_code == requests.codes.not_modified and cached is not None:
+            stats.not_modified += 1
+            cached_response.not_modified = True
+            return cached_response
+
+        r.not_modified = False
+        if conditional and r.status_code == requests.codes.ok:
+            etag = r.headers.get('ETag', None)
+            last_modified = r.headers.get('Last-Modified', None)
+            if etag or last_modified:
+                self._validators[key] = (etag, last_modified, r)
+            else:
+                self._validators.pop(key, None)
+        return r
+
+    def stats(self):
+        """
+        Return a json serializable summary of the endpoint statistics.
+        """
+        return OrderedDict((endpoint, s.summary()) for endpoint, s in self.endpoint_stats.iteritems())
+
+    def close(self):
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
+
+
+_client = None
+def get_client():
+    """
+    Return the HttpClient shared by the APIs in this process.
+    """
+    global _client
+    if _client is None:
+        _client = HttpClient()
+    return _client
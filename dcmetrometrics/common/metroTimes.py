@@ -4,9 +4,10 @@ common.metroTimes
 Utilities for determining opening/closing time
 of Metrorail system
 
-TODO: Make this module correct for daylights saving time:
-wdToOpenHours will not be correct on the two days a year when
-daylight savings starts/ends. This is a low impact bug.
+Metro open time is computed from a table of cumulative open time per
+metro day (MetroOpenTable). Opening and closing times are converted to
+UTC when the table is built, so the open time is correct on the days
+when daylight savings time starts/ends.
 """
 
 ##################################################
@@ -15,6 +16,7 @@ from dateutil.tz import tzlocal, tzutc
 from dateutil import zoneinfo
 from dateutil import parser 
 from .descriptors import setOnce, computeOnce
+import numpy as np
 
 nytz = zoneinfo.gettz("America/New_York")
 tzny = nytz 
@@ -123,6 +125,125 @@ def metroIsOpen(t):
     lastOpen = getLastOpenTime(t)
     return (lastOpen > lastClose)
 
+##################################################
+# Cumulative metro open time table
+#
+# Metro day k is the time range between the opening on the k-th day
+# since the epoch and the next opening. The table stores the UTC opening
+# and closing time of each metro day, and the total metro open time
+# before each metro day. The open time of a time range is the difference
+# of the cumulative open time at the end and the start.
+
+EPOCH = datetime(1970, 1, 1, tzinfo = tzutc)
+EPOCH_DATE = EPOCH.date()
+US_PER_SECOND = 10**6
+US_PER_DAY = 86400 * US_PER_SECOND
+
+# The metro opens between 9 and 12 hours after midnight UTC of the same date.
+_MIN_OPEN_OFFSET = 9 * 3600 * US_PER_SECOND
+
+def toEpochMicros(dt):
+    """
+    Convert a non-naive datetime to microseconds since the epoch.
+    """
+    if isNaive(dt):
+        raise RuntimeError('toEpochMicros: datetime cannot be naive')
+    td = dt - EPOCH
+    return (td.days * 86400 + td.seconds) * US_PER_SECOND + td.microseconds
+
+class MetroOpenTable(object):
+    """
+    Table of metro opening and closing times, and cumulative metro open
+    time, indexed by metro day. All times are microseconds since the epoch.
+    The table is extended as needed.
+    """
+
+    def __init__(self, first_day = date(2010, 1, 1), last_day = date(2030, 1, 1)):
+        self._build(first_day, last_day)
+
+    def _build(self, first_day, last_day):
+        numDays = (last_day - first_day).days
+        days = [first_day + timedelta(days = i) for i in range(numDays)]
+        opens = [toEpochMicros(dateToOpen(d)) for d in days]
+        closes = [toEpochMicros(dateToClose(d)) for d in days]
+        cumulative = [0]
+        for o, c in zip(opens, closes):
+            cumulative.append(cumulative[-1] + c - o)
+
+        # When the table is extended, keep the cumulative open time consistent
+        # with the previous table, so differences remain valid.
+        if getattr(self, 'cumulative', None):
+            offset = self.cumulative[0] - cumulative[(self.first_day - first_day).days]
+            cumulative = [c + offset for c in cumulative]
+
+        self.first_day = first_day
+        self.last_day = last_day
+        self.first_index = (first_day - EPOCH_DATE).days
+        self.opens = opens
+        self.closes = closes
+        self.cumulative = cumulative[:-1]
+        self.opensArray = np.array(opens, dtype = np.int64)
+        self.closesArray = np.array(closes, dtype = np.int64)
+        self.cumulativeArray = np.array(self.cumulative, dtype = np.int64)
+
+    def _extend(self, minIndex, maxIndex):
+        first_day = min(self.first_day, EPOCH_DATE + timedelta(days = minIndex - 365))
+        last_day = max(self.last_day, EPOCH_DATE + timedelta(days = maxIndex + 365))
+        self._build(first_day, last_day)
+
+    def openTimeBefore(self, t):
+        """
+        Return the total metro open time (in microseconds) before time t
+        (in microseconds since the epoch), counted from the start of the table.
+        """
+        i = (t - _MIN_OPEN_OFFSET) // US_PER_DAY - self.first_index
+        if i < 1 or i >= len(self.opens):
+            self._extend(i + self.first_index, i + self.first_index)
+            i = (t - _MIN_OPEN_OFFSET) // US_PER_DAY - self.first_index
+        if self.opens[i] > t:
+            i -= 1
+        o = self.opens[i]
+        return self.cumulative[i] + min(max(t - o, 0), self.closes[i] - o)
+
+    def openTimesBefore(self, t):
+        """
+        Vectorized openTimeBefore for an array of times.
+        """
+        t = np.asarray(t, dtype = np.int64)
+        i = (t - _MIN_OPEN_OFFSET) // US_PER_DAY - self.first_index
+        if i.size and (i.min() < 1 or i.max() >= len(self.opens)):
+            self._extend(i.min() + self.first_index, i.max() + self.first_index)
+            i = (t - _MIN_OPEN_OFFSET) // US_PER_DAY - self.first_index
+        opens = self.opensArray
+        i = i - (opens[i] > t)
+        o = opens[i]
+        return self.cumulativeArray[i] + np.minimum(np.maximum(t - o, 0), self.closesArray[i] - o)
+
+_metroOpenTable = None
+
+def getMetroOpenTable():
+    global _metroOpenTable
+    if _metroOpenTable is None:
+        _metroOpenTable = MetroOpenTable()
+    return _metroOpenTable
+
+def metroOpenSeconds(start, end):
+    """
+    Return the metro open time (in seconds) between start and end,
+    which are microseconds since the epoch.
+    """
+    table = getMetroOpenTable()
+    return (table.openTimeBefore(end) - table.openTimeBefore(start))/1E6
+
+def metroOpenSecondsArray(start, end):
+    """
+    Return the metro open time (in seconds) for arrays of start and end
+    times, which are microseconds since the epoch.
+    """
+    table = getMetroOpenTable()
+    return (table.openTimesBefore(end) - table.openTimesBefore(start))/1E6
+
+##################################################
 class TimeRange(object):
 
     start = setOnce("start")
@@ -143,6 +264,13 @@ class TimeRange(object):
         
     @computeOnce
     def metroOpenTime(self):
+        return metroOpenSeconds(toEpochMicros(self.start), toEpochMicros(self.end))
+
+    ###################################################
+    # Previous implementation of metroOpenTime, kept for reference.
+    # This uses wall clock time, so it is off by an hour on the days
+    # when daylight savings time starts/ends.
+    def metroOpenTime_NODST(self):
         start = self.start
         end  = self.end
         secOpen = 0.0
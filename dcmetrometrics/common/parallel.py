@@ -0,0 +1,118 @@
+"""
+common.parallel
+
+Helpers to run batch jobs over escalators/elevators in a pool of worker
+processes. Units are independent, so the unit ids are split into shards
+and each worker process handles one shard with its own database connection.
+
+Checkpoint: Records the units which have been completed, so that a job
+            can resume after a crash.
+"""
+import os
+import json
+import multiprocessing
+
+from . import dbGlobals
+
+def shard(items, num_shards):
+    """
+    Split items into num_shards lists of (nearly) equal size.
+    """
+    items = list(items)
+    return [items[i::num_shards] for i in range(num_shards)]
+
+def init_worker():
+    """
+    Initialize a worker process with its own database connection.
+    """
+    dbGlobals.reconnect()
+
+def run_sharded(func, items, workers = 1, args = (), initializer = init_worker):
+    """
+    Call func(shard, *args) for each shard of items and return the list of results.
+
+    If workers > 1, the shards are processed by a pool of worker processes,
+    each set up by calling initializer. func must be a module level function.
+    Otherwise, func is called once with all items in this process.
+    """
+    if workers <= 1:
+        return [func(list(items), *args)]
+
+    pool = multiprocessing.Pool(workers, initializer = initializer)
+    try:
+        async_results = [pool.apply_async(func, (s,) + tuple(args)) for s in shard(items, workers)]
+        pool.close()
+        # Use a timeout so that the main process still responds to KeyboardInterrupt
+        results = [r.get(1E9) for r in async_results]
+        pool.join()
+    except:
+        pool.terminate()
+        raise
+    return results
+
+
+###############################################################################
+class Checkpoint(object):
+    """
+    A file recording the units completed by a job, one json record per line.
+    Records are appended as units complete, so the file is safe to share
+    between worker processes. Phases of the job which run before the units
+    (see mark_phase) are recorded in the same file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Ignore a partially written record from a crash.
+                    continue
+
+    def completed(self):
+        """
+        Return a dictionary from unit_id to the record for each completed unit.
+        """
+        return dict((rec['unit_id'], rec) for rec in self._records() if 'unit_id' in rec)
+
+    def completed_phases(self):
+        """
+        Return the set of names of the completed phases.
+        """
+        return set(rec['phase'] for rec in self._records() if 'phase' in rec)
+
+    def mark(self, unit_id, **kwargs):
+        """
+        Record that a unit is complete, with additional json serializable data.
+        """
+        rec = dict(kwargs)
+        rec['unit_id'] = unit_id
+        self._append(rec)
+
+    def mark_phase(self, phase):
+        """
+        Record that a phase of the job is complete.
+        """
+        self._append({'phase' : phase})
+
+    def _append(self, rec):
+        line = json.dumps(rec) + '\n'
+        # A single small write in append mode is atomic, so records from
+        # different processes are not interleaved.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def remove(self):
+        """
+        Remove the checkpoint file once the job has finished.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
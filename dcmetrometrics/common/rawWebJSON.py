@@ -0,0 +1,154 @@
+"""
+common.rawWebJSON
+
+A fast path for the bulk JSON writers, which reads raw documents with pymongo
+instead of hydrating mongoengine documents and calling to_web_json.
+
+WebJSONProjection builds, from a model's web_json_fields and field definitions,
+the database projection and the conversion of each raw document to the dict
+that to_web_json would return, with datetimes already formatted as the
+WebJSONEncoder formats them. Referenced documents are loaded in batches.
+The json encoded by WebJSONEncoder is byte identical to the json of the documents.
+"""
+from datetime import datetime
+
+from bson.dbref import DBRef
+from mongoengine.fields import (DateTimeField, FloatField, IntField, LongField,
+                                ReferenceField, StringField, BooleanField)
+
+def format_datetime(t):
+  """
+  Format a datetime as WebJSONEncoder does. Naive datetimes are in UTC.
+  """
+  if t.tzinfo is not None and t.utcoffset():
+    return t.isoformat()
+  if t.microsecond:
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%06d+00:00'%(t.year, t.month, t.day,
+                                                       t.hour, t.minute, t.second, t.microsecond)
+  return '%04d-%02d-%02dT%02d:%02d:%02d+00:00'%(t.year, t.month, t.day, t.hour, t.minute, t.second)
+
+def _to_datetime(v):
+  return format_datetime(v) if isinstance(v, datetime) else v
+
+def _to_float(v):
+  return float(v) if v is not None else v
+
+def _to_int(v):
+  return int(v) if v is not None else v
+
+def _to_long(v):
+  return long(v) if v is not None else v
+
+def _to_ref_id(v):
+  return v.id if isinstance(v, DBRef) else v
+
+def _identity(v):
+  return v
+
+# Conversion of a raw value to the value in the web json, by field type.
+_CONVERTERS = [(DateTimeField, _to_datetime),
+               (FloatField, _to_float),
+               (LongField, _to_long),
+               (IntField, _to_int),
+               (BooleanField, _identity),
+               (StringField, _identity),
+               (ReferenceField, _to_ref_id)]
+
+_MISSING = object()
+
+class WebJSONProjection(object):
+  """
+  Convert raw documents of a model to the dicts returned by its to_web_json.
+  """
+
+  def __init__(self, doc_cls):
+    self.doc_cls = doc_cls
+    self.columns = [] # (name, field name, db_field, converter, default)
+    self.references = {} # name -> WebJSONProjection of the referenced model
+    for name in doc_cls.web_json_fields:
+      field_name = doc_cls._meta['id_field'] if name == 'id' else name
+      field = doc_cls._fields.get(field_name, None)
+      converter = None
+      for field_type, f in _CONVERTERS:
+        if isinstance(field, field_type):
+          converter = f
+          break
+      if converter is None:
+        raise ValueError('%s.%s is not supported by WebJSONProjection'%(doc_cls.__name__, name))
+      if isinstance(field, ReferenceField):
+        self.references[name] = WebJSONProjection(field.document_type)
+      default = field.default
+      if callable(default):
+        default = None
+      elif default is not None:
+        default = converter(default)
+      self.columns.append((name, field_name, field.db_field, converter, default))
+    self.fields = [c[2] for c in self.columns]
+
+  def convert(self, son):
+    """
+    Convert a raw document. Referenced documents are left as ids.
+    A missing field takes its default value, as in a mongoengine document.
+    """
+    ret = {}
+    for name, field_name, db_field, converter, default in self.columns:
+      v = son.get(db_field, _MISSING)
+      if v is _MISSING:
+        ret[name] = default
+      else:
+        ret[name] = converter(v) if v is not None else None
+    return ret
+
+  def resolve(self, docs):
+    """
+    Replace the ids of referenced documents in a list of converted documents
+    with the converted referenced documents, with one query per reference field.
+    """
+    for name, projection in self.references.iteritems():
+      ids = set(d[name] for d in docs if d[name] is not None)
+      id_to_doc = projection.find_by_ids(ids) if ids else {}
+      for d in docs:
+        d[name] = id_to_doc.get(d[name], None)
+    return docs
+
+  def find_by_ids(self, ids):
+    """
+    Return a dict from id to converted document, for the documents with the given ids.
+    """
+    collection = self.doc_cls._get_collection()
+    docs = list(collection.find({'_id' : {'$in' : list(ids)}}, fields = self.fields + ['_id']))
+    converted = self.resolve([self.convert(d) for d in docs])
+    return dict((d['_id'], c) for d, c in zip(docs, converted))
+
+  def find(self, spec = None, sort = None, limit = 0, batch_size = 500):
+    """
+    Query the model's collection, and yield the converted documents.
+    References are resolved one batch of batch_size documents at a time.
+    """
+    collection = self.doc_cls._get_collection()
+    cursor = collection.find(spec or {}, fields = self.fields, sort = sort, limit = limit)
+    cursor.batch_size(batch_size)
+    batch = []
+    try:
+      for son in cursor:
+        batch.append(self.convert(son))
+        if len(batch) >= batch_size:
+          for d in self.resolve(batch):
+            yield d
+          batch = []
+      for d in self.resolve(batch):
+        yield d
+    finally:
+      cursor.close()
+
+  def convert_document(self, doc):
+    """
+    Convert a mongoengine document which has already been loaded.
+    Referenced documents are not supported.
+    """
+    ret = {}
+    data = doc._data
+    for name, field_name, db_field, converter, default in self.columns:
+      v = data.get(field_name, None)
+      ret[name] = converter(v) if v is not None else None
+    return ret
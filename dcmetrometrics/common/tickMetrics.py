@@ -0,0 +1,284 @@
+"""
+common.tickMetrics
+
+Lightweight instrumentation for the app ticks.
+
+TickProfiler: Times the phases of a tick with context managed spans, and
+              counts the MongoDB operations made in each span. Keeps a
+              rolling history of the last N ticks for each phase, which is
+              summarized as p50/p95 and periodically written to a JSON
+              metrics file.
+
+monotonic: A monotonic clock (in seconds) for timing spans.
+
+install_mongo_op_counter: Count the messages pymongo sends to the server.
+              pymongo 2.6 has no command monitoring, so the client's send
+              methods are wrapped. Messages are also counted by greenlet, so
+              that the spans of a tick do not count the database operations
+              of worker greenlets (such as the JSONPublisher) which run during
+              the tick.
+"""
+import os
+import json
+import time
+import weakref
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+import logging
+
+from gevent import getcurrent
+
+from .metroTimes import utcnow
+
+###############################################################################
+# Monotonic clock. Python 2 does not provide time.monotonic, so use
+# clock_gettime(CLOCK_MONOTONIC) where it is available.
+
+def _make_monotonic():
+    try:
+        import ctypes, ctypes.util
+        CLOCK_MONOTONIC = 1 # Linux
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno = True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return t.tv_sec + t.tv_nsec * 1E-9
+
+        monotonic()
+        return monotonic
+
+    except Exception:
+        return time.time
+
+monotonic = _make_monotonic()
+
+
+###############################################################################
+# Mongo operation counts
+
+_mongo_op_count = [0]
+_greenlet_op_counts = weakref.WeakKeyDictionary() # greenlet -> messages sent by the greenlet
+
+def mongo_op_count():
+    """
+    Return the number of messages sent to MongoDB by this process, if
+    install_mongo_op_counter has been called.
+    """
+    return _mongo_op_count[0]
+
+def greenlet_mongo_op_count():
+    """
+    Return the number of messages sent to MongoDB by the current greenlet, if
+    install_mongo_op_counter has been called.
+    """
+    return _greenlet_op_counts.get(getcurrent(), 0)
+
+def _counted(method):
+    def wrapper(*args, **kwargs):
+        _mongo_op_count[0] += 1
+        g = getcurrent()
+        _greenlet_op_counts[g] = _greenlet_op_counts.get(g, 0) + 1
+        return method(*args, **kwargs)
+    wrapper._counted = True
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+def install_mongo_op_counter():
+    """
+    Wrap the pymongo client methods which send messages to the server,
+    so that each query, getmore, command and write is counted.
+    This is safe to call more than once.
+    """
+    from pymongo.mongo_client import MongoClient
+    from pymongo.mongo_replica_set_client import MongoReplicaSetClient
+    for cls in (MongoClient, MongoReplicaSetClient):
+        for name in ('_send_message', '_send_message_with_response'):
+            method = getattr(cls, name)
+            if not getattr(method, '_counted', False):
+                setattr(cls, name, _counted(method))
+
+
+###############################################################################
+def percentile(values, p):
+    """
+    Return the p-th percentile (0 <= p <= 100) of a list of values,
+    using the nearest rank.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(p/100.0 * (len(values) - 1)))
+    return values[rank]
+
+class TickProfiler(object):
+    """
+    Record the time and the number of MongoDB operations spent in each phase of a tick.
+
+    Usage:
+
+        profiler = TickProfiler('ELESApp', metrics_path = path)
+        with profiler.tick():
+            with profiler.span('fetch'):
+                ...
+
+    A phase may run several times in a tick, in which case its times are added.
+    Spans may be nested. A phase which does not run in a tick is not recorded
+    for that tick.
+
+    A span counts the MongoDB operations of its own greenlet. Spans in other
+    greenlets are recorded on their own, rather than in the tick in progress.
+
+    Counters (such as the number of ticks skipped) are kept for the life of the profiler.
+    """
+
+    TOTAL = 'total'
+
+    def __init__(self, name, history = 100, metrics_path = None, write_interval = 10):
+        """
+        name: Name of the app. Reports are logged to the logger with this name.
+        history: Number of ticks to keep for each phase.
+        metrics_path: JSON file to write the metrics to.
+        write_interval: Write the metrics file and log a report every write_interval ticks.
+        """
+        self.name = name
+        self.logger = logging.getLogger(name)
+        self.history = history
+        self.metrics_path = metrics_path
+        self.write_interval = write_interval
+        self.num_ticks = 0
+        self.phases = OrderedDict() # phase -> deque of (seconds, mongo ops) for the last ticks
+        self._current = None # phase -> [seconds, mongo ops] for the tick in progress
+        self._tick_greenlet = None # The greenlet running the tick in progress
+        self.counters = OrderedDict() # name -> count
+        install_mongo_op_counter()
+
+    def count(self, name, n = 1):
+        """
+        Increment a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def _record(self, phase, seconds, ops):
+        if self._current is not None and getcurrent() is self._tick_greenlet:
+            rec = self._current.setdefault(phase, [0.0, 0])
+            rec[0] += seconds
+            rec[1] += ops
+        else:
+            self._add(phase, seconds, ops)
+
+    def _add(self, phase, seconds, ops):
+        if phase not in self.phases:
+            self.phases[phase] = deque(maxlen = self.history)
+        self.phases[phase].append((seconds, ops))
+
+    @contextmanager
+    def span(self, phase):
+        """
+        Time a phase of the tick.
+        """
+        start = monotonic()
+        start_ops = greenlet_mongo_op_count()
+        try:
+            yield
+        finally:
+            self._record(phase, monotonic() - start, greenlet_mongo_op_count() - start_ops)
+
+    @contextmanager
+    def tick(self):
+        """
+        Time a tick. The spans recorded during the tick are added to the history
+        when the tick finishes, along with the total for the tick.
+        """
+        self._current = OrderedDict()
+        self._tick_greenlet = getcurrent()
+        try:
+            with self.span(self.TOTAL):
+                yield
+        finally:
+            current, self._current = self._current, None
+            self._tick_greenlet = None
+            # Record the total last.
+            total = current.pop(self.TOTAL)
+            for phase, (seconds, ops) in current.iteritems():
+                self._add(phase, seconds, ops)
+            self._add(self.TOTAL, *total)
+            self.num_ticks += 1
+            if self.write_interval and self.num_ticks % self.write_interval == 0:
+                self.flush()
+
+    def summarize(self, phase):
+        """
+        Summarize the history of a phase.
+        """
+        records = self.phases.get(phase, ())
+        seconds = [s for s, ops in records]
+        ops = [o for s, o in records]
+        n = len(seconds)
+        return OrderedDict([('n', n),
+                            ('p50', percentile(seconds, 50)),
+                            ('p95', percentile(seconds, 95)),
+                            ('max', max(seconds) if seconds else None),
+                            ('mean', sum(seconds)/n if n else None),
+                            ('last', seconds[-1] if seconds else None),
+                            ('mongo_ops_p50', percentile(ops, 50)),
+                            ('mongo_ops_p95', percentile(ops, 95)),
+                            ('mongo_ops_last', ops[-1] if ops else None)])
+
+    def summary(self):
+        """
+        Return a json serializable summary of all phases.
+        """
+        phases = OrderedDict((phase, self.summarize(phase)) for phase in self.phases)
+        return OrderedDict([('name', self.name),
+                            ('time', utcnow().isoformat()),
+                            ('num_ticks', self.num_ticks),
+                            ('history', self.history),
+                            ('counters', self.counters),
+                            ('phases', phases)])
+
+    def report(self):
+        """
+        Return a table of the phase summaries, for logging.
+        """
+        lines = ['%s tick metrics over the last %i ticks:'%(self.name, min(self.num_ticks, self.history)),
+                 '%-24s %5s %9s %9s %9s %8s %8s'%('phase', 'n', 'p50', 'p95', 'max', 'ops_p50', 'ops_p95')]
+        for phase in self.phases:
+            d = self.summarize(phase)
+            lines.append('%-24s %5i %9.3f %9.3f %9.3f %8i %8i'%(phase, d['n'], d['p50'], d['p95'],
+                          d['max'], d['mongo_ops_p50'], d['mongo_ops_p95']))
+        if self.counters:
+            lines.append(', '.join('%s: %i'%(k, v) for k, v in self.counters.iteritems()))
+        return '\n'.join(lines)
+
+    def write(self, path = None):
+        """
+        Write the summary to a JSON file. The file is replaced atomically.
+        """
+        path = path or self.metrics_path
+        if not path:
+            return
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.summary(), f, indent = 2)
+        os.rename(tmp_path, path)
+
+    def flush(self):
+        """
+        Log a report and write the metrics file. Errors writing the file are logged,
+        so that metrics never break a tick.
+        """
+        self.logger.info(self.report())
+        try:
+            self.write()
+        except (IOError, OSError) as e:
+            self.logger.error('Could not write tick metrics to %s: %s'%(self.metrics_path, str(e)))
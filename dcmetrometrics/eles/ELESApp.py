@@ -29,12 +29,16 @@ from ..common import dbGlobals, twitterUtils, utils, stations
 from ..common.metroTimes import utcnow, tzutc, metroIsOpen, toLocalTime, isNaive
 from ..common.globals import DATA_DIR, WWW_DIR
 from ..common.JSONifier import JSONWriter
+from ..common.JSONPublisher import JSONPublisher
+from ..common.tickMetrics import TickProfiler
 import dbUtils
 from .dbUtils import invert_dict, update_db_from_incident
 from .models import KeyStatuses, UnitStatus, SymptomCode, Unit, EscalatorAppState
+from .PerformanceTracker import PerformanceTracker, verify_unit
+from .UnitStateCache import UnitStateCache
 from ..keys import WMATA_API_KEY
 from twitter import TwitterError
-from .Incident import Incident
+from .Incident import Incident, incidents_digest
 from .WMATA_API import WMATA_API_ERROR, WMATA_API
 from .defs import symptomToCategory, OPERATIONAL_CODE as OP_CODE
 
@@ -49,6 +53,19 @@ MAX_TICK_TWEETS = 10
 
 PERFORMANCE_SUMMARY_INTERVAL = timedelta(hours = 4)
 
+# Minimum number of seconds between rounds of json file writes.
+JSON_PUBLISH_INTERVAL = 10.0
+
+# Tick metrics are kept for the last TICK_METRICS_HISTORY ticks, and written
+# to TICK_METRICS_FILE every TICK_METRICS_INTERVAL ticks.
+TICK_METRICS_HISTORY = 200
+TICK_METRICS_INTERVAL = 10
+TICK_METRICS_FILE = os.path.join(DATA_DIR, 'ELESApp.metrics.json')
+
+# If True, check each incrementally computed performance summary against
+# a full recompute with Unit.compute_performance_summary. This is slow.
+VERIFY_PERFORMANCE_SUMMARIES = False
+
 def url_maker(unit_id):
     url = "http://www.dcmetrometrics.com/unit/{unit_id}"
     return url.format(unit_id = unit_id)
@@ -134,6 +151,31 @@ class ELESApp(object):
 
         self.json_writer = JSONWriter(WWW_DIR)
 
+        # Running performance summary accumulators for each unit.
+        self.performance_tracker = PerformanceTracker()
+
+        # Last symptom and key statuses for each unit, loaded on the first tick.
+        self.unit_state_cache = UnitStateCache()
+
+        # Time and database operations spent in each phase of the tick.
+        self.profiler = TickProfiler('ELESApp',
+                                     history = TICK_METRICS_HISTORY,
+                                     metrics_path = TICK_METRICS_FILE,
+                                     write_interval = TICK_METRICS_INTERVAL)
+
+        # unit_id -> Unit, from the last performance summary pass and updated with the
+        # changed units. Used to build the station directory without loading all units.
+        self.unit_directory = None
+
+        # Digest of the incidents from the last tick that was processed.
+        self.last_incidents_digest = None
+
+        # Write the json for changed units and the station directory outside of the tick.
+        self.json_publisher = JSONPublisher(self.json_writer,
+                                            min_interval = JSON_PUBLISH_INTERVAL,
+                                            profiler = self.profiler)
+        self.json_publisher.start()
+
     def getTwitterApi(self):
 
         if not self.LIVE:
@@ -155,7 +197,71 @@ class ELESApp(object):
     def checkWMATAKey(self):
         checkWMATAKey()
 
+    def update_performance_summary(self, unit, statuses, end_time):
+        """
+        Update and save the unit's performance summary using the performance tracker.
+        In verification mode, the summary is also checked against a full recompute.
+        statuses: The unit's status history, or None if the unit is in the tracker.
+        """
+        tracker = self.performance_tracker
+
+        if VERIFY_PERFORMANCE_SUMMARIES:
+            diffs = verify_unit(tracker, unit, end_time = end_time, statuses = statuses)
+            if diffs:
+                WARNING("Rebuilding performance tracker for unit %s"%unit.unit_id)
+                tracker.invalidate(unit.unit_id)
+
+        ups = tracker.summarize(unit, end_time = end_time, statuses = statuses)
+        if ups is None:
+            return None
+
+        unit.performance_summary = ups
+        unit.save()
+        return ups
+
+    def directory_units(self):
+        """
+        Return the units for the station directory from the in-memory unit directory,
+        loading only the units added since it was built. Return None if it has not
+        been built, in which case the station directory loads all units.
+        """
+        if self.unit_directory is None:
+            return None
+        missing = [unit_id for unit_id in self.unit_state_cache.unit_states if unit_id not in self.unit_directory]
+        if missing:
+            for unit in Unit.objects(unit_id__in = missing).no_cache():
+                self.unit_directory[unit.unit_id] = unit
+        return self.unit_directory.values()
+
+    def iter_summary_units(self, unit_id_to_unit):
+        """
+        Generate (unit, statuses) for the performance summary pass.
+        Statuses are only loaded for the units which are not in the performance
+        tracker, with a single query. For the other units, statuses is None and
+        the summary comes from the tracker's accumulators.
+        """
+        untracked = set(unit_id for unit_id in unit_id_to_unit if unit_id not in self.performance_tracker)
+        if untracked:
+            INFO("Loading statuses for %i units not in the performance tracker."%len(untracked))
+            unit_ids = None if len(untracked) == len(unit_id_to_unit) else untracked
+            for unit_id, statuses in dbUtils.iter_unit_statuses(unit_ids = unit_ids):
+                unit = unit_id_to_unit.get(unit_id, None)
+                if unit is None:
+                    WARNING("Have statuses for unknown unit %s"%unit_id)
+                    continue
+                yield unit, statuses
+
+        for unit_id, unit in unit_id_to_unit.iteritems():
+            if unit_id not in untracked:
+                yield unit, None
+
     def tick(self):
+        with self.profiler.tick():
+            self._tick()
+
+    def _tick(self):
+
+        profiler = self.profiler
 
         curTime = utcnow()
         start_tick_time = curTime
@@ -165,7 +271,13 @@ class ELESApp(object):
         count = gc.collect()
         DEBUG("Garbage collect returned %i"%count)
 
-        appState = EscalatorAppState.get()
+        with profiler.span('app_state'):
+            appState = EscalatorAppState.get()
+            cache_reloaded = self.unit_state_cache.refresh(appState.unit_state_version)
+            if cache_reloaded:
+                # The units and statuses may have been changed by another process.
+                self.unit_directory = None
+                self.performance_tracker.invalidate()
 
         time_since_last_tick = None
         if appState.lastRunTime:
@@ -173,77 +285,85 @@ class ELESApp(object):
 
         # Get the current list of WMATA Incidents
         INFO("Getting ELES incidents from WMATA API.")
-        incidents = getELESIncidents()
+        with profiler.span('wmata_fetch'):
+            incidents = getELESIncidents()
 
         INFO("Have %i outages."%len(incidents))
 
         # Update the database with units that changed status.
-        INFO("Processing changed units.")
-        changed_units = self.processIncidents(incidents, curTime)
+        # If the incidents are the same as those of the last tick (and the unit state
+        # has not been reloaded), no unit has changed status.
+        digest = incidents_digest(incidents)
+        if digest == self.last_incidents_digest and not cache_reloaded:
+            INFO("Incidents are unchanged since the last tick.")
+            changed_units = []
+            profiler.count('ticks_skipped')
+        else:
+            INFO("Processing changed units.")
+            with profiler.span('process_incidents'):
+                changed_units = self.processIncidents(incidents, curTime)
+            self.last_incidents_digest = digest
+            profiler.count('ticks_processed')
         INFO("Have %i changed units"%len(changed_units))
 
         # Make tweets, but do not send them.
         INFO("Generating Tweets")
-        tweets = self.generate_tweets(changed_units, url_maker = url_maker)
+        with profiler.span('generate_tweets'):
+            tweets = self.generate_tweets(changed_units, url_maker = url_maker)
 
-        # Update the unit's key statuses document.
-        INFO("Updating key statuses.")
-        for (unit_id, unit, old_status, new_status, key_status) in changed_units:
-            # Update the Key Statuses Document.
-            unit.update(new_status)
+        # The unit's key statuses were updated in processIncidents.
+        with profiler.span('performance_tracker'):
+            for (unit_id, unit, old_status, new_status, key_status) in changed_units:
+                self.performance_tracker.add_status(new_status)
 
-        # Update static json files.
-        INFO("Updating static json files.")
+        # Queue the static json files to be updated by the json publisher.
         for (unit_id, unit, old_status, new_status, key_status) in changed_units:
-            INFO("Writing json for unit: %s"%unit_id)
-            self.json_writer.write_unit(unit)
+            self.json_publisher.unit_dirty(unit)
 
         if changed_units:
-        # if True:
-            INFO("Writing station directory json.")
-            self.json_writer.write_station_directory()
-
-            INFO("Writing recent updates json.")
-            self.json_writer.write_recent_updates()
-
-        # Periodically recompute all unit performance summaries.
-        # This takes about 2.5 minutes on my laptop, so we can
-        # afford to do it during the application tick. It just means
-        # some ticks will be long.
+            if self.unit_directory is not None:
+                for (unit_id, unit, old_status, new_status, key_status) in changed_units:
+                    self.unit_directory[unit_id] = unit
+            self.json_publisher.directory_dirty(self.directory_units())
+            self.json_publisher.recent_updates_dirty()
+
+        # Periodically update all unit performance summaries.
+        # The summaries come from the running accumulators in the performance tracker,
+        # which are built from the unit's statuses the first time a unit is seen.
         if not appState.lastPerformanceSummaryTime or \
             (curTime - appState.lastPerformanceSummaryTime) > PERFORMANCE_SUMMARY_INTERVAL:
 
-            INFO("Recomputing all performance summaries.")
-            units = Unit.objects.no_cache()
-            n = units.count()
-            GARBAGE_COLLECT_DELTA = 20
-            for i, unit in enumerate(units):
+            with profiler.span('performance_summaries'):
+                INFO("Updating all performance summaries.")
+                unit_id_to_unit = dict((unit.unit_id, unit) for unit in Unit.objects.no_cache())
+                n = len(unit_id_to_unit)
+                GARBAGE_COLLECT_DELTA = 20
+
+                for i, (unit, statuses) in enumerate(self.iter_summary_units(unit_id_to_unit)):
 
-                INFO("Computing performance summary for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n))
+                    INFO("Computing performance summary for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n))
 
-                # TODO: Could get the unit statuses here and pass to unit.compute_performance_summary
-                # and to the json_writer. This way the statuses are pulled from the db only once.
-                start_time = datetime.now()
-                statuses = unit.get_statuses()
-                unit.compute_performance_summary(statuses = statuses, save = True, end_time = start_tick_time )
-                end_time=datetime.now()
+                    self.update_performance_summary(unit, statuses, end_time = start_tick_time)
 
-                self.json_writer.write_unit(unit, statuses)
+                    # Replace any pending write of the unit from this tick, so that
+                    # the publisher writes the unit with its new performance summary.
+                    self.json_publisher.unit_dirty(unit)
 
-                if i%GARBAGE_COLLECT_DELTA == 0:
-                    DEBUG("Running garbage collector in performance summary.")
-                    count = gc.collect()
-                    DEBUG("Garbage collect returned %i"%count)
+                    if i%GARBAGE_COLLECT_DELTA == 0:
+                        DEBUG("Running garbage collector in performance summary.")
+                        count = gc.collect()
+                        DEBUG("Garbage collect returned %i"%count)
 
 
-            INFO("Writing station directory.")
-            self.json_writer.write_station_directory()
+                self.unit_directory = unit_id_to_unit
+                self.json_publisher.directory_dirty(unit_id_to_unit.values())
 
             appState.lastPerformanceSummaryTime = curTime
 
 
         appState.lastRunTime = curTime
-        appState.save()
+        with profiler.span('app_state'):
+            appState.save()
 
         # Print tweets to screen.
         for t in tweets:
@@ -259,7 +379,8 @@ class ELESApp(object):
          self.escTwitter is not None and \
          self.eleTwitter is not None:
             INFO("Broadcasting Tweets")
-            self.broadcast_tweets(units, tweets)
+            with profiler.span('broadcast'):
+                self.broadcast_tweets(units, tweets)
         else:
             INFO("Not tweeting live.")
 
@@ -285,17 +406,13 @@ class ELESApp(object):
             key_status is an instance of models.KeyStatuses
         """
 
+        unit_state_cache = self.unit_state_cache
+
         # Add any units or symptom codes that we are seeing for the first time.
         # If we are seeing a unit for the first time,
         # an initial operational status will be created for the unit.
         for inc in incidents:
-            update_db_from_incident(inc, curTime)
-
-        symptoms = list(SymptomCode.objects)
-        symptom_description_to_symptom = dict((s.description, s) for s in symptoms)
-
-        # units = list(Unit.objects)
-        # unit_id_to_unit = dict((u.unit_id, u) for u in units)
+            unit_state_cache.add_from_incident(inc, curTime)
 
         unit_id_to_incident = dict((i.UnitId, i) for i in incidents)
 
@@ -303,12 +420,7 @@ class ELESApp(object):
         unit_to_new_symptom_desc = dict((i.UnitId, i.SymptomDescription) for i in incidents)
         outage_units = set(unit_to_new_symptom_desc.keys())
 
-        unit_id_to_old_symptom_desc = dict((unit.unit_id, unit.key_statuses.lastStatus.symptom_description) for unit in Unit.objects.no_cache())
-
-        DEBUG("Running garbage collector after iteration over units.")
-        count = gc.collect()
-        DEBUG("Garbage collect returned %i"%count)
-
+        unit_id_to_old_symptom_desc = unit_state_cache.last_symptom_descriptions()
 
         was_not_operationals = set(unit_id for unit_id, symptom_desc in unit_id_to_old_symptom_desc.iteritems() if \
                              symptom_desc != "OPERATIONAL")
@@ -349,9 +461,10 @@ class ELESApp(object):
                 unit_to_new_symptom_desc[unit_id] != unit_id_to_old_symptom_desc[unit_id] )
 
         changed_units = []
+        unit_updates = []
 
-        for unit_id in changed_unit_ids:
-            unit = Unit.objects.no_cache().get(unit_id = unit_id)
+        for unit in Unit.objects(unit_id__in = changed_unit_ids).no_cache():
+            unit_id = unit.unit_id
             key_status = unit.key_statuses
             old_status = key_status.lastStatus
             old_status._add_timezones()
@@ -364,22 +477,36 @@ class ELESApp(object):
             else:
                 symptom_description = "OPERATIONAL"
 
-            # Save new UnitStatus
-            symptom = symptom_description_to_symptom[symptom_description]
+            # Make the new UnitStatus
+            symptom = unit_state_cache.get_symptom(symptom_description)
             new_status = UnitStatus(unit = unit, 
                                         time = curTime,
                                         tickDelta = tickDelta,
                                         symptom = symptom)
             new_status.denormalize()
-            new_status.save()
 
-            changed_units.append((unit_id, unit, old_status, new_status, key_status))
+            # Keep the key statuses from before the update for the tweets.
+            key_status = key_status.copy()
 
-            DEBUG("Running garbage collector after saving new status.")
-            count = gc.collect()
-            DEBUG("Garbage collect returned %i"%count)
+            # Update the unit's key statuses and the previous status's end_time.
+            previous_status = unit.apply_update(new_status)
+            if previous_status is not None:
+                unit_updates.append((unit, previous_status, new_status))
 
-            
+            changed_units.append((unit_id, unit, old_status, new_status, key_status))
+
+        # Write the new statuses, the end times and the key statuses with batched writes.
+        try:
+            with self.profiler.span('key_status_updates'):
+                dbUtils.save_unit_updates(unit_updates)
+        except:
+            # The database may be partially updated. Reload the cache on the next tick.
+            unit_state_cache.invalidate()
+            raise
+
+        # Write through to the unit state cache.
+        for (unit_id, unit, old_status, new_status, key_status) in changed_units:
+            unit_state_cache.update(unit)
 
         return changed_units
 
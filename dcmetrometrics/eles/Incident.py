@@ -2,6 +2,8 @@
 eles.incident
 
 class Incident: An item on the WMATA list of escalator outages.
+
+incidents_digest: Digest of the unit statuses given by a list of incidents.
 """
 
 
@@ -10,6 +12,7 @@ from ..common import utils
 from datetime import date, datetime, time
 from ..common.metroTimes import parse_iso_time
 import pprint
+import hashlib
 
 ###################################################################
 class Incident(object):
@@ -111,3 +114,12 @@ class Incident(object):
     def __str__(self):
         return pprint.pformat(self._data)
 
+
+def incidents_digest(incidents):
+    """
+    Return a digest of the (UnitId, SymptomDescription) set of a list of incidents.
+    Two incident lists with the same digest produce the same unit statuses.
+    """
+    keys = sorted(set((i.UnitId, i.SymptomDescription) for i in incidents))
+    data = u'\n'.join(u'%s\t%s'%k for k in keys)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
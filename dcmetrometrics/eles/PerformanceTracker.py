@@ -0,0 +1,495 @@
+"""
+This module maintains running performance summaries for escalator/elevator units,
+so that the periodic performance summary pass does not have to rebuild a
+StatusGroup for every time window of every unit.
+
+UnitPerformanceTracker: Per-unit accumulators, bucketed by metro day.
+
+PerformanceTracker: Collection of UnitPerformanceTracker's for all units.
+
+The summaries produced here match Unit.compute_performance_summary, which
+remains available as a (slow) verification mode. See verify_unit.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from operator import attrgetter
+
+from ..common.metroTimes import TimeRange, getLastOpenTime, dateToOpen, toUtc, toLocalTime
+from ..common.utils import gen_dates
+from .models import UnitPerformancePeriod, UnitPerformanceSummary
+
+import logging
+logger = logging.getLogger('ELESApp')
+
+# Performance summary windows, in days. None means all time.
+PERFORMANCE_WINDOWS = [('one_day', 1),
+                       ('three_day', 3),
+                       ('seven_day', 7),
+                       ('fourteen_day', 14),
+                       ('thirty_day', 30),
+                       ('all_time', None)]
+
+def metroDay(t):
+    """
+    Return the metro day (as a date) which contains time t.
+    A metro day runs from one system opening to the next.
+    """
+    return getLastOpenTime(toLocalTime(t)).date()
+
+def _openTime(start, end):
+    if end <= start:
+        return 0.0
+    return TimeRange(start, end).metroOpenTime
+
+
+###############################################################################
+class UnitPerformanceTracker(object):
+    """
+    Running performance accumulators for a single unit.
+
+    Statuses must be added in ascending order of time. The most recent status is
+    considered to be ongoing: its open time is computed when a summary is requested.
+    All earlier statuses are closed, and their metro open time is accumulated
+    into per metro day buckets. Break and inspection counts are bucketed by the
+    metro day of the status.
+    """
+
+    def __init__(self, unit_id):
+        self.unit_id = unit_id
+
+        # One entry per status, in ascending order of time.
+        self.times = []
+        self.categories = []
+        self.breakFlags = []
+        self.inspectionFlags = []
+
+        # Set if the most recent status has an end_time defined.
+        self.lastEndTime = None
+
+        # Metro day buckets
+        self.dayToTimeAllocation = defaultdict(lambda: defaultdict(float)) # Closed statuses only
+        self.dayToBreakCount = defaultdict(int)
+        self.dayToInspectionCount = defaultdict(int)
+
+        # Break and inspection state, as used by StatusGroupBase._genBreakStatuses
+        # and StatusGroupBase._genInspectionStatuses.
+        self._wasBroken = False
+        self._wasInspection = False
+
+        # Outage state, for the all time break_days and day_to_break_count.
+        self._outageStart = None
+        self._outageIsBreak = False
+        self._prevOutage = (None, False)
+        self.outageDayToBreakCount = defaultdict(int)
+        self.breakDays = set()
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def lastTime(self):
+        return self.times[-1] if self.times else None
+
+    def add_status(self, status):
+        """
+        Add a status which follows all statuses added so far.
+        """
+        time = toUtc(status.time, allow_naive = True)
+        category = status.symptom_category
+
+        if self.times and time < self.times[-1]:
+            raise RuntimeError('UnitPerformanceTracker: status for unit %s is out of order'%self.unit_id)
+
+        # Close the previous status.
+        if self.times:
+            self._close(self.times[-1], time, self.categories[-1])
+
+        # Determine if the status is a break or an inspection.
+        isBreak = False
+        isInspection = False
+        if category == 'ON':
+            self._wasBroken = False
+            self._wasInspection = False
+        elif category == 'BROKEN':
+            isBreak = not self._wasBroken
+            self._wasBroken = True
+        elif category == 'INSPECTION':
+            isInspection = not self._wasInspection
+            self._wasInspection = True
+
+        day = metroDay(time)
+        if isBreak:
+            self.dayToBreakCount[day] += 1
+        if isInspection:
+            self.dayToInspectionCount[day] += 1
+
+        # Track outages (consecutive non-operational statuses)
+        self._prevOutage = (self._outageStart, self._outageIsBreak)
+        if category == 'ON':
+            if self._outageStart is not None:
+                self._closeOutage(time)
+        else:
+            if self._outageStart is None:
+                self._outageStart = time
+                self._outageIsBreak = False
+            if category == 'BROKEN':
+                self._outageIsBreak = True
+
+        self.times.append(time)
+        self.categories.append(category)
+        self.breakFlags.append(isBreak)
+        self.inspectionFlags.append(isInspection)
+
+        end_time = getattr(status, 'end_time', None)
+        self.lastEndTime = toUtc(end_time, allow_naive = True) if end_time else None
+
+    def _close(self, start, end, category):
+        """
+        Add the metro open time of a closed status to the day buckets.
+        """
+        day_start = dateToOpen(metroDay(start))
+        while day_start < end:
+            day = day_start.date()
+            day_end = dateToOpen(day + timedelta(days = 1))
+            seconds = _openTime(max(start, day_start), min(end, day_end))
+            self.dayToTimeAllocation[day][category] += seconds
+            day_start = day_end
+
+    def _closeOutage(self, end):
+        if self._outageIsBreak:
+            self.outageDayToBreakCount[metroDay(self._outageStart)] += 1
+            self.breakDays.update(self._outageDays(self._outageStart, end))
+        self._outageStart = None
+        self._outageIsBreak = False
+
+    @staticmethod
+    def _outageDays(start, end):
+        """The metro days covered by an outage. This matches Outage.days"""
+        return [d.date() for d in gen_dates(metroDay(start), metroDay(end) + timedelta(1))]
+
+    def _isExcluded(self, i, end):
+        """
+        Return True if status i is the active last status, and it
+        does not start before the end of the period.
+        """
+        return i == len(self.times) - 1 and self.lastEndTime is None and self.times[i] >= end
+
+    def _statusEnd(self, i, default):
+        if i + 1 < len(self.times):
+            return self.times[i+1]
+        return self.lastEndTime or default
+
+    def _partialTimeAllocation(self, allocation, lo, hi):
+        """
+        Add the metro open time allocated to each symptom category in [lo, hi]
+        by walking the statuses which overlap the range.
+        """
+        times = self.times
+        i = max(bisect_right(times, lo) - 1, 0)
+        n = len(times)
+        while i < n and times[i] < hi:
+            seconds = _openTime(max(times[i], lo), min(self._statusEnd(i, hi), hi))
+            allocation[self.categories[i]] += seconds
+            i += 1
+
+    def _countFlags(self, flags, dayToCount, start, end, d0, dT):
+        """
+        Count the flags for statuses with time in [start, end].
+        Interior metro days come from the day buckets, and the first and
+        last metro days are counted from the status list.
+        """
+        times = self.times
+
+        def countRange(lo, hi, inclusive):
+            i = bisect_left(times, lo)
+            j = bisect_right(times, hi) if inclusive else bisect_left(times, hi)
+            return sum(1 for f in flags[i:j] if f)
+
+        if d0 == dT:
+            return countRange(start, end, True)
+
+        count = countRange(start, dateToOpen(d0 + timedelta(days = 1)), False)
+        count += countRange(dateToOpen(dT), end, True)
+        count += sum(c for d, c in self._interiorDays(dayToCount, d0, dT))
+        return count
+
+    @staticmethod
+    def _interiorDays(dayToValue, d0, dT):
+        """Generate (day, value) for days strictly between d0 and dT."""
+        numDays = (dT - d0).days - 1
+        if numDays > len(dayToValue):
+            for d, v in dayToValue.iteritems():
+                if d0 < d < dT:
+                    yield d, v
+        else:
+            for i in range(numDays):
+                d = d0 + timedelta(days = i + 1)
+                if d in dayToValue:
+                    yield d, dayToValue[d]
+
+    def timeAllocation(self, start, end):
+        """
+        Return the amount of metro open time allocated to each symptom category
+        during [start, end].
+        """
+        allocation = defaultdict(float)
+        d0 = metroDay(start)
+        dT = metroDay(end)
+
+        if d0 == dT:
+            self._partialTimeAllocation(allocation, start, end)
+            return allocation
+
+        d1Open = dateToOpen(d0 + timedelta(days = 1))
+        dTOpen = dateToOpen(dT)
+        self._partialTimeAllocation(allocation, start, d1Open)
+        self._partialTimeAllocation(allocation, dTOpen, end)
+
+        for d, dayAllocation in self._interiorDays(self.dayToTimeAllocation, d0, dT):
+            for category, seconds in dayAllocation.iteritems():
+                allocation[category] += seconds
+
+        # The most recent status is not in the day buckets.
+        lastTime = self.times[-1]
+        lastEnd = min(self.lastEndTime or dTOpen, dTOpen)
+        seconds = _openTime(max(lastTime, d1Open), lastEnd)
+        allocation[self.categories[-1]] += seconds
+
+        return allocation
+
+    def summarize_period(self, start_time, end_time):
+        """
+        Summarize the performance of the unit over a time period.
+        Return a dictionary with the fields of a UnitPerformancePeriod, computed
+        as in StatusGroup(statuses, start_time, end_time).
+        """
+        if not self.times:
+            raise RuntimeError('UnitPerformanceTracker: no statuses for unit %s'%self.unit_id)
+
+        ret = {'availability' : 0.0,
+               'broken_time_percentage' : 0.0,
+               'num_breaks' : 0,
+               'num_inspections' : 0}
+
+        times = self.times
+        if end_time < times[0]:
+            return ret
+
+        # Adjust the start_time and end_time bounds, as in StatusGroupBase.
+        start = max(start_time, times[0])
+        end = end_time
+        if self.lastEndTime and end > self.lastEndTime and self.lastEndTime > start:
+            end = self.lastEndTime
+        if end < start:
+            raise RuntimeError('Start time must be less than end time')
+
+        d0 = metroDay(start)
+        dT = metroDay(end)
+
+        allocation = self.timeAllocation(start, end)
+        metroOpenTime = TimeRange(start, end).metroOpenTime
+        if metroOpenTime > 0.0:
+            ret['availability'] = allocation['ON']/metroOpenTime
+            ret['broken_time_percentage'] = float(allocation['BROKEN'])/metroOpenTime
+
+        ret['num_breaks'] = self._countFlags(self.breakFlags, self.dayToBreakCount, start, end, d0, dT)
+
+        # The first status in the period counts as an inspection if it is an inspection.
+        # Inspections which follow it count unless an inspection has been seen since
+        # the last operational status, within the period.
+        i0 = max(bisect_left(times, start) - 1, 0)
+        firstIsInspection = self.categories[i0] == 'INSPECTION'
+        n = len(times)
+        jEnd = bisect_right(times, end) - 1
+        if jEnd > i0 and self._isExcluded(jEnd, end):
+            jEnd -= 1
+
+        numInspections = self._countFlags(self.inspectionFlags, self.dayToInspectionCount, start, end, d0, dT)
+        if times[i0] >= start and self.inspectionFlags[i0]:
+            numInspections -= 1
+        if jEnd < n - 1 and times[n-1] <= end and self.inspectionFlags[n-1]:
+            numInspections -= 1
+        if firstIsInspection:
+            numInspections += 1
+        else:
+            # An inspection which was not counted in the unit's history because it followed
+            # an inspection prior to the period should count if it is the first
+            # inspection in the period.
+            j = i0 + 1
+            while j <= jEnd and self.categories[j] not in ('ON', 'INSPECTION'):
+                j += 1
+            if j <= jEnd and self.categories[j] == 'INSPECTION' and not self.inspectionFlags[j]:
+                numInspections += 1
+        ret['num_inspections'] = numInspections
+
+        return ret
+
+    def break_summary(self, end_time):
+        """
+        Return (day_to_break_count, break_days) over the unit's history, as
+        computed by StatusGroup.day_to_break_count and StatusGroup.break_days
+        """
+        day_to_break_count = dict(self.outageDayToBreakCount)
+        break_days = set(self.breakDays)
+
+        end = end_time
+        if self.lastEndTime and end > self.lastEndTime and self.lastEndTime > self.times[0]:
+            end = self.lastEndTime
+
+        # Add the outage which is still ongoing. A status which is still active
+        # is not part of the StatusGroup if it starts at the end of the period.
+        outageStart, outageIsBreak = self._outageStart, self._outageIsBreak
+        if self._isExcluded(len(self.times) - 1, end) and self.categories[-1] != 'ON':
+            outageStart, outageIsBreak = self._prevOutage
+
+        if outageStart is not None and outageIsBreak:
+            day = metroDay(outageStart)
+            day_to_break_count[day] = day_to_break_count.get(day, 0) + 1
+            break_days.update(self._outageDays(outageStart, end))
+
+        return day_to_break_count, sorted(break_days)
+
+
+###############################################################################
+class PerformanceTracker(object):
+    """
+    Maintain UnitPerformanceTrackers for all units.
+
+    Units are loaded from their status history on first use. After that, each new
+    status should be added with add_status.
+    """
+
+    def __init__(self):
+        self.unitIdToTracker = {}
+
+    def __contains__(self, unit_id):
+        return unit_id in self.unitIdToTracker
+
+    def load_unit(self, unit, statuses = None):
+        """
+        Build the tracker for a unit from its status history.
+        """
+        if statuses is None:
+            statuses = unit.get_statuses()
+        statuses = sorted(statuses, key = attrgetter('time'))
+        tracker = UnitPerformanceTracker(unit.unit_id)
+        for s in statuses:
+            tracker.add_status(s)
+        self.unitIdToTracker[unit.unit_id] = tracker
+        return tracker
+
+    def get(self, unit, statuses = None):
+        tracker = self.unitIdToTracker.get(unit.unit_id, None)
+        if tracker is None:
+            tracker = self.load_unit(unit, statuses)
+        return tracker
+
+    def invalidate(self, unit_id = None):
+        """
+        Drop the tracker for a unit, or for all units if unit_id is None.
+        The tracker will be rebuilt from the database on the next use.
+        """
+        if unit_id is None:
+            self.unitIdToTracker = {}
+        else:
+            self.unitIdToTracker.pop(unit_id, None)
+
+    def add_status(self, unit_status):
+        """
+        Update the accumulators for a unit with a new status. If the unit
+        has not been loaded yet, this does nothing.
+        """
+        tracker = self.unitIdToTracker.get(unit_status.unit_id, None)
+        if tracker is None:
+            return
+        try:
+            tracker.add_status(unit_status)
+        except RuntimeError as e:
+            logger.warning('%s. Dropping performance tracker for unit %s'%(str(e), unit_status.unit_id))
+            self.invalidate(unit_status.unit_id)
+
+    def summarize(self, unit, end_time, statuses = None):
+        """
+        Return a UnitPerformanceSummary for the unit, without saving.
+        Return None if the unit has no statuses.
+        """
+        tracker = self.get(unit, statuses)
+
+        if not len(tracker):
+            logger.warning("No statuses for unit %s! Not computing performance summary."%unit.unit_id)
+            return None
+
+        ups = UnitPerformanceSummary(unit = unit, unit_id = unit.unit_id)
+
+        for key, days in PERFORMANCE_WINDOWS:
+            start_time = end_time - timedelta(days = days) if days is not None else tracker.times[0]
+            period = tracker.summarize_period(start_time, end_time)
+            upp = UnitPerformancePeriod(unit_id = unit.unit_id,
+                                        start_time = start_time,
+                                        end_time = end_time,
+                                        **period)
+
+            if key == 'all_time':
+                day_to_break_count, break_days = tracker.break_summary(end_time)
+                upp.day_to_break_count = dict( (d.strftime('%Y-%m-%d'), c) for
+                                               d,c in day_to_break_count.iteritems())
+                upp.break_days = [ d.strftime('%Y-%m-%d') for d in break_days ]
+
+            setattr(ups, key, upp)
+
+        return ups
+
+
+###############################################################################
+def compare_summaries(expected, actual, tol = 1E-6):
+    """
+    Compare two UnitPerformanceSummary records.
+    Return a list of differences as strings.
+    """
+    diffs = []
+    if expected is None or actual is None:
+        if expected is not actual:
+            diffs.append('summary: expected %s, got %s'%(expected, actual))
+        return diffs
+
+    float_fields = ['availability', 'broken_time_percentage']
+    exact_fields = ['num_breaks', 'num_inspections', 'day_to_break_count', 'break_days']
+
+    for key, days in PERFORMANCE_WINDOWS:
+        e = getattr(expected, key)
+        a = getattr(actual, key)
+        for f in float_fields:
+            ev, av = getattr(e, f), getattr(a, f)
+            if abs(ev - av) > tol:
+                diffs.append('%s.%s: expected %s, got %s'%(key, f, ev, av))
+        for f in exact_fields:
+            ev, av = getattr(e, f), getattr(a, f)
+            if ev != av:
+                diffs.append('%s.%s: expected %s, got %s'%(key, f, ev, av))
+    return diffs
+
+def verify_unit(tracker, unit, end_time, statuses = None):
+    """
+    Verify the incremental performance summary for a unit against a full recompute
+    with Unit.compute_performance_summary. The unit's performance_summary
+    is left unchanged.
+
+    Return a list of differences as strings.
+    """
+    if statuses is None:
+        statuses = unit.get_statuses()
+
+    current = unit.performance_summary
+    try:
+        expected = unit.compute_performance_summary(statuses = statuses, end_time = end_time)
+    finally:
+        unit.performance_summary = current
+
+    actual = tracker.summarize(unit, end_time = end_time, statuses = statuses)
+    diffs = compare_summaries(expected, actual)
+
+    for d in diffs:
+        logger.error('Performance summary mismatch for unit %s: %s'%(unit.unit_id, d))
+
+    return diffs
@@ -9,6 +9,8 @@ StatusGroup: Class used to summarize an ordered listing of consecutive statuses
 
 Outage: Class used to summarize an ordered listing of consecutive non-operational statuses
         for a single escalator or elevator.
+
+Statuses can be UnitStatus documents or StatusRecords.
 """
 from collections import defaultdict, Counter
 from copy import deepcopy, copy
@@ -21,6 +23,7 @@ from ..common.utils import gen_dates, gen_days
 from ..common import metroTimes
 from ..common.metroTimes import TimeRange, isNaive, getLastOpenTime
 from .misc_utils import *
+from .StatusRecord import StatusRecord
 
 
 ###############################################################################
@@ -97,9 +100,7 @@ class StatusGroupBase(object):
         # it as active so we know that the status is still ongoing. We can't 
         # rely on end_time becasue we are going to modify the end time.
         if 'end_time' not in statuses[-1]:
-            lastStatus = deepcopy(statuses[-1])
-            lastStatus._sg_is_active = True
-            statuses[-1] = lastStatus
+            statuses[-1] = _replaced(statuses[-1], _sg_is_active = True)
         
         # Adjust the start_time or end_time bounds if they are too loose
         if start_time < statuses[0].time:
@@ -143,13 +144,10 @@ class StatusGroupBase(object):
 
             first_status = during_time_period[0]
             if first_status.time < start_time:
-                first_status = deepcopy(first_status)
-                first_status.time = start_time
+                first_status = _replaced(first_status, time = start_time)
                 during_time_period = [first_status] + during_time_period[1:]
 
-            last_status = during_time_period[-1]
-            last_status = deepcopy(last_status)
-            last_status.end_time = end_time
+            last_status = _replaced(during_time_period[-1], end_time = end_time)
             during_time_period = during_time_period[:-1] + [last_status]
 
         _checkStatusListSane(during_time_period)
@@ -540,7 +538,19 @@ class Outage(StatusGroupBase):
 
 
 #############################################################            
-            
+
+def _replaced(status, **kwargs):
+    """
+    Return a copy of the status with the given attributes replaced.
+    StatusRecords are immutable and cheap to copy. Documents are deep copied.
+    """
+    if isinstance(status, StatusRecord):
+        return status.replace(**kwargs)
+    status = deepcopy(status)
+    for k, v in kwargs.iteritems():
+        setattr(status, k, v)
+    return status
+
 def _checkStatusListSane(statusList, require_end_time = True):
     """Check that each status has a 'time' and 'end_time' defined
     and that the list is sorted. If require_end_time is False,
@@ -0,0 +1,180 @@
+"""
+This module provides a compact, read-only status record for the analytics code.
+
+StatusRecord: A lightweight stand-in for a UnitStatus document, holding only the
+              fields used by StatusGroup, Outage, KeyStatuses.select_key_statuses and
+              DailyServiceReport.compute_for_unit. Times are non-naive and in UTC.
+
+Loading StatusRecords instead of UnitStatus documents cuts the memory use and the
+cost of building and copying statuses when recomputing over full status histories.
+"""
+from ..common.metroTimes import toUtc
+
+
+###############################################################################
+class StatusRecord(object):
+    """
+    An immutable status record for a single escalator or elevator.
+
+    Supports the parts of the UnitStatus interface used by the analytics code:
+    attribute access, 'end_time' in status, status['time'] and is_active.
+    Use replace to get a modified copy.
+    """
+
+    __slots__ = ('pk', 'unit_id', 'time', 'end_time', 'symptom_description',
+                 'symptom_category', '_sg_is_active')
+
+    # Fields loaded from the escalator_statuses collection (by database name)
+    db_fields = ['unit_id', 'time', 'end_time', 'symptom_description', 'symptom_category']
+
+    def __init__(self, unit_id = None, time = None, end_time = None,
+                 symptom_description = None, symptom_category = None, pk = None):
+        """
+        time, end_time: Times of the status. Naive times are taken to be in UTC,
+                        as they are stored in the database.
+        pk: The primary key of the UnitStatus document, if any.
+        """
+        setter = object.__setattr__
+        setter(self, 'pk', pk)
+        setter(self, 'unit_id', unit_id)
+        setter(self, 'time', _toUtc(time))
+        setter(self, 'end_time', _toUtc(end_time))
+        setter(self, 'symptom_description', symptom_description)
+        setter(self, 'symptom_category', symptom_category)
+        setter(self, '_sg_is_active', False)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('StatusRecord is immutable. Use replace instead.')
+
+    def __delattr__(self, name):
+        raise AttributeError('StatusRecord is immutable.')
+
+    def replace(self, **kwargs):
+        """
+        Return a copy of this record with the given fields replaced.
+        """
+        ret = object.__new__(self.__class__)
+        setter = object.__setattr__
+        for k in self.__slots__:
+            setter(ret, k, getattr(self, k))
+        for k, v in kwargs.iteritems():
+            if k not in self.__slots__:
+                raise AttributeError('StatusRecord has no field %s'%k)
+            if k in ('time', 'end_time'):
+                v = _toUtc(v)
+            setter(ret, k, v)
+        return ret
+
+    # Records are immutable, so copies can share the record.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        setter = object.__setattr__
+        for k, v in zip(self.__slots__, state):
+            setter(self, k, v)
+
+    def __eq__(self, other):
+        if not isinstance(other, StatusRecord):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        return ret if ret is NotImplemented else not ret
+
+    def __hash__(self):
+        return hash(self.__getstate__())
+
+    def __contains__(self, name):
+        """
+        Return True if the field is set, like a mongoengine Document.
+        """
+        return getattr(self, name, None) is not None
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __repr__(self):
+        return 'StatusRecord(%r, %s, %s, %r)'%(self.unit_id, self.time, self.end_time,
+                                               self.symptom_category)
+
+    @property
+    def is_active(self):
+        return self.end_time is None
+
+    @property
+    def start_time(self):
+        return self.time
+
+    ##########################
+    # Conversion to and from UnitStatus
+
+    @classmethod
+    def from_unit_status(cls, status):
+        """
+        Build a StatusRecord from a UnitStatus document.
+        """
+        return cls(unit_id = status.unit_id,
+                   time = status.time,
+                   end_time = getattr(status, 'end_time', None),
+                   symptom_description = status.symptom_description,
+                   symptom_category = status.symptom_category,
+                   pk = status.pk)
+
+    @classmethod
+    def from_son(cls, son):
+        """
+        Build a StatusRecord from a raw escalator_statuses document.
+        This can be used as the factory for dbUtils.iter_unit_statuses.
+        """
+        return cls(unit_id = son.get('unit_id'),
+                   time = son['time'],
+                   end_time = son.get('end_time'),
+                   symptom_description = son.get('symptom_description'),
+                   symptom_category = son.get('symptom_category'),
+                   pk = son.get('_id'))
+
+    def to_unit_status(self):
+        """
+        Return an (unsaved) UnitStatus document with the fields of this record.
+        If the record has a pk, the document can be used as a reference to
+        the stored status.
+        """
+        from .models import UnitStatus
+        return UnitStatus(id = self.pk,
+                          unit_id = self.unit_id,
+                          time = self.time,
+                          end_time = self.end_time,
+                          symptom_description = self.symptom_description,
+                          symptom_category = self.symptom_category)
+
+
+def _toUtc(t):
+    if t is None:
+        return None
+    return toUtc(t, allow_naive = True)
+
+def to_status_records(statuses):
+    """
+    Convert a list of UnitStatus documents to StatusRecords.
+    StatusRecords are passed through.
+    """
+    return [s if isinstance(s, StatusRecord) else StatusRecord.from_unit_status(s) for s in statuses]
+
+def as_unit_status(status):
+    """
+    Return a status suitable for a UnitStatus ReferenceField: StatusRecords
+    are converted with to_unit_status, and documents (or None) are passed through.
+    """
+    if isinstance(status, StatusRecord):
+        return status.to_unit_status()
+    return status
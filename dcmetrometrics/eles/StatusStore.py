@@ -0,0 +1,322 @@
+"""
+This module provides a columnar, NumPy backed store of statuses for many
+escalators/elevators, with vectorized versions of the StatusGroup metrics.
+
+StatusStore: Statuses for many units held in flat arrays, sorted by unit and time.
+
+StatusStoreWindow: Metrics for every unit in a StatusStore over a time period.
+                   For each unit, the metrics match those of
+                   StatusGroup(unit_statuses, start_time, end_time).
+
+Times are stored as int64 microseconds since the epoch, and metro open
+time is computed with the cumulative open time table in metroTimes.
+"""
+from operator import itemgetter
+
+import numpy as np
+
+from ..common.descriptors import computeOnce
+from ..common.metroTimes import toEpochMicros, metroOpenSecondsArray
+from .defs import SYMPTOM_CHOICES
+
+CATEGORIES = SYMPTOM_CHOICES
+CATEGORY_TO_CODE = dict((c, i) for i, c in enumerate(CATEGORIES))
+ON = CATEGORY_TO_CODE['ON']
+BROKEN = CATEGORY_TO_CODE['BROKEN']
+INSPECTION = CATEGORY_TO_CODE['INSPECTION']
+
+
+###############################################################################
+class StatusStore(object):
+    """
+    Statuses for many units, held in flat arrays sorted by unit and then time.
+
+    unit_ids: List of unit ids. The position of a unit_id in the list is its unit index.
+    unit: Unit index of each status.
+    time, end_time: Start and end of each status (microseconds since epoch).
+    has_end_time: False if the status does not have end_time defined.
+    category: Symptom category code of each status (index into CATEGORIES).
+    unit_start, unit_stop: Slice of the status arrays belonging to each unit.
+    """
+
+    def __init__(self, unit_ids, unit, time, end_time, has_end_time, category):
+        self.unit_ids = list(unit_ids)
+        self.unit_id_to_index = dict((u, i) for i, u in enumerate(self.unit_ids))
+        self.unit = np.asarray(unit, dtype = np.int32)
+        self.time = np.asarray(time, dtype = np.int64)
+        self.end_time = np.asarray(end_time, dtype = np.int64)
+        self.has_end_time = np.asarray(has_end_time, dtype = bool)
+        self.category = np.asarray(category, dtype = np.int8)
+
+        num_units = len(self.unit_ids)
+        counts = np.bincount(self.unit, minlength = num_units) if len(self.unit) else np.zeros(num_units, dtype = np.int64)
+        self.unit_stop = np.cumsum(counts)
+        self.unit_start = self.unit_stop - counts
+
+        self._checkSane()
+        self._computeFlags()
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def num_units(self):
+        return len(self.unit_ids)
+
+    @classmethod
+    def from_statuses(cls, statuses, unit_ids = None):
+        """
+        Build a StatusStore from UnitStatus documents (or any object with unit_id,
+        time, end_time and symptom_category attributes).
+
+        unit_ids: If provided, the units to include in the store, in order. Units
+                  without statuses are allowed. Otherwise, the units
+                  are the units of the statuses, sorted by unit_id.
+        """
+        statuses = list(statuses)
+        if unit_ids is None:
+            unit_ids = sorted(set(s.unit_id for s in statuses))
+        unit_id_to_index = dict((u, i) for i, u in enumerate(unit_ids))
+
+        records = [(unit_id_to_index[s.unit_id], toEpochMicros(s.time), s) for s in statuses]
+        records.sort(key = itemgetter(0, 1))
+
+        n = len(records)
+        unit = np.empty(n, dtype = np.int32)
+        time = np.empty(n, dtype = np.int64)
+        end_time = np.zeros(n, dtype = np.int64)
+        has_end_time = np.zeros(n, dtype = bool)
+        category = np.empty(n, dtype = np.int8)
+
+        for i, (unit_index, t, s) in enumerate(records):
+            unit[i] = unit_index
+            time[i] = t
+            s_end_time = getattr(s, 'end_time', None)
+            if s_end_time:
+                end_time[i] = toEpochMicros(s_end_time)
+                has_end_time[i] = True
+            category[i] = CATEGORY_TO_CODE[s.symptom_category]
+
+        return cls(unit_ids, unit, time, end_time, has_end_time, category)
+
+    def _checkSane(self):
+        """
+        Check that statuses are sorted by unit and time, and that all statuses
+        (except the last for each unit) have end_time defined.
+        """
+        n = len(self)
+        if n == 0:
+            return
+        same_unit = self.unit[1:] == self.unit[:-1]
+        if np.any(self.unit[1:] < self.unit[:-1]) or \
+           np.any(same_unit & (self.time[1:] < self.time[:-1])):
+            raise RuntimeError('StatusStore: statuses are not sorted in ascending order')
+        if np.any(same_unit & ~self.has_end_time[:-1]):
+            raise RuntimeError('Status must have end_time defined')
+
+    def _computeFlags(self):
+        """
+        Compute the index of the last operational status at or before each status,
+        and the index of the last broken and inspection status strictly before each status.
+        Indices refer to the status arrays, and may belong to an earlier unit.
+        """
+        n = len(self)
+        index = np.arange(n)
+        category = self.category
+
+        def last_index(mask):
+            return np.maximum.accumulate(np.where(mask, index, -1)) if n else index
+
+        def last_index_before(mask):
+            ret = np.empty(n, dtype = index.dtype)
+            if n:
+                ret[0] = -1
+                ret[1:] = last_index(mask)[:-1]
+            return ret
+
+        self.last_on = last_index(category == ON)
+        self.last_broken_before = last_index_before(category == BROKEN)
+        self.last_inspection_before = last_index_before(category == INSPECTION)
+
+        # A break is the first broken status since the last operational status.
+        # This matches StatusGroupBase._genBreakStatuses.
+        unit_start = self.unit_start[self.unit] if n else index
+        self.is_break = (category == BROKEN) & \
+                        (self.last_broken_before < np.maximum(self.last_on, unit_start))
+
+    def window(self, start_time = None, end_time = None):
+        """
+        Return a StatusStoreWindow with the metrics of each unit over a time period.
+
+        start_time: The start of the time range of interest (as a non-naive datetime).
+                   If None, the time of each unit's first status is used.
+        end_time:   The end of the time range of interest (as a non-naive datetime).
+                   If None, the end_time (or time) of each unit's last status is used.
+        """
+        return StatusStoreWindow(self, start_time, end_time)
+
+
+###############################################################################
+class StatusStoreWindow(object):
+    """
+    Metrics for every unit in a StatusStore over a time period. Per unit results are
+    arrays indexed by unit index. Per status results are arrays indexed like the
+    status arrays of the StatusStore.
+    """
+
+    def __init__(self, store, start_time = None, end_time = None):
+
+        self.store = store
+        s = store
+        num_units = s.num_units
+        n = len(s)
+
+        has_statuses = s.unit_stop > s.unit_start
+        first = np.minimum(s.unit_start, max(n - 1, 0))
+        last = np.maximum(s.unit_stop - 1, 0)
+        if n == 0:
+            first_time = last_time = last_end_time = np.zeros(num_units, dtype = np.int64)
+            last_has_end_time = np.zeros(num_units, dtype = bool)
+        else:
+            first_time = s.time[first]
+            last_time = s.time[last]
+            last_end_time = s.end_time[last]
+            last_has_end_time = s.has_end_time[last]
+
+        # The group is empty if the unit has no statuses or if the time period
+        # ends before the unit's first status.
+        empty = ~has_statuses
+        if end_time is not None:
+            empty |= toEpochMicros(end_time) < first_time
+
+        # Adjust the start time and end time, as in StatusGroupBase.
+        if start_time is None:
+            start = first_time
+        else:
+            start = np.maximum(first_time, toEpochMicros(start_time))
+
+        if end_time is None:
+            end = np.where(last_has_end_time, last_end_time, last_time)
+        else:
+            end = np.zeros(num_units, dtype = np.int64) + toEpochMicros(end_time)
+
+        use_last_end = last_has_end_time & (end > last_end_time) & (last_end_time > start)
+        end = np.where(use_last_end, last_end_time, end)
+
+        bad = ~empty & (end < start)
+        if np.any(bad):
+            raise RuntimeError('Start time must be less than end time (unit %s)'%s.unit_ids[np.nonzero(bad)[0][0]])
+
+        self.empty = empty
+        self.start = start
+        self.end = end
+
+        # Collect statuses that overlap the time period
+        u = s.unit
+        index = np.arange(n)
+        active = (index == last[u]) & ~s.has_end_time if n else np.zeros(0, dtype = bool)
+        overlaps = np.where(active,
+                            s.time < end[u],
+                            ~((s.end_time < start[u]) | (s.time > end[u])))
+        overlaps &= ~empty[u]
+        self.overlaps = overlaps
+
+        # First and last overlapping status for each unit
+        overlap_index = np.nonzero(overlaps)[0]
+        overlap_unit = u[overlap_index]
+        self.first_overlap = np.zeros(num_units, dtype = np.int64) - 1
+        self.last_overlap = np.zeros(num_units, dtype = np.int64) - 1
+        if len(overlap_index):
+            unique_units, first_pos = np.unique(overlap_unit, return_index = True)
+            self.first_overlap[unique_units] = overlap_index[first_pos]
+            unique_units, last_pos = np.unique(overlap_unit[::-1], return_index = True)
+            self.last_overlap[unique_units] = overlap_index[::-1][last_pos]
+
+        # Trim the statuses to conform to the time period
+        trimmed_time = s.time[overlap_index].copy()
+        trimmed_end_time = s.end_time[overlap_index].copy()
+        is_first = overlap_index == self.first_overlap[overlap_unit]
+        is_first &= trimmed_time < start[overlap_unit]
+        trimmed_time[is_first] = start[overlap_unit[is_first]]
+        is_last = overlap_index == self.last_overlap[overlap_unit]
+        trimmed_end_time[is_last] = end[overlap_unit[is_last]]
+
+        self._overlap_index = overlap_index
+        self._overlap_unit = overlap_unit
+        self.statusMetroOpenTime = metroOpenSecondsArray(trimmed_time, trimmed_end_time)
+
+    @computeOnce
+    def metroOpenTime(self):
+        return metroOpenSecondsArray(self.start, self.end)
+
+    @computeOnce
+    def timeAllocation(self):
+        """
+        Return the amount of metro open time allocated to each symptom category,
+        as an array of shape (num_units, len(CATEGORIES)).
+        """
+        ret = np.zeros((self.store.num_units, len(CATEGORIES)), dtype = np.float64)
+        category = self.store.category[self._overlap_index]
+        # np.add.at accumulates in order, matching the sums in StatusGroupBase.timeAllocation.
+        np.add.at(ret, (self._overlap_unit, category), self.statusMetroOpenTime)
+        return ret
+
+    def _percentage(self, category_code):
+        metroOpenTime = self.metroOpenTime
+        time = self.timeAllocation[:, category_code]
+        is_open = metroOpenTime > 0.0
+        ret = np.zeros(self.store.num_units, dtype = np.float64)
+        ret[is_open] = time[is_open]/metroOpenTime[is_open]
+        return ret
+
+    @computeOnce
+    def availability(self):
+        return self._percentage(ON)
+
+    @computeOnce
+    def brokenTimePercentage(self):
+        return self._percentage(BROKEN)
+
+    @computeOnce
+    def breakStatuses(self):
+        """
+        Boolean mask of the statuses which are breaks during the time period.
+        Only the first break between operational states is counted.
+        """
+        s = self.store
+        u = s.unit
+        return s.is_break & ~self.empty[u] & (s.time >= self.start[u]) & (s.time <= self.end[u])
+
+    @computeOnce
+    def inspectionStatuses(self):
+        """
+        Boolean mask of the statuses which are inspections during the time period.
+        Only the first inspection between operational states within the
+        time period is counted.
+        """
+        s = self.store
+        u = s.unit
+        first = self.first_overlap[u]
+        return self.overlaps & (s.category == INSPECTION) & \
+               (s.last_inspection_before < np.maximum(s.last_on + 1, first))
+
+    def _count(self, mask):
+        return np.bincount(self.store.unit[mask], minlength = self.store.num_units)
+
+    @computeOnce
+    def num_breaks(self):
+        return self._count(self.breakStatuses)
+
+    @computeOnce
+    def num_inspections(self):
+        return self._count(self.inspectionStatuses)
+
+    def unit_time_allocation(self, unit_id):
+        """
+        Return the time allocation for a single unit as a dictionary,
+        like StatusGroupBase.timeAllocation.
+        """
+        i = self.store.unit_id_to_index[unit_id]
+        row = self.timeAllocation[i]
+        categories = self.store.category[self._overlap_index[self._overlap_unit == i]]
+        return dict((CATEGORIES[j], row[j]) for j in set(categories))
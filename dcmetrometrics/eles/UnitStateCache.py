@@ -0,0 +1,196 @@
+"""
+eles.UnitStateCache
+
+A process-resident cache of the state of each escalator/elevator unit, so that
+a tick of the ELESApp does not have to load every Unit (and dereference its
+lastStatus) to find the units which have changed status.
+
+UnitState: The cached state of a single unit.
+
+UnitStateCache: The cached states of all units and the known symptom codes.
+                The cache is loaded once with a few raw queries, updated
+                write-through as the app saves unit updates, and reloaded if
+                the unit_state_version in the EscalatorAppState changes.
+"""
+from bson.dbref import DBRef
+
+from .models import Unit, UnitStatus, SymptomCode
+from .dbUtils import update_db_from_incident
+
+import logging
+logger = logging.getLogger('ELESApp')
+
+KEY_STATUS_FIELDS = ['lastFixStatus', 'lastBreakStatus', 'lastInspectionStatus',
+                     'lastOperationalStatus', 'currentBreakStatus', 'lastStatus']
+
+def _ref_id(ref):
+    """
+    Return the ObjectId of a reference, which may be stored as a DBRef,
+    an ObjectId, or a document.
+    """
+    if ref is None:
+        return None
+    if isinstance(ref, DBRef):
+        return ref.id
+    return getattr(ref, 'pk', ref)
+
+
+###############################################################################
+class UnitState(object):
+    """
+    The cached state of a single unit.
+
+    key_status_ids: A dictionary from KeyStatuses field name to the id of the
+                    UnitStatus for that key status.
+    """
+    __slots__ = ['unit_id', 'pk', 'symptom_description', 'symptom_category', 'key_status_ids']
+
+    def __init__(self, unit_id, pk, symptom_description, symptom_category, key_status_ids):
+        self.unit_id = unit_id
+        self.pk = pk
+        self.symptom_description = symptom_description
+        self.symptom_category = symptom_category
+        self.key_status_ids = key_status_ids
+
+    @classmethod
+    def from_unit(cls, unit):
+        """
+        Make the UnitState for a Unit document. The unit must have key statuses.
+        """
+        ks = unit.key_statuses
+        last_status = ks.lastStatus
+        # Use the raw field values so that the other key statuses are not dereferenced.
+        key_status_ids = dict((k, _ref_id(ks._data.get(k, None))) for k in KEY_STATUS_FIELDS)
+        return cls(unit.unit_id, unit.pk, last_status.symptom_description,
+                   last_status.symptom_category, key_status_ids)
+
+    def __repr__(self):
+        return 'UnitState(%s, %s)'%(self.unit_id, self.symptom_description)
+
+
+###############################################################################
+class UnitStateCache(object):
+    """
+    Cache of the UnitState for all units and of the known symptom codes.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.unit_states = {} # unit_id -> UnitState
+        self.symptoms = {} # symptom description -> SymptomCode
+
+    def __contains__(self, unit_id):
+        return unit_id in self.unit_states
+
+    def __len__(self):
+        return len(self.unit_states)
+
+    def get(self, unit_id):
+        return self.unit_states.get(unit_id, None)
+
+    @property
+    def is_loaded(self):
+        return self.version is not None
+
+    def load(self, version = 0):
+        """
+        Load the state of all units from the database. This uses one query for
+        the units, one for their last statuses, and one for the symptom codes.
+        """
+        logger.info("Loading unit state cache (version %s)."%version)
+
+        unit_docs = list(Unit._get_collection().find({}, {'unit_id' : True, 'key_statuses' : True}))
+
+        last_status_ids = []
+        for doc in unit_docs:
+            ks = doc.get('key_statuses', None)
+            if ks and ks.get('lastStatus', None) is not None:
+                last_status_ids.append(_ref_id(ks['lastStatus']))
+
+        status_fields = {'symptom_description' : True, 'symptom_category' : True}
+        status_id_to_doc = dict((d['_id'], d) for d in \
+          UnitStatus._get_collection().find({'_id' : {'$in' : last_status_ids}}, status_fields))
+
+        unit_states = {}
+        for doc in unit_docs:
+            unit_id = doc['unit_id']
+            ks = doc.get('key_statuses', None) or {}
+            key_status_ids = dict((k, _ref_id(ks.get(k, None))) for k in KEY_STATUS_FIELDS)
+            last_status = status_id_to_doc.get(key_status_ids['lastStatus'], None)
+            if last_status is None:
+                # Unit.add will build the key statuses if this unit has an incident.
+                logger.warning("Unit %s has no last status. Leaving it out of the unit state cache."%unit_id)
+                continue
+            unit_states[unit_id] = UnitState(unit_id, doc['_id'],
+                                             last_status.get('symptom_description', None),
+                                             last_status.get('symptom_category', None),
+                                             key_status_ids)
+
+        self.unit_states = unit_states
+        self.symptoms = dict((s.description, s) for s in SymptomCode.objects)
+        self.version = version
+
+        logger.info("Loaded %i units and %i symptoms into unit state cache."%(len(self.unit_states), len(self.symptoms)))
+
+    def refresh(self, version):
+        """
+        Reload the cache if it has not been loaded or if the version stamp has changed.
+        Return True if the cache was reloaded.
+        """
+        version = version or 0
+        if self.version == version:
+            return False
+        if self.is_loaded:
+            logger.info("Unit state version changed from %s to %s."%(self.version, version))
+        self.load(version)
+        return True
+
+    def invalidate(self):
+        """
+        Force a reload on the next refresh.
+        """
+        self.version = None
+
+    def update(self, unit):
+        """
+        Update the cached state of a unit after its key statuses have changed.
+        """
+        self.unit_states[unit.unit_id] = UnitState.from_unit(unit)
+
+    def add_from_incident(self, inc, curTime):
+        """
+        Add the unit and symptom of an incident to the database and the cache
+        if they are not already known.
+        """
+        known_symptom = inc.SymptomDescription in self.symptoms
+        known_unit = inc.UnitId in self.unit_states
+        if known_symptom and known_unit:
+            return
+
+        update_db_from_incident(inc, curTime)
+
+        if not known_symptom:
+            symptom = SymptomCode.objects.get(description = inc.SymptomDescription)
+            self.symptoms[symptom.description] = symptom
+
+        if not known_unit:
+            unit = Unit.objects.get(unit_id = inc.UnitId)
+            self.update(unit)
+
+    def get_symptom(self, description):
+        """
+        Get the SymptomCode for a symptom description, loading it
+        from the database if necessary.
+        """
+        symptom = self.symptoms.get(description, None)
+        if symptom is None:
+            symptom = SymptomCode.objects.get(description = description)
+            self.symptoms[description] = symptom
+        return symptom
+
+    def last_symptom_descriptions(self):
+        """
+        Return a dictionary from unit_id to the symptom description
+        of the unit's last status.
+        """
+        return dict((unit_id, s.symptom_description) for unit_id, s in self.unit_states.iteritems())
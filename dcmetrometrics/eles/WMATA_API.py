@@ -6,6 +6,8 @@ Request data from the WMATA API
 
 import requests
 
+from ..common import httpClient
+
 class WMATA_API_ERROR(Exception):
     def __init__(self, requestObj):
         self.requestObj = requestObj
@@ -17,13 +19,18 @@ class WMATA_API(object):
     (partial) implementation of the WMATA API.
     """
     
-    def __init__(self, key):
+    def __init__(self, key, client = None):
+        """
+        client: The httpClient.HttpClient to make requests with.
+                Defaults to the shared client.
+        """
         if not isinstance(key, str) or not key:
             raise TypeError('WMATA_API key should be str')
 
         self.API_KEY = key
         self.URL_BASE = 'http://api.wmata.com'
         self.TIMEOUT = 10 # timeout requests after 10 seconds.
+        self.client = client if client is not None else httpClient.get_client()
 
     # Check if a request is okay. If it isn't raise WMATA_API_ERROR
     def checkRequest(self, req):    
@@ -35,14 +42,16 @@ class WMATA_API(object):
         headers = { 'api_key' : self.API_KEY }
         if params is not None:
             payload.update(params)
-        r = requests.get(url, params=payload, timeout = self.TIMEOUT, headers = headers)
+        endpoint = 'wmata:' + url[len(self.URL_BASE):]
+        r = self.client.get(url, params=payload, timeout = self.TIMEOUT, headers = headers,
+                            endpoint = endpoint)
         self.checkRequest(r)
         return r
 
     # Request the static webpage with elevator/escalator status
     def getEscalatorWebpageStatus(self):
         url = 'http://www.wmata.com/rider_tools/metro_service_status/elevator_escalator.cfm'
-        r = requests.get(url, timeout = self.TIMEOUT)
+        r = self.client.get(url, timeout = self.TIMEOUT)
         return r
 
     def getStations(self, params = None):
@@ -7,6 +7,8 @@ to the MongoDB collections.
 
 # python imports
 import pymongo
+from pymongo.errors import OperationFailure
+from bson.son import SON
 from mongoengine import DoesNotExist
 import sys
 import os
@@ -24,7 +26,7 @@ from ..common import dbGlobals, stations
 from ..common.metroTimes import TimeRange, utcnow, isNaive, toUtc, tzutc
 from .defs import symptomToCategory, OPERATIONAL_CODE as OP_CODE
 from .StatusGroup import StatusGroup
-from .models import Unit, UnitStatus, KeyStatuses, SymptomCode
+from .models import Unit, UnitStatus, KeyStatuses, SymptomCode, EscalatorAppState
 from .misc_utils import *
 
 invert_dict = lambda d: dict((v,k) for k,v in d.iteritems())
@@ -91,8 +93,89 @@ def set_unit_key_statuses():
         print "Computing key statuses for unit: %s"%(unit.unit_id)
         unit.compute_key_statuses()
 
+    EscalatorAppState.bump_unit_state_version()
+
 
 
+######################################################################
+# Batched writes for a tick
+#
+# pymongo 2.6 does not have the bulk write API, so new statuses are written
+# with one batch insert, end_time updates with one multi-document update per
+# distinct end_time, and the KeyStatuses $set updates with a single update
+# write command where the server supports it.
+
+def insert_unit_statuses(statuses):
+    """
+    Validate and insert new UnitStatus documents with a single batch insert,
+    and set the primary key of each document.
+    """
+    if not statuses:
+        return []
+    for status in statuses:
+        status.validate()
+    raw = [status.to_mongo() for status in statuses]
+    ids = UnitStatus._get_collection().insert(raw)
+    for status, oid in zip(statuses, ids):
+        status.pk = oid
+        status._created = False
+        status._clear_changed_fields()
+    return ids
+
+def set_status_end_times(statuses):
+    """
+    Write the end_time of existing statuses. Statuses which share an end_time
+    (the statuses ended by a single tick) are updated together.
+    """
+    end_time_to_ids = defaultdict(list)
+    for status in statuses:
+        end_time_to_ids[toUtc(status.end_time, allow_naive = True)].append(status.pk)
+    collection = UnitStatus._get_collection()
+    for end_time, ids in end_time_to_ids.iteritems():
+        collection.update({'_id' : {'$in' : ids}}, {'$set' : {'end_time' : end_time}}, multi = True)
+
+def bulk_set(collection, updates):
+    """
+    Apply $set updates to documents in a collection.
+
+    updates: A list of (_id, fields) pairs, where fields is a dictionary
+             of field values to $set.
+
+    The updates are sent with a single update write command (MongoDB 2.6+).
+    If the server does not support write commands, the updates are sent
+    one at a time.
+    """
+    if not updates:
+        return
+    cmd = SON([('update', collection.name),
+               ('updates', [{'q' : {'_id' : _id}, 'u' : {'$set' : fields}} for _id, fields in updates]),
+               ('ordered', False)])
+    try:
+        res = collection.database.command(cmd)
+    except OperationFailure:
+        for _id, fields in updates:
+            collection.update({'_id' : _id}, {'$set' : fields})
+        return
+    write_errors = res.get('writeErrors', None)
+    if write_errors:
+        raise RuntimeError('bulk_set: %i updates failed: %s'%(len(write_errors), write_errors[0]))
+
+def save_unit_updates(updates):
+    """
+    Save the result of Unit.apply_update for several units with batched writes.
+
+    updates: A list of (unit, previous_status, new_status) tuples.
+
+    The new statuses are inserted first, so that the KeyStatuses can reference them.
+    """
+    if not updates:
+        return
+    insert_unit_statuses([new_status for unit, previous_status, new_status in updates])
+    set_status_end_times([previous_status for unit, previous_status, new_status in updates])
+    key_status_updates = [(unit.pk, {'key_statuses' : unit.key_statuses.to_mongo()}) for
+                          unit, previous_status, new_status in updates]
+    bulk_set(Unit._get_collection(), key_status_updates)
+
 ######################################################################
 def group_statuses_by_station_code(statuses):
     checkAllTimesNotNaive(statuses)
@@ -353,13 +436,12 @@ def get_all_unit_summaries(start_time=None, end_time=None, escalators=False, ele
 
     unit_to_summary = {}
 
-    # NOTE: This function could be improved by making a single call to db.escalator_statuses.find() and
-    # aggregating.
-    for oid in oids:
+    unit_id_to_oid = dict((u.unit_id, u.pk) for u in Unit.objects(pk__in = list(oids)).only('unit_id'))
+
+    for unit_id, statuses in iter_unit_statuses(unit_ids = unit_id_to_oid.keys(),
+                                                start_time = start_time, end_time = end_time):
         gevent.sleep(0.0)
-        unit = Unit.objects(pk = oid).get()
-        statuses = unit.get_statuses(start_time = start_time, end_time = end_time)
-        #statuses = get_unit_statuses(object_id = oid, start_time = start_time, end_time = end_time)
+        oid = unit_id_to_oid[unit_id]
         et = end_time if end_time is not None else curTime
         st = start_time if start_time is not None else min(s['time'] for s in statuses)
         summary = summarize_statuses(statuses, st, et)
@@ -375,14 +457,109 @@ def get_all_unit_summaries(start_time=None, end_time=None, escalators=False, ele
 
 ###############################################################################
 # Get all escalator statuses.
-# Return a dictionary from escalator to status list, in chronological order
+# Return a dictionary from unit_id to status list, in chronological order
 def get_all_unit_statuses():
 
-    statuses = UnitStatus.objects.order_by('time').select_related()
-    unit_id_to_statuses = defaultdict(list)
+    unit_id_to_statuses = {}
 
-    for s in statuses:
-        s.add_timezones()
-        unit_id_to_statuses[s.unit.pk].append(s)
+    for unit_id, statuses in iter_unit_statuses():
+        unit_id_to_statuses[unit_id] = statuses[::-1]
 
     return unit_id_to_statuses
+
+###############################################################################
+# Bulk status loading
+#
+# Stream the escalator_statuses collection once, sorted by unit and time,
+# instead of issuing queries for each unit.
+
+# Fields (by database name) loaded for each status by default. These are the
+# denormalized fields needed by StatusGroup and the JSON writers.
+STATUS_LOADER_FIELDS = ['escalator_id', 'unit_id', 'time', 'end_time', 'metro_open_time',
+                        'update_type', 'tickDelta', 'symptom_description', 'symptom_category']
+
+def unit_status_from_son(son):
+    """
+    Build a UnitStatus from a raw escalator_statuses document,
+    with non-naive times.
+    """
+    status = UnitStatus._from_son(son)
+    status._add_timezones()
+    return status
+
+def pad_status_docs(docs, start_time = None, end_time = None):
+    """
+    Select the raw status documents for a single unit (in descending order
+    of time) with time in [start_time, end_time], padded with the documents
+    that preceed and follow the time range up to the first operational status,
+    to provide context for StatusGroup (see Unit._get_unit_statuses).
+    """
+    def is_operational(d):
+        return d.get('symptom_category') == 'ON'
+
+    # Times are stored as naive UTC datetimes.
+    def to_db_time(t):
+        if t is None:
+            return None
+        return toUtc(t).replace(tzinfo = None)
+
+    start_time = to_db_time(start_time)
+    end_time = to_db_time(end_time)
+
+    statuses = [d for d in docs if (start_time is None or d['time'] >= start_time) and \
+                                   (end_time is None or d['time'] <= end_time)]
+
+    if start_time is not None and ((not statuses) or not is_operational(statuses[-1])):
+        preceeding = []
+        for d in docs:
+            if d['time'] < start_time:
+                preceeding.append(d)
+                if is_operational(d):
+                    break
+        statuses.extend(preceeding)
+
+    if end_time is not None and ((not statuses) or not is_operational(statuses[0])):
+        following = []
+        for d in reversed(docs):
+            if d['time'] > end_time:
+                following.append(d)
+                if is_operational(d):
+                    break
+        statuses = following[::-1] + statuses
+
+    return statuses
+
+def iter_unit_statuses(unit_ids = None, start_time = None, end_time = None,
+                       factory = unit_status_from_son, fields = STATUS_LOADER_FIELDS,
+                       batch_size = 1000):
+    """
+    Stream the statuses of all units from the database with a single query.
+    Yield (unit_id, statuses) for each unit with statuses, in order of unit_id,
+    where statuses are in descending order of time (like Unit.get_statuses).
+
+    unit_ids: If provided, only load statuses for these units.
+    start_time, end_time: If provided, select statuses in this time range,
+                          padded with the statuses which preceed and follow
+                          the range, as in Unit.get_statuses.
+    factory: Function to convert a raw status document to a status.
+    fields: Database fields to load. If None, all fields are loaded.
+    """
+    collection = UnitStatus._get_collection()
+
+    spec = {}
+    if unit_ids is not None:
+        spec['unit_id'] = {'$in' : list(unit_ids)}
+
+    # Sort in the order of the (unit_id, -time) index.
+    sort = [('unit_id', pymongo.ASCENDING), ('time', pymongo.DESCENDING)]
+    cursor = collection.find(spec, fields = fields, sort = sort, timeout = False)
+    cursor.batch_size(batch_size)
+
+    try:
+        for unit_id, docs in itertools.groupby(cursor, lambda d: d.get('unit_id')):
+            docs = list(docs)
+            if start_time is not None or end_time is not None:
+                docs = pad_status_docs(docs, start_time, end_time)
+            yield unit_id, [factory(d) for d in docs]
+    finally:
+        cursor.close()
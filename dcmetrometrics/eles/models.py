@@ -4,7 +4,8 @@ Models for eles data.
 
 from mongoengine import *
 from operator import attrgetter
-from ..common.metroTimes import TimeRange, UTCToLocalTime, toUtc, tzny, utcnow, dateToOpen
+from ..common.metroTimes import TimeRange, UTCToLocalTime, toUtc, tzny, utcnow, dateToOpen, \
+  toEpochMicros, metroOpenSeconds
 from ..common.WebJSONMixin import WebJSONMixin
 from ..common.DataWriteable import DataWriteable
 from ..common.utils import gen_days
@@ -12,8 +13,16 @@ from .defs import symptomToCategory, SYMPTOM_CHOICES
 from ..common import dbGlobals
 from .misc_utils import *
 from .StatusGroup import StatusGroup
+from .StatusRecord import as_unit_status
+
+from pymongo.errors import OperationFailure
+from bson.dbref import DBRef
+from bson.son import SON
 
 from datetime import timedelta, datetime, date
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import itertools
 import sys
 
 
@@ -68,6 +77,35 @@ class KeyStatuses(WebJSONMixin, EmbeddedDocument):
   web_json_fields = ['lastFixStatus', 'lastBreakStatus', 'lastInspectionStatus',
   'lastOperationalStatus', 'currentBreakStatus', 'lastStatus']
 
+  def copy(self):
+    """
+    Return a copy of the key statuses. The raw status references are copied,
+    so that making the copy does not dereference them.
+    """
+    return KeyStatuses(**dict((k, self._data.get(k, None)) for k in self._fields))
+
+  @classmethod
+  def dereference_all(cls, key_statuses_list):
+    """
+    Dereference the statuses of several KeyStatuses with a single query,
+    instead of one query per reference when the fields are accessed.
+    """
+    key_statuses_list = [ks for ks in key_statuses_list if ks is not None]
+    ids = set()
+    for ks in key_statuses_list:
+      for k in cls.web_json_fields:
+        ref = ks._data.get(k, None)
+        if isinstance(ref, DBRef):
+          ids.add(ref.id)
+    if not ids:
+      return
+    id_to_status = dict((s.pk, s) for s in UnitStatus.objects(pk__in = list(ids)))
+    for ks in key_statuses_list:
+      for k in cls.web_json_fields:
+        ref = ks._data.get(k, None)
+        if isinstance(ref, DBRef) and ref.id in id_to_status:
+          ks._data[k] = id_to_status[ref.id]
+
 
   @classmethod
   def get_last_symptoms(cls, unit_ids = None):
@@ -102,13 +140,100 @@ class KeyStatuses(WebJSONMixin, EmbeddedDocument):
       # then the lastBreak status is that of the CALLBACK/REPAIR, since it is the
       # first broken status in the stretch of brokeness.
 
+    The statuses can be UnitStatus documents or StatusRecords.
+    Return a KeyStatuses record, without saving.
+
+    The key statuses are selected with a single pass over the statuses in
+    time order, and match those of select_key_statuses_OLD.
+    """
+
+    checkAllTimesNotNaive(statuses)
+
+    # Check that these statuses concern a single escalator
+    escids = set(s.unit_id for s in statuses)
+    if len(escids) > 1:
+        raise RuntimeError('get_key_statuses: received status list for multiple escalators!')
+
+    unit_id = escids.pop()
+
+    # Sort statuses by time in descending order
+    statusesRevCron = sorted(statuses, key = attrgetter('time'), reverse=True)
+    statusesCron = sorted(statuses, key = attrgetter('time'))
+    statuses = statusesRevCron
+
+    # Walk forward in time, one group of statuses with the same time at a time.
+    # Associate the most recent operational status with the first break
+    # which strictly follows it, and the most recent break with the first
+    # operational status which strictly follows it. The last such pairs give
+    # the lastBreak and the lastFix.
+    lastBreak = None
+    lastFix = None
+    haveOpWithoutBreak = False
+    haveBreakWithoutFix = False
+    for t, group in itertools.groupby(statusesCron, attrgetter('time')):
+      group = list(group)
+      groupOp = get_one(rec for rec in group if rec.symptom_category == 'ON')
+      groupBreak = get_one(rec for rec in group if rec.symptom_category == 'BROKEN')
+      if groupBreak is not None:
+        if haveOpWithoutBreak:
+          lastBreak = groupBreak
+          haveOpWithoutBreak = False
+      if groupOp is not None:
+        if haveBreakWithoutFix:
+          lastFix = groupOp
+          haveBreakWithoutFix = False
+        haveOpWithoutBreak = True
+      if groupBreak is not None:
+        haveBreakWithoutFix = True
+
+    lastOp = get_one(rec for rec in statuses if rec.symptom_category == 'ON')
+    lastStatus = statuses[0] if statuses else None
+
+    # Get the break since the most recent operational status, if it exists.
+    currentBreak = get_one(rec for rec in statuses if rec.symptom_category == 'BROKEN')
+    if currentBreak and lastOp and currentBreak.time < lastOp.time:
+        currentBreak = None 
+
+    # Get the last inspection status
+    lastInspection = get_one(rec for rec in statuses if rec.symptom_category == 'INSPECTION')
+
+    data = { 'lastFixStatus' : lastFix,
+            'lastInspectionStatus' : lastInspection,
+            'lastBreakStatus': lastBreak,
+            'lastOperationalStatus' : lastOp,
+            'lastStatus' : lastStatus,
+            'currentBreakStatus' : currentBreak
+    }
+    data = dict((k, as_unit_status(v)) for k, v in data.iteritems())
+
+    return cls(unit_id = unit_id, **data)
+
+  @classmethod
+  def select_key_statuses_OLD(cls, statuses):
+    """
+      This is the original implementation of select_key_statuses, which
+      is quadratic in the number of statuses. It is kept for benchmarking
+      and testing.
+
+      # From a list of statuses, select key statuses
+      # -lastFix: The oldest operational status which follows the most recent break
+      # -lastBreak: The most recent broken status which has been fixed.
+      # -lastInspection: The last inspection status
+      # -lastOp: The most recent operational status
+      # -lastStatus: The most recent status
+      # Note: If there is a transition between broken states, such as :
+      # ... OPERATIONAL -> CALLBACK/REPAIR -> MINOR REPAIR -> OPERATIONAL,
+      # then the lastBreak status is that of the CALLBACK/REPAIR, since it is the
+      # first broken status in the stretch of brokeness.
+
+    The statuses can be UnitStatus documents or StatusRecords.
     Return a KeyStatuses record, without saving.
     """
 
     checkAllTimesNotNaive(statuses)
 
     # Check that these statuses concern a single escalator
-    escids = set(s.unit.unit_id for s in statuses)
+    escids = set(s.unit_id for s in statuses)
     if len(escids) > 1:
         raise RuntimeError('get_key_statuses: received status list for multiple escalators!')
 
@@ -170,6 +295,7 @@ class KeyStatuses(WebJSONMixin, EmbeddedDocument):
             'lastStatus' : lastStatus,
             'currentBreakStatus' : currentBreak
     }
+    data = dict((k, as_unit_status(v)) for k, v in data.iteritems())
 
     return cls(unit_id = unit_id, **data)
 
@@ -384,7 +510,97 @@ class Station(WebJSONMixin, DataWriteable, Document):
     return list(q)
 
   @classmethod
-  def get_station_directory(cls):
+  def get_recent_statuses_by_code(cls, codes, n = 20):
+    """
+    Get the n most recent statuses for each station code, using a single aggregation
+    and a single query for the statuses.
+
+    Return a dictionary from station code to a list of statuses in descending order of time,
+    or None if the server does not support the aggregation ($slice requires MongoDB 3.2).
+    """
+    pipeline = [{'$match' : {'station_code' : {'$in' : list(codes)}}},
+                {'$sort' : SON([('station_code', 1), ('time', -1)])},
+                {'$group' : {'_id' : '$station_code', 'ids' : {'$push' : '$_id'}}},
+                {'$project' : {'ids' : {'$slice' : ['$ids', n]}}}]
+    try:
+      res = UnitStatus._get_collection().aggregate(pipeline, allowDiskUse = True)
+    except OperationFailure as e:
+      logger.warning("Could not aggregate recent statuses: %s"%str(e))
+      return None
+    groups = res['result'] if isinstance(res, dict) else list(res)
+
+    ids = [i for g in groups for i in g['ids']]
+    id_to_status = dict((s.pk, s) for s in UnitStatus.objects(pk__in = ids))
+    return dict((g['_id'], [id_to_status[i] for i in g['ids'] if i in id_to_status]) for g in groups)
+
+  @classmethod
+  def get_station_directory(cls, units = None):
+
+    """Form the station directory. Merge stations that share the same name 
+    (i.e. both platforms at Fort Totten, Gallery Place, etc.)
+
+    units: The units to include. If None, all units are loaded with a single query.
+
+    The recent statuses for all stations come from a single aggregation, and the
+    key statuses for all units are dereferenced with a single query.
+    The original implementation is get_station_directory_OLD.
+    """
+    n = 20
+    all_stations = list(cls.objects)
+    code_to_name = dict((s.code, s.long_name) for s in all_stations)
+    code_to_station = dict((s.code, s) for s in all_stations)
+    all_units = list(Unit.objects) if units is None else list(units)
+    KeyStatuses.dereference_all(u.key_statuses for u in all_units)
+
+    # Stations sharing a name share their recent statuses (see get_recent_statuses).
+    all_codes = set(c for station in all_stations for c in station.all_codes)
+    code_to_recent = cls.get_recent_statuses_by_code(all_codes, n)
+
+    def recent_statuses(station):
+      if code_to_recent is None:
+        return station.get_recent_statuses(n)
+      statuses = [s for c in set(station.all_codes) for s in code_to_recent.get(c, [])]
+      statuses.sort(key = attrgetter('time'), reverse = True)
+      return statuses[:n]
+
+    # Collection units by station names
+    station_to_data = {}
+    for station in all_stations:
+      station_name = station.long_name
+      station_data = station_to_data.get(station_name, None)
+      if not station_data:
+        station_data = {'stations': [station], 
+                        'escalators': [],
+                        'elevators': [],
+                        'recent_statuses': recent_statuses(station)}
+      else:
+        station_data['stations'].append(station)
+      station_to_data[station_name] = station_data
+
+    for u in all_units:
+
+      station_name = code_to_name.get(u.station_code, None)
+      station_data = station_to_data.get(station_name, None) if station_name else None
+
+      # If the unit has a station code that we are not expecting,
+      # do not include it in the station directory.
+      if station_data is None:
+        continue
+
+      if u.is_escalator():
+        station_data['escalators'].append(u)
+      elif u.is_elevator():
+        station_data['elevators'].append(u)
+
+    # Sort the units by their ids.
+    for station_name, station_data in station_to_data.iteritems():
+      station_data['escalators'].sort(key = attrgetter('unit_id'))
+      station_data['elevators'].sort(key = attrgetter('unit_id'))
+
+    return station_to_data
+
+  @classmethod
+  def get_station_directory_OLD(cls):
 
     """Form the station directory. Merge stations that share the same name 
     (i.e. both platforms at Fort Totten, Gallery Place, etc.)
@@ -552,6 +768,17 @@ class Unit(WebJSONMixin, DataWriteable, Document):
     """
     return self._get_unit_statuses(object_id = self.pk, *args, **kwargs)
 
+  def get_statuses_since(self, start_time):
+    """
+    Get the statuses for this unit which start at or after start_time,
+    in descending order of time. Unlike get_statuses, the result is not
+    padded with the statuses preceding start_time.
+    """
+    statuses = list(UnitStatus.objects(unit = self.pk, time__gte = start_time).order_by('-time'))
+    for s in statuses:
+      s._add_timezones()
+    return statuses
+
   def compute_performance_summary(self, statuses = None, save = False, end_time = None):
     """
     Compute or recompute the historical performance summary for a unit.
@@ -628,7 +855,28 @@ class Unit(WebJSONMixin, DataWriteable, Document):
     """
     Update a unit's history with a new unit status.
 
-    This will update the unit's key_status record.
+    This will update the unit's key_status record, and save the previous
+    status, the new status and the unit.
+    """
+    previous_status = self.apply_update(unit_status)
+    if previous_status is None:
+      return
+
+    # Can we use a mongodb transaction here?
+    previous_status.save()
+    unit_status.save()
+    self.save()
+
+  def apply_update(self, unit_status):
+    """
+    Update a unit's history with a new unit status, without saving.
+
+    This sets the update_type of the new status, the end_time of the
+    previous status and updates the unit's key_status record.
+
+    Return the previous status, or None if the status has not changed.
+    The caller is responsible for saving the previous status, the new
+    status and the unit (see dbUtils.save_unit_updates).
     """
 
     if self.key_statuses is None:
@@ -647,7 +895,7 @@ class Unit(WebJSONMixin, DataWriteable, Document):
     # Check if there has been a change in status
     # If not, do nothing.
     if unit_status.symptom_description == key_statuses.lastStatus.symptom_description:
-      return
+      return None
 
     if unit_status.symptom_category == 'ON':
       
@@ -690,19 +938,17 @@ class Unit(WebJSONMixin, DataWriteable, Document):
       else:
         unit_status.update_type = "Update"
 
-    # Can we use a mongodb transaction here?
-    
     # Update the end_time of the previous status.
-    key_statuses.lastStatus.end_time = unit_status.time
-    key_statuses.lastStatus.save()
+    previous_status = key_statuses.lastStatus
+    previous_status.end_time = unit_status.time
 
     # Update the keyStatus with the new status.
     key_statuses.lastStatus = unit_status
-    unit_status.save()
 
-    # Save the updated key_statuses to self.
+    # Set the updated key_statuses on self.
     self.key_statuses = key_statuses
-    self.save()
+
+    return previous_status
 
 
   @staticmethod
@@ -802,29 +1048,29 @@ class Unit(WebJSONMixin, DataWriteable, Document):
     if not statuses:
       statuses = self.get_statuses()
 
-    docs = []
-    for day in gen_days(start_day, last_day):
-
-      logger.info("Computing daily service report for unit %s on %s"%(self.unit_id,
-         day.strftime("%Y-%m-%d")))
+    logger.info("Computing daily service reports for unit %s from %s to %s"%(self.unit_id,
+       start_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")))
 
-      dsr = DailyServiceReport.compute_for_unit(self, day, statuses = statuses)
-
-      docs.append(dsr)
+    docs = DailyServiceReport.compute_for_unit_days(self, start_day, last_day, statuses = statuses)
 
     if save:
 
       # By default we will erase any existing daily service reports on these days
-      existing = DailyServiceReport.objects(day__gte = start_day.strftime("%Y-%m-%d"),
-                                            day__lt = last_day.strftime("%Y-%m-%d"),
-                                            unit_id = self.unit_id).no_cache()
-      logger.info("Removing %i existing daily service reports for unit %s"%(existing.count(), self.unit_id))
-      existing.delete()
-
-      DailyServiceReport.objects.insert(docs)
+      self.delete_daily_service_reports(start_day, last_day)
+      DailyServiceReport.objects.insert(docs, load_bulk = False)
 
     return docs
 
+  def delete_daily_service_reports(self, start_day, last_day):
+    """
+    Delete the unit's daily service reports from start_day to last_day (exclusive).
+    """
+    existing = DailyServiceReport.objects(day__gte = start_day.strftime("%Y-%m-%d"),
+                                          day__lt = last_day.strftime("%Y-%m-%d"),
+                                          unit_id = self.unit_id).no_cache()
+    logger.info("Removing %i existing daily service reports for unit %s"%(existing.count(), self.unit_id))
+    existing.delete()
+
 #############################################
 # New format for UnitStatus, with reference to symptoms in new format.
 class UnitStatus(WebJSONMixin, DataWriteable, Document):
@@ -990,10 +1236,135 @@ class DailyServiceReport(WebJSONMixin, DataWriteable, Document):
     ret.num_breaks = sg.num_breaks
     ret.num_inspections = sg.num_inspections
     ret.num_fixes = sg.num_fixes
-    ret.statuses = sg.statuses
+    ret.statuses = [as_unit_status(s) for s in sg.statuses]
 
     return ret
 
+  @classmethod
+  def compute_for_unit_days(cls, unit, start_day, last_day, statuses = None):
+    """
+    Compute the daily service reports for a unit for each day from start_day
+    to last_day (exclusive).
+
+    This gives the same reports as calling compute_for_unit for each day, but
+    sweeps over the unit's statuses once instead of building a StatusGroup
+    over the full status history for every day.
+    """
+
+    if not statuses:
+      statuses = unit.get_statuses()
+
+    checkAllTimesNotNaive(statuses)
+    statuses = sorted(statuses, key = attrgetter('time'))
+    days = list(gen_days(start_day, last_day))
+
+    # The sweep needs every status but the last to have an end_time, and
+    # end times that do not decrease. Otherwise, compute each day separately.
+    end_times = [getattr(s, 'end_time', None) for s in statuses[:-1]]
+    if not statuses or not all(end_times) or \
+       any(e1 > e2 for e1, e2 in zip(end_times[:-1], end_times[1:])):
+      return [cls.compute_for_unit(unit, day, statuses = statuses) for day in days]
+
+    n = len(statuses)
+    times = [s.time for s in statuses]
+    first_time = times[0]
+    last_end_time = getattr(statuses[-1], 'end_time', None)
+    last_is_active = last_end_time is None
+
+    # Breaks and fixes depend on all preceeding statuses, as in StatusGroup.
+    # Keep cumulative counts, indexed by status.
+    break_counts = [0]
+    fix_counts = [0]
+    wasBroken = False
+    for s in statuses:
+      is_break = is_fix = False
+      if s.symptom_category == 'ON':
+        is_fix = wasBroken
+        wasBroken = False
+      elif s.symptom_category == 'BROKEN':
+        is_break = not wasBroken
+        wasBroken = True
+      break_counts.append(break_counts[-1] + is_break)
+      fix_counts.append(fix_counts[-1] + is_fix)
+
+    def count_between(counts, start_time, end_time):
+      i = bisect_left(times, start_time)
+      j = bisect_right(times, end_time)
+      return counts[j] - counts[i] if j > i else 0
+
+    docs = []
+    lo = 0 # The first status which may overlap the day
+    for day in days:
+
+      start_time = dateToOpen(day)
+      end_time = dateToOpen(day + timedelta(days=1))
+
+      ret = cls()
+      ret.unit_id = unit.unit_id
+      ret.day = day.strftime("%Y-%m-%d")
+      docs.append(ret)
+
+      if end_time < first_time:
+        ret.availability = 0.0
+        ret.broken_time_percentage = 0.0
+        ret.num_breaks = 0
+        ret.num_inspections = 0
+        ret.num_fixes = 0
+        ret.statuses = []
+        continue
+
+      # Adjust the start_time and end_time, as in StatusGroupBase
+      if start_time < first_time:
+        start_time = first_time
+      if last_end_time and end_time > last_end_time and last_end_time > start_time:
+        end_time = last_end_time
+
+      # Collect the statuses which overlap the day
+      while lo < n - 1 and statuses[lo].end_time < start_time:
+        lo += 1
+      if lo == n - 1 and not last_is_active and statuses[lo].end_time < start_time:
+        lo = n
+      hi = lo
+      while hi < n and times[hi] <= end_time:
+        if hi == n - 1 and last_is_active and not times[hi] < end_time:
+          break
+        hi += 1
+      overlapping = statuses[lo:hi]
+
+      # Allocate metro open time to each symptom category and count
+      # inspections, using the statuses trimmed to the day.
+      timeAllocation = defaultdict(lambda: 0.0)
+      num_inspections = 0
+      wasInspection = False
+      for k, s in enumerate(overlapping):
+        t = s.time
+        if k == 0 and t < start_time:
+          t = start_time
+        e = end_time if k == len(overlapping) - 1 else s.end_time
+        timeAllocation[s.symptom_category] += metroOpenSeconds(toEpochMicros(t), toEpochMicros(e))
+        if s.symptom_category == 'INSPECTION':
+          if not wasInspection and t >= start_time and t <= end_time:
+            num_inspections += 1
+          wasInspection = True
+        elif s.symptom_category == 'ON':
+          wasInspection = False
+
+      metroOpenTime = metroOpenSeconds(toEpochMicros(start_time), toEpochMicros(end_time))
+      availability = 0.0
+      broken_time_percentage = 0.0
+      if metroOpenTime > 0.0:
+        availability = timeAllocation['ON']/metroOpenTime
+        broken_time_percentage = float(timeAllocation['BROKEN'])/metroOpenTime
+
+      ret.availability = availability
+      ret.broken_time_percentage = broken_time_percentage
+      ret.num_breaks = count_between(break_counts, start_time, end_time)
+      ret.num_inspections = num_inspections
+      ret.num_fixes = count_between(fix_counts, start_time, end_time)
+      ret.statuses = [as_unit_status(s) for s in overlapping]
+
+    return docs
+
 class UnitTypeServiceReport(WebJSONMixin, DataWriteable, EmbeddedDocument):
 
   availability = FloatField(required = True)
@@ -1115,8 +1486,18 @@ class EscalatorAppState(Document):
   lastRunTime = DateTimeField()
   lastDailyStatsTime = DateTimeField()
   lastPerformanceSummaryTime = DateTimeField()
+  # Incremented when units or their key statuses are changed outside of the app,
+  # so that the app reloads its UnitStateCache.
+  unit_state_version = IntField(default = 0)
   meta = {'collection' : 'escalator_appstate'}
 
+  @classmethod
+  def bump_unit_state_version(cls):
+    """
+    Invalidate the unit state cache of a running app.
+    """
+    cls.objects(pk = 1).update_one(inc__unit_state_version = 1, upsert = True)
+
   @classmethod 
   def get(cls):
     try:
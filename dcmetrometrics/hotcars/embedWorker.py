@@ -0,0 +1,204 @@
+"""
+hotcars.embedWorker
+
+Fetch the oEmbed html of hot car tweets from a greenlet, so that a burst of
+new tweets does not serialize Twitter round trips inside the HotCarApp tick.
+
+Tweets are saved with a placeholder embed (see fallback_embed_html) and
+embed_pending set. The OEmbedFetcher fetches the embeds of the pending tweets
+with a bounded pool of greenlets, retries failed fetches with exponential
+backoff, saves the embeds, and then calls on_embedded (e.g. to publish the
+hot car json).
+
+TweetEmbedStore: The pending tweets and their embeds, in the hotcars_tweets collection.
+
+OEmbedFetcher: Fetch and save the embeds of pending tweets.
+"""
+import cgi
+
+import gevent
+from gevent.event import Event
+from gevent.pool import Pool
+
+from .models import HotCarTweet
+from ..common.tickMetrics import monotonic
+
+import logging
+logger = logging.getLogger('HotCarApp')
+
+def fallback_embed_html(tweet_id, text, handle):
+    """
+    Html shown for a tweet until its oEmbed html has been fetched.
+    """
+    url = 'https://twitter.com/%s/status/%i'%(handle, tweet_id)
+    return u'<blockquote class="twitter-tweet" align="left"><p>%s</p>&mdash; @%s <a href="%s">%s</a></blockquote>\n'%\
+        (cgi.escape(text), cgi.escape(handle), url, url)
+
+
+###############################################################################
+class TweetEmbedStore(object):
+    """
+    Read and save the embeds of tweets in the hotcars_tweets collection.
+    """
+
+    def pending_tweet_ids(self):
+        docs = HotCarTweet._get_collection().find({'embed_pending' : True}, fields = ['_id'])
+        return [d['_id'] for d in docs]
+
+    def set_embed(self, tweet_id, embed_html):
+        HotCarTweet._get_collection().update({'_id' : tweet_id},
+            {'$set' : {'embed_html' : embed_html, 'embed_pending' : False}})
+
+    def give_up(self, tweet_id):
+        """
+        Stop trying to fetch the embed of a tweet. The tweet keeps its placeholder embed.
+        """
+        HotCarTweet._get_collection().update({'_id' : tweet_id}, {'$set' : {'embed_pending' : False}})
+
+
+###############################################################################
+class OEmbedFetcher(object):
+    """
+    Fetch the oEmbed html of pending tweets with a bounded pool of greenlets.
+    """
+
+    def __init__(self, api_factory, store = None, pool_size = 4, max_attempts = 5,
+                 backoff = 30.0, max_backoff = 3600.0, poll_interval = 300.0,
+                 on_embedded = None, profiler = None, clock = monotonic):
+        """
+        api_factory: Function which returns the python-twitter Api.
+        store: The TweetEmbedStore.
+        pool_size: Maximum number of concurrent oEmbed requests.
+        max_attempts: Number of failed fetches after which a tweet keeps its placeholder embed.
+        backoff: Delay before retrying a failed fetch, in seconds. The delay doubles
+                 with each failure, up to max_backoff.
+        poll_interval: Maximum number of seconds between checks for pending tweets.
+        on_embedded: Function called after a round in which embeds were saved.
+        profiler: An optional tickMetrics.TickProfiler, used to count the fetches.
+        """
+        self.api_factory = api_factory
+        self.store = store if store is not None else TweetEmbedStore()
+        self.pool_size = pool_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.on_embedded = on_embedded
+        self.profiler = profiler
+        self.clock = clock
+        self.attempts = {} # tweet id -> number of failed fetches
+        self.next_attempt = {} # tweet id -> clock time of the next fetch
+        self.greenlet = None
+        self._loaded = False
+        self._event = Event()
+
+    def __len__(self):
+        return len(self.next_attempt)
+
+    def _count(self, name, n = 1):
+        if self.profiler is not None and n:
+            self.profiler.count(name, n)
+
+    def _delay(self, attempts):
+        return min(self.max_backoff, self.backoff * 2**(attempts - 1))
+
+    def enqueue(self, tweet_id):
+        """
+        Fetch the embed of a tweet in the next round.
+        """
+        self.next_attempt[tweet_id] = self.clock()
+        self._event.set()
+
+    def load_pending(self):
+        """
+        Enqueue the tweets which are pending in the store, e.g. from before a restart.
+        """
+        for tweet_id in self.store.pending_tweet_ids():
+            self.next_attempt.setdefault(tweet_id, self.clock())
+        self._loaded = True
+
+    def fetch(self, tweet_id):
+        """
+        Return the oEmbed html of a tweet.
+        """
+        api = self.api_factory()
+        embedding = api.GetStatusOembed(tweet_id, hide_thread=False, omit_script=True, align='left')
+        return embedding['html']
+
+    def _fetch(self, tweet_id):
+        try:
+            return tweet_id, self.fetch(tweet_id), None
+        except Exception as e:
+            return tweet_id, None, e
+
+    def _done(self, tweet_id):
+        self.next_attempt.pop(tweet_id, None)
+        self.attempts.pop(tweet_id, None)
+
+    def run_once(self):
+        """
+        Fetch the embeds of the tweets which are due, and save them.
+        Return the number of embeds saved.
+        """
+        if not self._loaded:
+            self.load_pending()
+        now = self.clock()
+        due = [tweet_id for tweet_id, t in self.next_attempt.iteritems() if t <= now]
+        if not due:
+            return 0
+
+        pool = Pool(self.pool_size)
+        embedded = 0
+        for tweet_id, embed_html, error in pool.imap_unordered(self._fetch, due):
+            if error is None:
+                self.store.set_embed(tweet_id, embed_html)
+                self._done(tweet_id)
+                embedded += 1
+                continue
+
+            attempts = self.attempts.get(tweet_id, 0) + 1
+            self._count('embed_errors')
+            if attempts >= self.max_attempts:
+                logger.error('Giving up on the oEmbed of tweet %i after %i attempts: %s'%(tweet_id, attempts, str(error)))
+                self.store.give_up(tweet_id)
+                self._done(tweet_id)
+            else:
+                logger.warning('Could not get the oEmbed of tweet %i: %s. Retrying.'%(tweet_id, str(error)))
+                self.attempts[tweet_id] = attempts
+                self.next_attempt[tweet_id] = self.clock() + self._delay(attempts)
+
+        self._count('embeds_fetched', embedded)
+        if embedded and self.on_embedded is not None:
+            self.on_embedded()
+        return embedded
+
+    def _wait_time(self):
+        if not self.next_attempt:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, min(self.next_attempt.itervalues()) - self.clock()))
+
+    def _run(self):
+        while True:
+            self._event.wait(timeout = self._wait_time())
+            self._event.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error('Caught exception when fetching oEmbeds: %s'%str(e))
+                gevent.sleep(self.backoff)
+
+    def start(self):
+        """
+        Start the fetcher greenlet.
+        """
+        if self.greenlet is None or self.greenlet.dead:
+            self.greenlet = gevent.spawn(self._run)
+        return self.greenlet
+
+    def stop(self):
+        """
+        Stop the fetcher greenlet.
+        """
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
@@ -5,6 +5,7 @@ Utility functions for the HotCars app
 
 """
 import pymongo
+import os
 import sys
 import re
 import gc
@@ -14,20 +15,27 @@ from dateutil.tz import tzlocal
 import time
 from collections import defaultdict, Counter
 from operator import itemgetter
+from functools import partial
 from mongoengine import DoesNotExist, NotUniqueError
 
 from . import models
 from .twitter_api import getTwitterAPI
-from .process_tweets import (preprocessText, getHotCarDataFromText,
+from .process_tweets import (preprocessText, getHotCarDataFromText, getHotCarDataFromTweet,
         uniqueTweets, tweetIsValidReport, isRetweet)
-from .models import (HotCarAppState, HotCarTweet, HotCarTweeter, HotCarReport, CarsForbiddenByMention, Temperature)
+from .models import (HotCarAppState, HotCarTweet, HotCarTweeter, HotCarReport, HotCarReportCount,
+    CarsForbiddenByMention, Temperature)
+from .reportIndex import HotCarReportIndex
+from .embedWorker import OEmbedFetcher, fallback_embed_html
+from .twitterFanout import TwitterFanout
 
 from twitter import TwitterError
-from ..common.globals import WWW_DIR
+from ..common.globals import WWW_DIR, DATA_DIR
 from ..common import twitterUtils
 from ..common import dbGlobals
 from ..common.JSONifier import JSONWriter
+from ..common.JSONPublisher import JSONPublisher
 from ..common.metroTimes import utcnow, toLocalTime, UTCToLocalTime, tzutc
+from ..common.tickMetrics import TickProfiler
 
 import logging
 logger = logging.getLogger('HotCarApp')
@@ -36,6 +44,30 @@ DEBUG = logger.debug
     
 ME = 'MetroHotCars'.upper()
 
+# Time and database operations spent in each phase of the tick.
+profiler = TickProfiler('HotCarApp',
+                        history = 200,
+                        metrics_path = os.path.join(DATA_DIR, 'HotCarApp.metrics.json'),
+                        write_interval = 10)
+
+# Index of the hot car reports, used to find duplicate reports.
+report_index = HotCarReportIndex()
+
+# Publish the hot car json when the oEmbed html of new tweets has been fetched.
+json_publisher = JSONPublisher(JSONWriter(WWW_DIR), min_interval = 30.0, profiler = profiler)
+embed_fetcher = OEmbedFetcher(getTwitterAPI, on_embedded = json_publisher.hotcars_dirty, profiler = profiler)
+
+# Twitter searches for hot car reports, made concurrently with the mentions on each tick.
+SEARCH_QUERIES = ['wmata hotcar', 'wmata hot car', 'wmata hotcars', 'wmata hot cars']
+twitter_fanout = TwitterFanout(pool_size = 6, timeout = 20.0, profiler = profiler)
+
+def start_workers():
+    """
+    Start the greenlets which fetch the tweet embeds and publish the json.
+    """
+    json_publisher.start()
+    embed_fetcher.start()
+
 # Words which are not allowed in hot car report tweets
 all_forbidden_words = set(w.upper() for w in ['cold', 'cool', 'freeze', 'freezing'])
 def hasForbiddenWord(t):
@@ -62,6 +94,10 @@ def getWundergroundAPI():
 
 #######################################
 def tick(tweetLive = False):
+    with profiler.tick():
+        _tick(tweetLive)
+
+def _tick(tweetLive = False):
 
     dbGlobals.connect()
     curTime = utcnow()
@@ -74,7 +110,9 @@ def tick(tweetLive = False):
     DEBUG("Garbage collect returned %i"%count)
 
             
-    appState = HotCarAppState.get()
+    with profiler.span('app_state'):
+        appState = HotCarAppState.get()
+        HotCarReportCount.ensure_built()
     lastTweetId = appState.lastTweetId if appState.lastTweetId else 0
 
     T = getTwitterAPI()
@@ -89,34 +127,8 @@ def tick(tweetLive = False):
         response = genResponseTweet(tweet.handle, getHotCarDataFromText(tweet.text))
         tweetResponses.append((tweet.tweet_id, response))
 
-    # Remove any tweets returned by Twitter search which mention ME. These
-    # will be collected by getMentions, which is careful
-    # about what cars are allowed to be reported by mention instead of hash tag.
-    def tweetMentionsMe(tweet):
-        mentions = (u.screen_name.upper() for u in tweet.user_mentions)
-        return ME in mentions
-
-    # Get the latest tweets about WMATA hotcars. Ignore tweets which
-    # mention MetroHotCars, as these will be processed by getMentions
-    queries = ['wmata hotcar', 'wmata hot car', 'wmata hotcars', 'wmata hot cars']
-    logger.info('Searching for hot car tweets...')
-    tweets = []
-    for q in queries:
-        queryResult = T.GetSearch(q, count=100, since_id = lastTweetId, result_type='recent', include_entities=True)
-        qtweets = (t for t in queryResult if not tweetMentionsMe(t))
-        tweets.extend(qtweets)
-    logger.info("Search return %i tweets", len(tweets))
-    for i, tweet in enumerate(tweets):
-        logger.info("\tTweet from %s: %s", tweet.user.screen_name, tweet.text)
-
-    # Find the max tweet id seen through twitter search
-    maxTweetId = max([t.id for t in tweets]) if tweets else 0
-    maxTweetId = max(maxTweetId, lastTweetId)
-
-    logger.info("Getting mentions from twitter.")
-    # Get tweets which mention MetroHotCars
-    tweets.extend(getMentions(curTime=curTime))
-    logger.info("Done getting mentions.")
+    # Get the latest tweets about WMATA hotcars, and the tweets which mention MetroHotCars
+    tweets, maxTweetId = getTweets(T, curTime, lastTweetId)
 
     # Make a set of unique tweets
     tweets = uniqueTweets(tweets)
@@ -149,68 +161,144 @@ def tick(tweetLive = False):
 
     logger.info('Filtered to %i tweets after removing tweets with forbidden words'%len(filteredTweets))
 
-    tweetData = [(t, getHotCarDataFromText(t.text)) for t in filteredTweets]
+    tweetData = [(t, getHotCarDataFromTweet(t)) for t in filteredTweets]
     tweetData = [(t, hcd) for t,hcd in tweetData if tweetIsValidReport(t, hcd)]
-    tweetData = filterDuplicateReports(tweetData)
+    with profiler.span('filter_duplicates'):
+        report_index.refresh()
+        tweetData = filterDuplicateReports(tweetData)
     tweetIds = set(t.id for t,hcd in tweetData)
 
     logger.info('Filtered to %i tweets after removing invalid and duplicate reports'%len(tweetData))
     logger.info('Have %i tweets about hot cars'%len(tweetData))
 
-    for tweet, hotCarData in tweetData:
-        validTweet = tweetIsValidReport(tweet, hotCarData)
-        if not validTweet:
-            continue
+    with profiler.span('process_tweets'):
+        for tweet, hotCarData in tweetData:
+            validTweet = tweetIsValidReport(tweet, hotCarData)
+            if not validTweet:
+                continue
 
-        updated = updateDBFromTweet(tweet, hotCarData)
+            updated = updateDBFromTweet(tweet, hotCarData)
 
-        # If we updated the database with data on this tweet,
-        # generate a response tweet
-        if updated:
-            user = tweet.user.screen_name
-            response = genResponseTweet(user, hotCarData)
-            tweetResponses.append((tweet.id, response))
+            # If we updated the database with data on this tweet,
+            # generate a response tweet
+            if updated:
+                user = tweet.user.screen_name
+                response = genResponseTweet(user, hotCarData)
+                tweetResponses.append((tweet.id, response))
 
     # Update the app state
-    HotCarAppState.update(lastRunTime = curTime, lastTweetId = maxTweetId)
+    with profiler.span('app_state'):
+        HotCarAppState.update(lastRunTime = curTime, lastTweetId = maxTweetId)
     
     # Tweet Responses
-    for tweetId, response in tweetResponses:
+    with profiler.span('broadcast'):
+        for tweetId, response in tweetResponses:
 
-        if response is None:
-            continue
+            if response is None:
+                continue
 
-        logger.info('Response for Tweet %i: %s'%(tweetId, response))
+            logger.info('Response for Tweet %i: %s'%(tweetId, response))
 
-        if tweetLive:
+            if tweetLive:
 
-            try:
+                try:
 
-                T.PostUpdate(response, in_reply_to_status_id = tweetId)
+                    T.PostUpdate(response, in_reply_to_status_id = tweetId)
 
-                # Update the acknowledgement status of the tweet
-                tweet_doc = HotCarTweet.objects(tweet_id = tweetId).get()
-                tweet_doc.acknowledged = True
-                tweet_doc.save()
+                    # Update the acknowledgement status of the tweet
+                    tweet_doc = HotCarTweet.objects(tweet_id = tweetId).get()
+                    tweet_doc.acknowledged = True
+                    tweet_doc.save()
 
-            except TwitterError as e:
+                except TwitterError as e:
 
-                logger.error('Caught TwitterError when trying to acknowledge tweet %i!: %s'%(tweetId, str(e)))
+                    logger.error('Caught TwitterError when trying to acknowledge tweet %i!: %s'%(tweetId, str(e)))
             
-            except DoesNotExist as e:
-                logger.error('Caught DoesNotExist when trying to mark tweet %i as acknowledged!:\n%s'%(tweetId, str(e)))
+                except DoesNotExist as e:
+                    logger.error('Caught DoesNotExist when trying to mark tweet %i as acknowledged!:\n%s'%(tweetId, str(e)))
 
     # Write hotcar json file for website if data has changed
     jwriter = JSONWriter(WWW_DIR)
     if tweetResponses:
         logger.info('Writing json data.')
-        jwriter.write_hotcars()
+        with profiler.span('json_writes'):
+            jwriter.write_hotcars()
 
     # Update daily maximum temperatures if necessary
     logger.info("Updating latest temperatures")
     wu = getWundergroundAPI()
-    Temperature.update_latest_temperatures(wu)
-    jwriter.write_hotcars_by_day()
+    with profiler.span('temperatures'):
+        Temperature.update_latest_temperatures(wu)
+    with profiler.span('json_writes'):
+        jwriter.write_hotcars_by_day()
+
+# Remove any tweets returned by Twitter search which mention ME. These
+# will be collected by getMentions, which is careful
+# about what cars are allowed to be reported by mention instead of hash tag.
+def tweetMentionsMe(tweet):
+    mentions = (u.screen_name.upper() for u in tweet.user_mentions)
+    return ME in mentions
+
+def getTweets(T, curTime, lastTweetId):
+    """
+    Get the latest tweets about WMATA hotcars and the tweets which mention MetroHotCars.
+    The searches, the mentions and MetroHotCars' own timeline are requested concurrently
+    through twitter_fanout, each with its own timeout.
+
+    Returns the tweets, and the max tweet id to save as the lastTweetId. If any search
+    fails, lastTweetId is kept so that the next tick searches since the same tweet.
+    Likewise, the mentions are only processed (and lastMentionsTweetId and lastSelfTweetId
+    only advanced) if both the mentions and the timeline requests succeed.
+    """
+    appState = HotCarAppState.get()
+    checkMentions = mentionsCheckDue(curTime, appState)
+
+    requests = [('search:%s'%q, partial(T.GetSearch, q, count=100, since_id = lastTweetId,
+                                         result_type='recent', include_entities=True))
+                for q in SEARCH_QUERIES]
+    if checkMentions:
+        lastMentionsTweetId = appState.lastMentionsTweetId if appState.lastMentionsTweetId else None
+        lastSelfTweetId = appState.lastSelfTweetId if appState.lastSelfTweetId else 0
+        requests.append(('mentions', partial(T.GetMentions, include_entities = True,
+                                             since_id = lastMentionsTweetId)))
+        requests.append(('self_timeline', partial(T.GetUserTimeline, screen_name = ME,
+                                                  since_id = lastSelfTweetId, count = 200)))
+
+    logger.info('Searching for hot car tweets...')
+    with profiler.span('twitter_requests'):
+        results = twitter_fanout.run(requests)
+
+    # Ignore tweets which mention MetroHotCars, as these will be processed by getMentions
+    tweets = []
+    searchComplete = True
+    for q in SEARCH_QUERIES:
+        queryResult = results.get('search:%s'%q, None)
+        if queryResult is None:
+            searchComplete = False
+            continue
+        tweets.extend(t for t in queryResult if not tweetMentionsMe(t))
+    logger.info("Search return %i tweets", len(tweets))
+    for i, tweet in enumerate(tweets):
+        logger.info("\tTweet from %s: %s", tweet.user.screen_name, tweet.text)
+
+    # Find the max tweet id seen through twitter search
+    if searchComplete:
+        maxTweetId = max([t.id for t in tweets]) if tweets else 0
+        maxTweetId = max(maxTweetId, lastTweetId)
+    else:
+        logger.warning('Twitter search incomplete. Keeping last tweet id %i.'%lastTweetId)
+        maxTweetId = lastTweetId
+
+    if checkMentions:
+        if 'mentions' in results and 'self_timeline' in results:
+            with profiler.span('mentions'):
+                tweets.extend(getMentions(curTime, mentions = results['mentions'],
+                                          selfTweets = results['self_timeline']))
+            logger.info("Done getting mentions.")
+        else:
+            logger.warning('Could not get mentions from twitter. Retrying on the next tick.')
+
+    return tweets, maxTweetId
 
 ##################################################
 # Get the UTC time of the tweet, from sec since epoch
@@ -244,22 +332,13 @@ def updateDBFromTweet(tweet, hotCarData):
         pass
  
 
-    # Get the HTML Embedding of the tweet. This may fail if the user
-    # immediately deleted the tweet.
-    T = getTwitterAPI()
-    embed_html = None
-    try:
-        embedding = T.GetStatusOembed(tweet.id, hide_thread=False, omit_script=True, align='left')
-        embed_html = embedding['html']
-    except TwitterError as e:
-        msg = 'Tweet Id: %i'%tweetId +\
-              '\nCaught Twitter error when trying to get Status Oembed: %s'%(str(e))
-        logger.error(msg)
-
-    # Save the tweet.
+    # Save the tweet. The HTML Embedding of the tweet is fetched later by the
+    # embed_fetcher, and a placeholder is shown until then.
+    embed_html = fallback_embed_html(tweet.id, tweet.text, tweet.user.screen_name)
     tweet_doc = HotCarTweet(tweet_id = tweet.id,
                             acknowledged = False,
                             embed_html = embed_html,
+                            embed_pending = True,
                             text = tweetText,
                             time = makeUTCDateTime(tweet.created_at_in_seconds),
                             user_id = tweet.user.id,
@@ -270,6 +349,8 @@ def updateDBFromTweet(tweet, hotCarData):
         logging.info('No update made. Tweet %i is a duplicate.'%tweet.id)    
         return False
 
+    embed_fetcher.enqueue(tweet.id)
+
     # Update informatino about the twitter user who reported the car.
     HotCarTweeter.update(tweet.user.id, tweet.user.screen_name)
 
@@ -287,6 +368,8 @@ def updateDBFromTweet(tweet, hotCarData):
 
     try:
         hot_car_report_doc.save()
+        report_index.add(carNum, hot_car_report_doc.time, tweet.id, tweet.user.id)
+        HotCarReportCount.increment(carNum, hot_car_report_doc.time.year)
         updated = True
 
     except NotUniqueError:
@@ -302,7 +385,7 @@ def updateDBFromTweet(tweet, hotCarData):
 
 
 
-def filterDuplicateReports(tweetData):
+def filterDuplicateReports(tweetData, index = None):
     """
     Remove tweets which are duplicate reports.
     A tweet is a duplicate report if:
@@ -315,37 +398,19 @@ def filterDuplicateReports(tweetData):
     30 days. Some users may repeated talk about the same car.
     #
     tweetData: List of (tweet, hotCarData) tuples
+    index: HotCarReportIndex of the previous reports. Defaults to the
+           report_index of this module, which should be refreshed first.
     """
- 
-    # Build a dictionary from car number to the reporting users/times.
-    # This includes all previous reports.
-    hotCarReportDict= defaultdict(list)
-
-    def doc_to_data(doc):
-        """Extract data from a HotCarReport document to be used locally"""
-        return { 'car_number': doc.car_number,
-                 'tweet_id': doc.tweet.tweet_id,
-                 'time' : doc.time,
-                 'user_id' : doc.tweet.user.user_id }
-
-    # Collect some fields from exists hot car reports.
-    doc_data = (doc_to_data(doc) for doc in HotCarReport.iter_reports())
-    for dd in doc_data:
-        hotCarReportDict[dd['car_number']].append(dd)
+    if index is None:
+        index = report_index
 
-
-    # Add the current batch of tweets to the hotCarReportDict
+    # Reports from the current batch of tweets, by car number.
+    batchReports = defaultdict(list)
     for tweet, hotCarData in tweetData:
         cars = hotCarData['cars']
         assert(len(cars)==1)
         carNumber = cars[0]
-        data = {'car_number' : carNumber,
-                'time' : makeUTCDateTime(tweet.created_at_in_seconds),
-                'tweet_id' : tweet.id,
-                'user_id' : tweet.user.id
-               }                
-
-        hotCarReportDict[carNumber].append(data)
+        batchReports[carNumber].append((makeUTCDateTime(tweet.created_at_in_seconds), tweet.id, tweet.user.id))
 
     filteredTweetData = []
     for tweet, hotCarData in tweetData:
@@ -354,21 +419,20 @@ def filterDuplicateReports(tweetData):
         user_id = tweet.user.id
         screen_name = tweet.user.screen_name
         tweet_id = tweet.id
-        assert(len(cars)==1)
         carNumber = hotCarData['cars'][0]
-        otherReports = [d for d in hotCarReportDict[carNumber] if d['tweet_id'] != tweet_id and
-                                                                  d['time'] > timeCutoff]
+        otherReports = [r for r in index.reports_since(carNumber, timeCutoff) if r[1] != tweet_id]
+        otherReports.extend(r for r in batchReports[carNumber] if r[1] != tweet_id and r[0] > timeCutoff)
 
         # Check if this car was already reported by the user within 30 days
-        prevSelfReports = sum(1 for d in otherReports if d['user_id'] == user_id)
+        prevSelfReports = sum(1 for t, tid, uid in otherReports if uid == user_id)
         
         # Check if this car was already reported by another user mentioned in this tweet
         mentionUserIds = set(u.id for u in tweet.user_mentions)
         if tweet.in_reply_to_user_id is not None:
             mentionUserIds.add(tweet.in_reply_to_user_id)
 
-        otherUserReports = sum(1 for d in otherReports if (d['user_id'] in mentionUserIds)
-                                                          and (d['time'] < tweetTime))
+        otherUserReports = sum(1 for t, tid, uid in otherReports if (uid in mentionUserIds)
+                                                                  and (t < tweetTime))
         if (prevSelfReports > 0):
             logger.info('Skipping Tweet %i by %s on car %i because there is a previous self-report' \
                       ' in last 30 days'%(tweet_id, screen_name, carNumber))
@@ -400,11 +464,9 @@ def genResponseTweet(handle, hotCarData):
     car_num_int = int(car)
     cur_year = datetime.now().year
 
-    all_reports = HotCarReport.reports_for_car(car_num_int)
-    reports_this_year = [r for r in all_reports if r.time and r.time.year == cur_year]
-
-    num_reports_total = len(all_reports)
-    num_reports_this_year = len(reports_this_year)
+    year_to_count = HotCarReportCount.counts_for_car(car_num_int)
+    num_reports_total = sum(year_to_count.itervalues())
+    num_reports_this_year = year_to_count.get(cur_year, 0)
 
     car_url = getHotCarUrl(car)
 
@@ -419,7 +481,7 @@ def genResponseTweet(handle, hotCarData):
 
 
 
-def getForbiddenCarsByMention():
+def getForbiddenCarsByMention(selfTweets = None):
     """
     Check non-automated tweets made by MetroHotCars
     If MetroHotCars mentions a 4-digit car number,
@@ -430,6 +492,9 @@ def getForbiddenCarsByMention():
     This is done to forbid duplicate reports if a user
     modifies or quotes the non-automated tweet.
    
+    selfTweets: MetroHotCars' tweets since the lastSelfTweetId, if they have
+                already been requested (see getTweets).
+
     Returns a set of forbidden car numbers
     """
 
@@ -440,8 +505,9 @@ def getForbiddenCarsByMention():
     CarsForbiddenByMention.remove_stale_docs()
 
     # Get any tweets by MetroHotCars since the lastSelfTweetId
-    T = getTwitterAPI()
-    selfTweets = T.GetUserTimeline(screen_name = ME, since_id = lastSelfTweetId, count = 200)
+    if selfTweets is None:
+        T = getTwitterAPI()
+        selfTweets = T.GetUserTimeline(screen_name = ME, since_id = lastSelfTweetId, count = 200)
     maxTweetId = max(t.id for t in selfTweets) if selfTweets else 0
     maxTweetId = max(lastSelfTweetId, maxTweetId)
 
@@ -456,7 +522,7 @@ def getForbiddenCarsByMention():
     # reported via mentions
 
     def getTimeCarPairs(tweet):
-        hcd = getHotCarDataFromText(tweet.text)
+        hcd = getHotCarDataFromTweet(tweet)
         time = makeUTCDateTime(tweet.created_at_in_seconds)
         return [(time, n) for n in hcd['cars']]
 
@@ -473,7 +539,19 @@ def getForbiddenCarsByMention():
     # Return the list of tweetIds which are forbidden by mention
     return CarsForbiddenByMention.get_forbidden_cars()
 
-def getMentions(curTime):
+def mentionsCheckDue(curTime, appState = None):
+    """
+    Return True if the mentions should be checked. This is rate limited,
+    so check every 90 seconds.
+    """
+    appState = appState if appState is not None else HotCarAppState.get()
+    lastMentionsCheckTime = appState.lastMentionsCheckTime
+    if lastMentionsCheckTime is not None:
+        lastMentionsCheckTime = lastMentionsCheckTime.replace(tzinfo=tzutc)
+    return (lastMentionsCheckTime is None) or \
+           (curTime - lastMentionsCheckTime) > timedelta(seconds=90.0)
+
+def getMentions(curTime, mentions = None, selfTweets = None):
     """
     Search Twitter for tweets that mention MetroHotCars.
     This is rate limited, so perform every 90 seconds.
@@ -484,32 +562,28 @@ def getMentions(curTime):
     For example, if MetroHotCars tweets "Car 1043 is a #wmata #hotcar. Car 1043 mentioned 5 times."
     a third user may say "WOW Car 1043 still isn't fixed! @MetroHotcars". This isn't a new report.
     This is why reporting cars with #wmata #hotcar without a mention is more reliable than by mention.
+
+    mentions, selfTweets: The results of GetMentions and GetUserTimeline, if they have
+                          already been requested (see getTweets). The rate limit is then
+                          left to the caller.
     """
 
     appState = HotCarAppState.get()
-    lastMentionsCheckTime = appState.lastMentionsCheckTime
-    if lastMentionsCheckTime is not None:
-        lastMentionsCheckTime = lastMentionsCheckTime.replace(tzinfo=tzutc)
     lastMentionsTweetId = appState.lastMentionsTweetId if appState.lastMentionsTweetId else None
-    doCheck = False
-
-    if (lastMentionsCheckTime is None) or \
-       (curTime - lastMentionsCheckTime) > timedelta(seconds=90.0):
-       doCheck = True
 
-    if not doCheck:
-        return []
-    
-    T = getTwitterAPI() 
-    mentions = T.GetMentions(include_entities = True, since_id = lastMentionsTweetId)
+    if mentions is None:
+        if not mentionsCheckDue(curTime, appState):
+            return []
+        T = getTwitterAPI()
+        mentions = T.GetMentions(include_entities = True, since_id = lastMentionsTweetId)
     maxMentionsTweetId = max(t.id for t in mentions) if mentions else 0
     maxMentionsTweetId = max(maxMentionsTweetId, lastMentionsTweetId)
 
     # Get car numbers which are forbidden to be submitted by mention
-    forbiddenCarNumbers = getForbiddenCarsByMention()
+    forbiddenCarNumbers = getForbiddenCarsByMention(selfTweets)
 
     def tweetIsForbidden(tweet):
-        carNums = getHotCarDataFromText(tweet.text)['cars']
+        carNums = getHotCarDataFromTweet(tweet)['cars']
         return any(carNum in forbiddenCarNumbers for carNum in carNums)
 
     mentions = [t for t in mentions if (not hasForbiddenWord(t)) and (not tweetIsForbidden(t))]
@@ -80,6 +80,7 @@ class HotCarTweet(WebJSONMixin, Document):
   tweet_id = LongField(primary_key = True, required=True, db_field='_id')
   acknowledged = BooleanField(default = False, db_field = 'ack')
   embed_html = StringField(required = True)
+  embed_pending = BooleanField(default = False) # True until the oEmbed html has been fetched
   text = StringField(required = True)
   time = DateTimeField(required = True)
   user = ReferenceField(HotCarTweeter, required = True, db_field = "user_id")
@@ -170,6 +171,79 @@ class HotCarReport(WebJSONMixin, DataWriteable, Document):
 
 
 
+class HotCarReportCount(Document):
+  """Number of hot car reports for a car in a year (UTC).
+  The counts are incremented as reports are saved, so that counting
+  the reports for a car does not require loading the reports.
+  """
+  car_number = IntField(required = True)
+  year = IntField(required = True)
+  count = IntField(required = True, default = 0)
+
+  meta = {'collection' : 'hotcars_report_counts',
+          'indexes' : [{'fields' : ['car_number', 'year'], 'unique' : True}]}
+
+  @classmethod
+  def increment(cls, car_number, year, n = 1):
+    cls._get_collection().update({'car_number' : car_number, 'year' : year},
+                                 {'$inc' : {'count' : n}}, upsert = True)
+
+  @classmethod
+  def counts_for_car(cls, car_number):
+    """
+    Return a dictionary from year to the number of reports for the car.
+    """
+    docs = cls._get_collection().find({'car_number' : car_number}, fields = ['year', 'count'])
+    return dict((d['year'], d['count']) for d in docs)
+
+  @classmethod
+  def compute_counts(cls):
+    """
+    Count the reports by car and year from the hot car reports.
+    Return a dictionary from (car_number, year) to count.
+    """
+    pipeline = [{'$group' : {'_id' : {'car_number' : '$car_number', 'year' : {'$year' : '$time'}},
+                             'count' : {'$sum' : 1}}}]
+    res = HotCarReport._get_collection().aggregate(pipeline)
+    groups = res['result'] if isinstance(res, dict) else list(res)
+    return dict(((g['_id']['car_number'], g['_id']['year']), g['count']) for g in groups)
+
+  @classmethod
+  def ensure_built(cls):
+    """
+    Build the counts if they have never been built.
+    """
+    if cls._get_collection().find_one() is None and HotCarReport._get_collection().find_one() is not None:
+      cls.rebuild()
+
+  @classmethod
+  def check(cls):
+    """
+    Compare the stored counts with the counts computed from the reports.
+    Return a list of (car_number, year, stored count, computed count) for the counts which differ.
+    """
+    computed = cls.compute_counts()
+    stored = dict(((d['car_number'], d['year']), d['count']) for d in cls._get_collection().find())
+    keys = sorted(set(computed.keys()) | set(stored.keys()))
+    return [k + (stored.get(k, 0), computed.get(k, 0)) for k in keys if stored.get(k, 0) != computed.get(k, 0)]
+
+  @classmethod
+  def rebuild(cls):
+    """
+    Replace the stored counts with the counts computed from the reports.
+    Return the number of counts which were changed.
+    """
+    mismatches = cls.check()
+    collection = cls._get_collection()
+    for car_number, year, stored, computed in mismatches:
+      if computed:
+        collection.update({'car_number' : car_number, 'year' : year},
+                          {'$set' : {'count' : computed}}, upsert = True)
+      else:
+        collection.remove({'car_number' : car_number, 'year' : year})
+    return len(mismatches)
+
+
 class CarsForbiddenByMention(Document):
   """Hot Cars which are temporarily forbidden to be submitted
   by tweets which mention MetroHotCars.
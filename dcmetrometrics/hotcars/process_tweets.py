@@ -1,8 +1,38 @@
 """Utilities for processing tweets to generate hot car reports
+
+parseText extracts the car numbers, line colors and excluded words of a tweet
+in a single pass over its words, with compiled patterns and module-level
+tables. It gives the same results as preprocessText followed by getCarNums
+and getColors. parseTweet memoizes parseText by tweet id.
 """
 
 ##########################
 import re
+from collections import namedtuple, OrderedDict
+
+NON_ALNUM_RE = re.compile('[^a-zA-Z0-9\s]')
+NUMBER_RE = re.compile('(\d+)')
+DIGITS_RE = re.compile('\d+')
+WHITESPACE_RE = re.compile('\s+')
+SERIES_RE = re.compile('[1-6]000 SERIES')
+
+# Words which refer to each line color.
+COLOR_TO_WORDS = { 'RED' : ['RED', 'RD', 'RL', 'REDLINE'],
+                   'BLUE' : ['BLUE', 'BL', 'BLUELINE'],
+                   'GREEN' : ['GREEN', 'GR', 'GL', 'GREENLINE'],
+                   'YELLOW' : ['YELLOW', 'YL', 'YELLOWLINE'],
+                   'ORANGE' : ['ORANGE', 'OL', 'ORANGELINE']
+                 }
+WORD_TO_COLOR = dict((w,k) for k,wlist in COLOR_TO_WORDS.iteritems() for w in wlist)
+
+# Tweets with these words are not reports of WMATA hot cars.
+EXCLUDED_WORDS = frozenset(['MBTA', 'BART'])
+
+# Car series numbers, which are removed when followed by "SERIES".
+SERIES_NUMBERS = frozenset(['1000', '2000', '3000', '4000', '5000', '6000'])
+
+# Letter and digit runs of a word, which are the words of the preprocessed text.
+TOKEN_RE = re.compile('[A-Z]+|[0-9]+')
 
 def preprocessText(tweetText):
   """
@@ -19,16 +49,16 @@ def preprocessText(tweetText):
   tweetText = ' '.join(words)
 
   # Replace non-alphanumeric characters with spaces
-  tweetText = re.sub('[^a-zA-Z0-9\s]',' ', tweetText)
+  tweetText = NON_ALNUM_RE.sub(' ', tweetText)
 
   # Separate numbers embedded in words
-  tweetText = re.sub('(\d+)', ' \\1 ', tweetText)
+  tweetText = NUMBER_RE.sub(' \\1 ', tweetText)
 
   # Make consecutive white space a single space
-  tweetText = re.sub('\s+', ' ', tweetText)
+  tweetText = WHITESPACE_RE.sub(' ', tweetText)
 
   # Remove reference to 1000, 2000, ..., 6000 Series
-  tweetText = re.sub('[1-6]000 SERIES', '', tweetText)
+  tweetText = SERIES_RE.sub('', tweetText)
 
   return tweetText
 
@@ -36,7 +66,7 @@ def getCarNums(text):
   """
   Get 4 digit car numbers
   """
-  nums = re.findall('\d+', text)
+  nums = DIGITS_RE.findall(text)
   validNums = [int(n) for n in set(s for s in nums if len(s)==4)]
   return validNums
 
@@ -50,23 +80,11 @@ def getColors(text):
   This assumes that the tweet text has already been preprocessed
   by removing hashtags and making all text uppercase.
   """
-
-  colorToWords = { 'RED' : ['RD', 'RL', 'REDLINE'],
-                   'BLUE' : ['BL', 'BLUELINE'],
-                   'GREEN' : ['GR', 'GL', 'GREENLINE'],
-                   'YELLOW' : ['YL', 'YELLOWLINE'],
-                   'ORANGE' : ['OL', 'ORANGELINE']
-                 }
-
-  for c, colorWordList in colorToWords.iteritems():
-      colorWordList.append(c) # Add the color itself to the word list
-      colorToWords[c] = colorWordList
-
-  wordToColor = dict((w,k) for k,wlist in colorToWords.iteritems() for w in wlist)
   words = text.split()
-  colors = (wordToColor.get(w, None) for w in words)
-  colors = [c for c in colors if c is not None]
+  colors = [WORD_TO_COLOR[w] for w in words if w in WORD_TO_COLOR]
+  return _addSilverLine(colors, words)
 
+def _addSilverLine(colors, words):
   # Special handling of the silver line.
   # Be wary of "Silver Spring". It's tough, because
   # Spring Hill is an actual Silver Line station, so we may miss some
@@ -82,6 +100,73 @@ def getColors(text):
 
   return colors
 
+#######################################
+# Single pass parser
+ParsedText = namedtuple('ParsedText', ['words', 'cars', 'colors', 'has_excluded_word'])
+
+def tokenize(tweetText):
+  """
+  Return the words of the tweet text, as preprocessText(tweetText).split()
+  """
+  tweetText = tweetText.encode('ascii', errors='ignore').upper()
+
+  # Letter and digit runs of each word, skipping handles other than @WMATA
+  tokens = []
+  for w in tweetText.split():
+    if (w[0] != '@') or (w == '@WMATA'):
+      tokens.extend(TOKEN_RE.findall(w))
+
+  # Remove reference to 1000, 2000, ..., 6000 Series. The rest of the
+  # number and of the word after it make a single word.
+  words = []
+  i = 0
+  n = len(tokens)
+  while i < n:
+    t = tokens[i]
+    if i + 1 < n and t[-4:] in SERIES_NUMBERS and tokens[i+1].startswith('SERIES'):
+      rest = t[:-4] + tokens[i+1][6:]
+      if rest:
+        words.append(rest)
+      i += 2
+    else:
+      words.append(t)
+      i += 1
+  return words
+
+def parseText(tweetText):
+  """
+  Parse tweet text in a single pass over its words.
+  Return a ParsedText with the car numbers and colors (as getCarNums and getColors
+  of the preprocessed text) and whether the text has an excluded word.
+  """
+  words = tokenize(tweetText)
+  nums = []
+  colors = []
+  has_excluded_word = False
+  for w in words:
+    if w[0].isdigit():
+      nums.append(w if w.isdigit() else DIGITS_RE.match(w).group())
+    elif w in WORD_TO_COLOR:
+      colors.append(WORD_TO_COLOR[w])
+    elif w in EXCLUDED_WORDS:
+      has_excluded_word = True
+  cars = [int(n) for n in set(s for s in nums if len(s)==4)]
+  return ParsedText(words, cars, _addSilverLine(colors, set(words)), has_excluded_word)
+
+_parsed_tweets = OrderedDict() # tweet id -> ParsedText
+PARSED_TWEETS_CACHE_SIZE = 1000
+
+def parseTweet(tweet):
+  """
+  Return parseText(tweet.text), memoized by tweet id.
+  """
+  parsed = _parsed_tweets.get(tweet.id, None)
+  if parsed is None:
+    parsed = _parsed_tweets[tweet.id] = parseText(tweet.text)
+    if len(_parsed_tweets) > PARSED_TWEETS_CACHE_SIZE:
+      _parsed_tweets.popitem(last = False)
+  return parsed
+
 def uniqueTweets(tweetList):    
   """
   Return a list of unique tweets from a list of tweets.
@@ -95,6 +180,22 @@ def isRetweet(tweet):
   return (tweet.retweeted_status or ('MT' in txt) or ('RT' in txt))
 
 def getHotCarDataFromText(text):
+  """
+  Get hot car data from text. Extract car numbers and line colors
+  """
+  parsed = parseText(text)
+  return {'cars' : parsed.cars,
+          'colors' : parsed.colors }
+
+def getHotCarDataFromTweet(tweet):
+  """
+  Get hot car data from a tweet, using the memoized parse of its text.
+  """
+  parsed = parseTweet(tweet)
+  return {'cars' : list(parsed.cars),
+          'colors' : list(parsed.colors) }
+
+def getHotCarDataFromText_OLD(text):
   """
   Get hot car data from text. Extract car numbers and line colors
   """
@@ -157,13 +258,7 @@ def tweetIsValidReport(tweet, hotCarData):
         return False
 
     # Check if the tweet has any forbidded words.
-    excludedWords = ['MBTA', 'BART']
-    excludedWords = [w.upper() for w in excludedWords]
-    excludedWords = set(excludedWords)
-    tweetText = preprocessText(tweet.text)
-    tweetWords = tweetText.split()
-    numExcluded = sum(1 for w in tweetWords if w in excludedWords)
-    if numExcluded > 0:
+    if parseTweet(tweet).has_excluded_word:
         return False
 
     # The tweet is good!
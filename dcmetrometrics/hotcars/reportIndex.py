@@ -0,0 +1,118 @@
+"""
+hotcars.reportIndex
+
+A process-resident index of the hot car reports, so that checking a batch of
+tweets for duplicate reports does not have to load every HotCarReport (and
+dereference its tweet and user) on each tick of the HotCarApp.
+
+HotCarReportIndex: For each car number, the (time, tweet_id, user_id) of its
+                   reports sorted by time. The index is loaded once with a
+                   single projected query, updated as the app saves reports,
+                   and reloaded if the number of reports in the database
+                   differs from the number it has seen.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+
+from .models import HotCarReport, HotCarTweet
+from ..common.metroTimes import tzutc
+
+import logging
+logger = logging.getLogger('HotCarApp')
+
+REPORT_FIELDS = ['car_number', 'time', 'tweet_id', 'user_id']
+
+def _utc(t):
+    return t.replace(tzinfo = tzutc) if t.tzinfo is None else t
+
+
+class HotCarReportIndex(object):
+    """
+    Index of the hot car reports by car number, with reports sorted by time.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.num_docs = 0 # Number of report documents loaded or added
+        self._times = defaultdict(list) # car number -> sorted report times
+        self._reports = defaultdict(list) # car number -> (tweet_id, user_id), in the order of _times
+        self._tweet_ids = set()
+
+    def __len__(self):
+        return len(self._tweet_ids)
+
+    def clear(self):
+        self._times.clear()
+        self._reports.clear()
+        self._tweet_ids.clear()
+        self.loaded = False
+        self.num_docs = 0
+
+    def add(self, car_number, time, tweet_id, user_id):
+        """
+        Add a report to the index. Return False if the tweet is already indexed.
+        """
+        if tweet_id in self._tweet_ids:
+            return False
+        time = _utc(time)
+        times = self._times[car_number]
+        i = bisect_right(times, time)
+        times.insert(i, time)
+        self._reports[car_number].insert(i, (tweet_id, user_id))
+        self._tweet_ids.add(tweet_id)
+        if self.loaded:
+            self.num_docs += 1
+        return True
+
+    def reports_since(self, car_number, time_cutoff):
+        """
+        Return the (time, tweet_id, user_id) of the reports for a car
+        with time after time_cutoff, in order of time.
+        """
+        times = self._times.get(car_number, None)
+        if not times:
+            return []
+        i = bisect_right(times, _utc(time_cutoff))
+        reports = self._reports[car_number]
+        return [(times[j],) + reports[j] for j in xrange(i, len(times))]
+
+    def load(self):
+        """
+        Load the index from the database. Reports which have not been denormalized
+        with the user_id get it from their tweet, with one more query.
+        """
+        self.clear()
+        missing_user = [] # (car_number, time, tweet_id)
+        num_docs = 0
+        collection = HotCarReport._get_collection()
+        for doc in collection.find({}, fields = REPORT_FIELDS):
+            num_docs += 1
+            car_number, time, tweet_id = doc.get('car_number'), doc.get('time'), doc.get('tweet_id')
+            if car_number is None or time is None or tweet_id is None:
+                continue
+            user_id = doc.get('user_id', None)
+            if user_id is None:
+                missing_user.append((car_number, time, tweet_id))
+            else:
+                self.add(car_number, time, tweet_id, user_id)
+
+        if missing_user:
+            tweet_ids = [tweet_id for car_number, time, tweet_id in missing_user]
+            tweets = HotCarTweet._get_collection().find({'_id' : {'$in' : tweet_ids}}, fields = ['user_id'])
+            tweet_to_user = dict((d['_id'], d.get('user_id')) for d in tweets)
+            for car_number, time, tweet_id in missing_user:
+                self.add(car_number, time, tweet_id, tweet_to_user.get(tweet_id, None))
+
+        self.loaded = True
+        self.num_docs = num_docs
+        logger.info('Loaded hot car report index with %i reports.'%len(self))
+
+    def refresh(self):
+        """
+        Load the index if it has not been loaded, or if reports have been added or
+        removed by another process. Return True if the index was loaded.
+        """
+        if self.loaded and HotCarReport._get_collection().count() == self.num_docs:
+            return False
+        self.load()
+        return True
@@ -0,0 +1,71 @@
+"""
+hotcars.twitterFanout
+
+Issue the Twitter requests of a HotCarApp tick concurrently, so that one slow
+search response does not delay the other requests and the rest of the tick.
+
+TwitterFanout: Run named requests through a bounded pool of greenlets, each
+               with its own timeout. A request which fails or times out is
+               logged and left out of the results, so that the caller keeps
+               the since_id of that endpoint for the next tick.
+"""
+import gevent
+from gevent.pool import Pool
+
+from ..common.tickMetrics import monotonic
+
+import logging
+logger = logging.getLogger('HotCarApp')
+
+class TwitterFanout(object):
+    """
+    Run Twitter requests concurrently, with a timeout per request.
+    """
+
+    def __init__(self, pool_size = 6, timeout = 20.0, profiler = None):
+        """
+        pool_size: Maximum number of concurrent requests.
+        timeout: Number of seconds after which a request is abandoned.
+        profiler: An optional tickMetrics.TickProfiler, used to count the failed requests.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.profiler = profiler
+        self.elapsed = {} # name -> seconds taken by the request, in the last run
+
+    def _count(self, name, n = 1):
+        if self.profiler is not None and n:
+            self.profiler.count(name, n)
+
+    def _call(self, request):
+        name, func = request
+        start = monotonic()
+        timeout = gevent.Timeout(self.timeout)
+        timeout.start()
+        try:
+            return name, func(), None, monotonic() - start
+        except gevent.Timeout as e:
+            if e is not timeout:
+                raise
+            return name, None, 'timed out after %.1f seconds'%self.timeout, monotonic() - start
+        except Exception as e:
+            return name, None, e, monotonic() - start
+        finally:
+            timeout.cancel()
+
+    def run(self, requests):
+        """
+        Run the requests, a list of (name, function of no arguments).
+        Return a dict from name to result, for the requests which succeeded.
+        """
+        pool = Pool(self.pool_size)
+        results = {}
+        self.elapsed = {}
+        for name, result, error, elapsed in pool.imap_unordered(self._call, requests):
+            self.elapsed[name] = elapsed
+            if error is None:
+                results[name] = result
+            else:
+                logger.error('Twitter request %s failed: %s'%(name, str(error)))
+                self._count('twitter_request_errors')
+        return results
@@ -9,6 +9,8 @@ from datetime import date, datetime, timedelta
 from time import sleep as do_sleep
 import requests
 
+from ..common import httpClient
+
 TIMEOUT = 10.0
 
 class WundergroundError(Exception):
@@ -21,11 +23,13 @@ class WundergroundAPI(object):
 
     baseUrl = "http://api.wunderground.com/api"
 
-    def __init__(self, key, callsPerMinute=None):
+    def __init__(self, key, callsPerMinute=None, client=None):
         """
         key: API Key as a str. If key is None, all calls to API method will
              return no result.
         callsPerMinute: The maximum number of callsPerMinute to enforce
+        client: The httpClient.HttpClient to make requests with.
+                Defaults to the shared client.
         """
         if not isinstance(key, str) and key is not None:
             raise TypeError('key must be a str or None.')
@@ -36,6 +40,7 @@ class WundergroundAPI(object):
 
         self.enforceRateLimit = not (callsPerMinute is None)
         self.callTimes = []
+        self.client = client if client is not None else httpClient.get_client()
 
     def _buildUrl(self, query, **kwargs):
         """
@@ -66,7 +71,8 @@ class WundergroundAPI(object):
         if self.enforceRateLimit:
             self.callTimes.append(datetime.now())
 
-        r = requests.get(url, timeout = TIMEOUT)
+        # The url contains the API key, so name the endpoint for the latency stats.
+        r = self.client.get(url, timeout = TIMEOUT, endpoint = 'wunderground')
         if r.status_code != requests.codes.ok:
             msg = 'RequestError! URL=%s, StatusCode=%i'%(r.url, r.status_code)
             raise WundergroundError(msg)
@@ -51,6 +51,9 @@ class HotCarApp(RestartingGreenlet):
         self.SLEEP = 40 # Run every 10 seconds
         self.LIVE = LIVE
 
+        # Fetch tweet embeds and publish the hot car json in the background.
+        hotCars.start_workers()
+
     # Run forever
     def _run(self):
 
@@ -0,0 +1,78 @@
+import unittest
+import setup
+import random
+
+from dcmetrometrics.eles import models
+from dcmetrometrics.eles.StatusRecord import to_status_records
+from dcmetrometrics.common.metroTimes import nytz, tzutc
+from bson.objectid import ObjectId
+from datetime import timedelta, datetime, date
+
+CATEGORY_CHOICES = ['ON', 'ON', 'ON', 'BROKEN', 'BROKEN', 'INSPECTION', 'INSPECTION', 'OFF', 'REHAB']
+
+REPORT_FIELDS = ['unit_id', 'day', 'availability', 'broken_time_percentage',
+                 'num_breaks', 'num_inspections', 'num_fixes']
+
+def make_statuses(unit_id, start, num, rand, active = True):
+  """
+  Generate a random status history for a unit, in ascending order.
+  If active is True, the last status is still active.
+  """
+  times = [start]
+  for i in range(num):
+    gap = rand.choice([rand.randint(1, 3600), rand.randint(1, 3*24*3600)])
+    times.append(times[-1] + timedelta(seconds = gap))
+  end_times = times[1:]
+  if active:
+    end_times[-1] = None
+  statuses = []
+  for t, te in zip(times[:-1], end_times):
+    statuses.append(models.UnitStatus(id = ObjectId(),
+                                      unit_id = unit_id,
+                                      time = t.astimezone(tzutc),
+                                      end_time = te.astimezone(tzutc) if te else None,
+                                      symptom_category = rand.choice(CATEGORY_CHOICES)))
+  return statuses
+
+
+class TestDailyServiceReports(unittest.TestCase):
+
+  def setUp(self):
+    self.unit = models.Unit(unit_id = 'A01N01ESCALATOR')
+
+  def check(self, statuses, start_day, last_day):
+    reports = models.DailyServiceReport.compute_for_unit_days(self.unit, start_day, last_day,
+      statuses = statuses)
+    expected = [models.DailyServiceReport.compute_for_unit(self.unit, day, statuses = statuses)
+                for day in models.gen_days(start_day, last_day)]
+    self.assertEqual(len(reports), len(expected))
+    for r, e in zip(reports, expected):
+      for k in REPORT_FIELDS:
+        self.assertEqual(getattr(r, k), getattr(e, k), '%s %s'%(e.day, k))
+      self.assertEqual([s.pk for s in r.statuses], [s.pk for s in e.statuses])
+
+  def test_active(self):
+    rand = random.Random(6)
+    for i in range(5):
+      start = datetime(2015, 2, 20, rand.randint(0, 23), tzinfo = nytz)
+      statuses = make_statuses('A01N01ESCALATOR', start, rand.randint(1, 50), rand)
+      # Cover days before the first status, and the daylight savings change.
+      self.check(statuses, date(2015, 2, 15), date(2015, 4, 1))
+
+  def test_closed(self):
+    rand = random.Random(7)
+    start = datetime(2014, 10, 25, 4, tzinfo = nytz)
+    statuses = make_statuses('A01N01ESCALATOR', start, 40, rand, active = False)
+    # Days up to the end of the last status
+    last_day = statuses[-1].end_time.astimezone(nytz).date() - timedelta(days = 1)
+    self.check(statuses, date(2014, 10, 20), last_day)
+
+  def test_status_records(self):
+    rand = random.Random(8)
+    start = datetime(2015, 6, 3, 12, tzinfo = nytz)
+    statuses = make_statuses('A01N01ESCALATOR', start, 60, rand)
+    self.check(to_status_records(statuses), date(2015, 6, 1), date(2015, 7, 15))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import setup
+
+from dcmetrometrics.common import descriptors
+from dcmetrometrics.common.descriptors import setOnce, computeOnce
+from dcmetrometrics.eles import models
+from dcmetrometrics.eles.StatusGroup import StatusGroup
+from dcmetrometrics.common.metroTimes import tzutc
+from datetime import timedelta, datetime
+
+class Counted(object):
+
+  value = setOnce('value')
+
+  def __init__(self):
+    self.calls = 0
+
+  def __len__(self):
+    return 0
+
+  @computeOnce
+  def nothing(self):
+    self.calls += 1
+    return None
+
+  @computeOnce
+  def zero(self):
+    self.calls += 1
+    return 0
+
+
+class TestDescriptors(unittest.TestCase):
+
+  def test_cache_none(self):
+    c = Counted()
+    self.assertTrue(c.nothing is None)
+    self.assertTrue(c.nothing is None)
+    self.assertEqual(c.calls, 1)
+
+  def test_cache_falsy(self):
+    c = Counted()
+    self.assertEqual(c.zero, 0)
+    self.assertEqual(c.zero, 0)
+    self.assertEqual(c.calls, 1)
+
+  def test_set_once(self):
+    c = Counted()
+    self.assertTrue(c.value is None)
+    c.value = []
+    def set_again():
+      c.value = [1]
+    self.assertRaises(AttributeError, set_again)
+    self.assertEqual(c.value, [])
+
+  def test_class_access(self):
+    self.assertRaises(AttributeError, getattr, Counted, 'zero')
+
+
+class TestProfiler(unittest.TestCase):
+
+  def tearDown(self):
+    descriptors.disable_profiling()
+
+  def test_profile_status_group(self):
+    t0 = datetime(2015, 4, 1, 12, tzinfo = tzutc)
+    categories = ['ON', 'BROKEN', 'ON', 'INSPECTION', 'ON']
+    statuses = [models.UnitStatus(unit_id = 'A01N01ESCALATOR',
+                                  time = t0 + timedelta(hours = i),
+                                  end_time = t0 + timedelta(hours = i + 1) if i < len(categories) - 1 else None,
+                                  symptom_category = c) for i, c in enumerate(categories)]
+    profiler = descriptors.enable_profiling()
+    sg = StatusGroup(statuses, t0, t0 + timedelta(days = 1))
+    sg.availability
+    sg.availability
+    sg.brokenTimePercentage
+    stats = profiler.stats
+    self.assertEqual(stats[('StatusGroup', 'availability')][:2], [1, 1])
+    self.assertEqual(stats[('StatusGroup', 'timeAllocation')][:2], [1, 1])
+    self.assertTrue(stats[('StatusGroup', 'availability')][2] >= stats[('StatusGroup', 'timeAllocation')][2])
+    self.assertTrue('StatusGroup.availability' in profiler.report())
+    self.assertTrue(descriptors.disable_profiling() is profiler)
+    self.assertTrue(descriptors.get_profiler() is None)
+
+
+if __name__ == '__main__':
+  unittest.main()
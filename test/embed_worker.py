@@ -0,0 +1,116 @@
+import unittest
+import setup
+
+import gevent
+from twitter import TwitterError
+from dcmetrometrics.hotcars.embedWorker import OEmbedFetcher, fallback_embed_html
+
+class StubTwitterApi(object):
+  """
+  Stub of the python-twitter Api. GetStatusOembed fails for the first
+  failures[tweet_id] calls for a tweet, and records the concurrent calls.
+  """
+  def __init__(self, failures = None):
+    self.failures = dict(failures or {})
+    self.calls = []
+    self.active = 0
+    self.max_active = 0
+
+  def GetStatusOembed(self, tweet_id, hide_thread = False, omit_script = False, align = None):
+    self.calls.append(tweet_id)
+    self.active += 1
+    self.max_active = max(self.max_active, self.active)
+    try:
+      gevent.sleep(0.01)
+      if self.failures.get(tweet_id, 0) > 0:
+        self.failures[tweet_id] -= 1
+        raise TwitterError('Rate limit exceeded')
+      return {'html' : '<blockquote>%i</blockquote>'%tweet_id}
+    finally:
+      self.active -= 1
+
+class MemoryStore(object):
+  def __init__(self, pending = ()):
+    self.pending = set(pending)
+    self.embeds = {}
+
+  def pending_tweet_ids(self):
+    return list(self.pending)
+
+  def set_embed(self, tweet_id, embed_html):
+    self.pending.discard(tweet_id)
+    self.embeds[tweet_id] = embed_html
+
+  def give_up(self, tweet_id):
+    self.pending.discard(tweet_id)
+
+
+class TestOEmbedFetcher(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = [0.0]
+    self.published = []
+
+  def make_fetcher(self, api, store, **kwargs):
+    return OEmbedFetcher(lambda: api, store = store, backoff = 10.0, clock = lambda: self.clock[0],
+                         on_embedded = lambda: self.published.append(True), **kwargs)
+
+  def test_bounded_pool(self):
+    api = StubTwitterApi()
+    store = MemoryStore(pending = [1, 2])
+    fetcher = self.make_fetcher(api, store, pool_size = 3)
+    for tweet_id in range(3, 11):
+      fetcher.enqueue(tweet_id)
+    self.assertEqual(fetcher.run_once(), 10)
+    self.assertEqual(api.max_active, 3)
+    self.assertEqual(sorted(store.embeds), range(1, 11))
+    self.assertEqual(store.embeds[4], '<blockquote>4</blockquote>')
+    self.assertEqual(len(fetcher), 0)
+    self.assertEqual(self.published, [True])
+
+  def test_retry_backoff(self):
+    api = StubTwitterApi(failures = {1 : 2, 2 : 10})
+    store = MemoryStore(pending = [1, 2, 3])
+    fetcher = self.make_fetcher(api, store, max_attempts = 3)
+    self.assertEqual(fetcher.run_once(), 1)
+    self.assertEqual(fetcher.next_attempt, {1 : 10.0, 2 : 10.0})
+
+    # Nothing is due before the backoff.
+    self.clock[0] = 5.0
+    self.assertEqual(fetcher.run_once(), 0)
+    self.assertEqual(fetcher._wait_time(), 5.0)
+
+    # The delay doubles after each failure.
+    self.clock[0] = 10.0
+    self.assertEqual(fetcher.run_once(), 0)
+    self.assertEqual(fetcher.next_attempt, {1 : 30.0, 2 : 30.0})
+
+    # Tweet 1 succeeds, and tweet 2 keeps its placeholder after max_attempts.
+    self.clock[0] = 30.0
+    self.assertEqual(fetcher.run_once(), 1)
+    self.assertEqual(sorted(store.embeds), [1, 3])
+    self.assertEqual(store.pending, set())
+    self.assertEqual(len(fetcher), 0)
+    self.assertEqual(api.calls.count(2), 3)
+    self.assertEqual(len(self.published), 2)
+
+  def test_greenlet(self):
+    api = StubTwitterApi()
+    store = MemoryStore()
+    fetcher = self.make_fetcher(api, store)
+    fetcher.start()
+    try:
+      fetcher.enqueue(5)
+      gevent.sleep(0.05)
+      self.assertEqual(store.embeds.keys(), [5])
+    finally:
+      fetcher.stop()
+
+  def test_fallback_embed_html(self):
+    html = fallback_embed_html(123, u'Car 1000 <is> hot & \u2013', 'rider')
+    self.assertTrue(u'Car 1000 &lt;is&gt; hot &amp; \u2013' in html)
+    self.assertTrue('https://twitter.com/rider/status/123' in html)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import setup
+from datetime import datetime
+
+from dcmetrometrics.hotcars.models import HotCarReportCount
+from dcmetrometrics.hotcars.hotCars import genResponseTweet
+
+class FakeCollection(object):
+  """
+  Stub of the hotcars_report_counts collection, holding (car_number, year) -> count.
+  """
+  def __init__(self, counts):
+    self.counts = dict(counts)
+
+  def find(self, spec = None, fields = None):
+    return [{'car_number' : c, 'year' : y, 'count' : n} for (c, y), n in self.counts.iteritems()]
+
+  def update(self, spec, document, upsert = False):
+    self.counts[(spec['car_number'], spec['year'])] = document['$set']['count']
+
+  def remove(self, spec):
+    del self.counts[(spec['car_number'], spec['year'])]
+
+
+class StubbedCounts(unittest.TestCase):
+  """
+  Replace class methods of HotCarReportCount for the duration of a test.
+  """
+  def stub(self, name, f):
+    if name in HotCarReportCount.__dict__:
+      self.addCleanup(setattr, HotCarReportCount, name, HotCarReportCount.__dict__[name])
+    else:
+      self.addCleanup(delattr, HotCarReportCount, name)
+    setattr(HotCarReportCount, name, staticmethod(f))
+
+
+class TestGenResponseTweet(StubbedCounts):
+
+  def test_counts(self):
+    year = datetime.now().year
+    counts = {1000 : {year - 1 : 3, year : 2}}
+    self.stub('counts_for_car', lambda car_number: counts.get(car_number, {}))
+    msg = genResponseTweet('rider', {'cars' : [1000], 'colors' : ['RED']})
+    self.assertEqual(msg, '@MetroRailInfo Red line car 1000 is a #wmata #hotcar HT @rider. '
+                          'Reported 2x in %i, 5x since 2013. '
+                          'http://www.dcmetrometrics.com/hotcars/detail/1000'%year)
+
+  def test_no_reports_this_year(self):
+    year = datetime.now().year
+    self.stub('counts_for_car', lambda car_number: {year - 2 : 4})
+    msg = genResponseTweet('rider', {'cars' : [1000], 'colors' : ['RED', 'BLUE']})
+    self.assertTrue(msg.startswith('@MetroRailInfo Car 1000 is a #wmata #hotcar HT @rider. '))
+    self.assertTrue('Reported 0x in %i, 4x since 2013.'%year in msg)
+
+
+class TestCheckRebuild(StubbedCounts):
+
+  def setUp(self):
+    computed = {(1000, 2013) : 2, (1000, 2014) : 3, (2000, 2014) : 1}
+    self.collection = FakeCollection({(1000, 2013) : 2, (1000, 2014) : 1, (3000, 2014) : 4})
+    self.stub('compute_counts', lambda: dict(computed))
+    self.stub('_get_collection', lambda: self.collection)
+
+  def test_check(self):
+    self.assertEqual(HotCarReportCount.check(),
+                     [(1000, 2014, 1, 3), (2000, 2014, 0, 1), (3000, 2014, 4, 0)])
+
+  def test_rebuild(self):
+    self.assertEqual(HotCarReportCount.rebuild(), 3)
+    self.assertEqual(self.collection.counts, {(1000, 2013) : 2, (1000, 2014) : 3, (2000, 2014) : 1})
+    self.assertEqual(HotCarReportCount.check(), [])
+    self.assertEqual(HotCarReportCount.rebuild(), 0)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import setup
+import calendar
+from datetime import datetime, timedelta
+
+from dcmetrometrics.common.metroTimes import tzutc
+from dcmetrometrics.hotcars.reportIndex import HotCarReportIndex
+from dcmetrometrics.hotcars.hotCars import filterDuplicateReports
+
+class FakeUser(object):
+  def __init__(self, user_id, screen_name = 'rider'):
+    self.id = user_id
+    self.screen_name = screen_name
+
+class FakeTweet(object):
+  def __init__(self, tweet_id, user_id, time, mentions = (), in_reply_to_user_id = None):
+    self.id = tweet_id
+    self.user = FakeUser(user_id)
+    self.created_at_in_seconds = calendar.timegm(time.utctimetuple())
+    self.user_mentions = [FakeUser(u) for u in mentions]
+    self.in_reply_to_user_id = in_reply_to_user_id
+
+def utc(*args):
+  return datetime(*args).replace(tzinfo = tzutc)
+
+class TestHotCarReportIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.index = HotCarReportIndex()
+    self.index.add(1000, utc(2014, 7, 10), 3, 30)
+    self.index.add(1000, datetime(2014, 6, 1), 1, 10) # Naive times are in UTC.
+    self.index.add(1000, utc(2014, 7, 1), 2, 20)
+    self.index.add(2000, utc(2014, 7, 1), 4, 10)
+
+  def test_reports_since(self):
+    self.assertEqual(len(self.index), 4)
+    self.assertEqual(self.index.reports_since(1000, utc(2014, 1, 1)),
+                     [(utc(2014, 6, 1), 1, 10), (utc(2014, 7, 1), 2, 20), (utc(2014, 7, 10), 3, 30)])
+    # The cutoff is exclusive.
+    self.assertEqual(self.index.reports_since(1000, utc(2014, 7, 1)), [(utc(2014, 7, 10), 3, 30)])
+    self.assertEqual(self.index.reports_since(3000, utc(2014, 1, 1)), [])
+
+  def test_add_duplicate(self):
+    self.assertFalse(self.index.add(1000, utc(2014, 8, 1), 3, 30))
+    self.assertEqual(len(self.index.reports_since(1000, utc(2014, 7, 5))), 1)
+
+  def test_filter_duplicates(self):
+    data = lambda car: {'cars' : [car], 'colors' : []}
+    tweets = [
+      # Self report 9 days after a previous report: duplicate.
+      (FakeTweet(5, 30, utc(2014, 7, 19)), data(1000)),
+      # Mentions a user who reported the car within 30 days: duplicate.
+      (FakeTweet(6, 40, utc(2014, 7, 20), mentions = [20]), data(1000)),
+      # Mentions a user whose report is older than 30 days: kept.
+      (FakeTweet(7, 50, utc(2014, 7, 20), mentions = [10]), data(1000)),
+      # Two reports of a new car by the same user in one batch: both are duplicates.
+      (FakeTweet(8, 60, utc(2014, 7, 20)), data(3000)),
+      (FakeTweet(9, 60, utc(2014, 7, 21)), data(3000)),
+      # Mentions a user who reported the car after this tweet: kept.
+      (FakeTweet(10, 70, utc(2014, 6, 20), in_reply_to_user_id = 20), data(1000))]
+    filtered = filterDuplicateReports(tweets, index = self.index)
+    self.assertEqual([t.id for t, hcd in filtered], [7, 10])
+
+
+if __name__ == '__main__':
+  unittest.main()
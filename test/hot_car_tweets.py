@@ -0,0 +1,117 @@
+import unittest
+import setup
+
+import gevent
+from twitter import TwitterError
+from dcmetrometrics.common.metroTimes import utcnow
+from dcmetrometrics.hotcars import hotCars
+from dcmetrometrics.hotcars.twitterFanout import TwitterFanout
+
+class FakeUser(object):
+  def __init__(self, screen_name):
+    self.screen_name = screen_name
+
+class FakeTweet(object):
+  def __init__(self, tweet_id, mentions = ()):
+    self.id = tweet_id
+    self.user = FakeUser('rider')
+    self.user_mentions = [FakeUser(m) for m in mentions]
+    self.text = 'Car %i is a #wmata #hotcar'%tweet_id
+
+class FakeAppState(object):
+  lastMentionsCheckTime = None
+  lastMentionsTweetId = 70
+  lastSelfTweetId = 30
+
+class StubAppStateModel(object):
+  @staticmethod
+  def get():
+    return FakeAppState()
+
+class StubTwitterApi(object):
+  """
+  Stub of the python-twitter Api. Each search returns the tweet with id
+  search_ids[term], and the requests in failures raise a TwitterError.
+  """
+  def __init__(self, search_ids, failures = ()):
+    self.search_ids = search_ids
+    self.failures = set(failures)
+    self.calls = []
+
+  def _call(self, name, result):
+    self.calls.append(name)
+    gevent.sleep(0.01)
+    if name in self.failures:
+      raise TwitterError('Over capacity')
+    return result
+
+  def GetSearch(self, term, since_id = None, **kwargs):
+    # Tweets which mention MetroHotCars are left to the mentions.
+    return self._call(term, [FakeTweet(self.search_ids[term]), FakeTweet(1, mentions = ['MetroHotCars'])])
+
+  def GetMentions(self, since_id = None, **kwargs):
+    return self._call('mentions', [FakeTweet(since_id + 1)])
+
+  def GetUserTimeline(self, screen_name = None, since_id = None, **kwargs):
+    return self._call('self_timeline', [FakeTweet(since_id + 1)])
+
+
+class TestGetTweets(unittest.TestCase):
+
+  def setUp(self):
+    self.saved = (hotCars.HotCarAppState, hotCars.getMentions, hotCars.twitter_fanout)
+    self.mentions_calls = []
+    def getMentions(curTime, mentions = None, selfTweets = None):
+      self.mentions_calls.append(([t.id for t in mentions], [t.id for t in selfTweets]))
+      return mentions
+    hotCars.HotCarAppState = StubAppStateModel
+    hotCars.getMentions = getMentions
+    hotCars.twitter_fanout = TwitterFanout(timeout = 1.0)
+    self.search_ids = dict((q, 100 + i) for i, q in enumerate(hotCars.SEARCH_QUERIES))
+
+  def tearDown(self):
+    hotCars.HotCarAppState, hotCars.getMentions, hotCars.twitter_fanout = self.saved
+
+  def test_all_succeed(self):
+    api = StubTwitterApi(self.search_ids)
+    tweets, maxTweetId = hotCars.getTweets(api, utcnow(), 50)
+    self.assertEqual(sorted(t.id for t in tweets), [71, 100, 101, 102, 103])
+    self.assertEqual(maxTweetId, 103)
+    self.assertEqual(self.mentions_calls, [([71], [31])])
+    self.assertEqual(len(api.calls), len(hotCars.SEARCH_QUERIES) + 2)
+
+  def test_search_fails(self):
+    # The last tweet id is kept when any search fails.
+    failed = hotCars.SEARCH_QUERIES[0]
+    api = StubTwitterApi(self.search_ids, failures = [failed])
+    tweets, maxTweetId = hotCars.getTweets(api, utcnow(), 50)
+    self.assertEqual(sorted(t.id for t in tweets), [71, 101, 102, 103])
+    self.assertEqual(maxTweetId, 50)
+    self.assertEqual(len(self.mentions_calls), 1)
+
+  def test_timeline_fails(self):
+    # The mentions are not processed without the timeline.
+    api = StubTwitterApi(self.search_ids, failures = ['self_timeline'])
+    tweets, maxTweetId = hotCars.getTweets(api, utcnow(), 50)
+    self.assertEqual(sorted(t.id for t in tweets), [100, 101, 102, 103])
+    self.assertEqual(maxTweetId, 103)
+    self.assertEqual(self.mentions_calls, [])
+
+  def test_mentions_fail(self):
+    api = StubTwitterApi(self.search_ids, failures = ['mentions'])
+    tweets, maxTweetId = hotCars.getTweets(api, utcnow(), 50)
+    self.assertEqual(maxTweetId, 103)
+    self.assertEqual(self.mentions_calls, [])
+
+  def test_mentions_not_due(self):
+    FakeAppState.lastMentionsCheckTime = utcnow()
+    try:
+      api = StubTwitterApi(self.search_ids)
+      tweets, maxTweetId = hotCars.getTweets(api, utcnow(), 50)
+    finally:
+      FakeAppState.lastMentionsCheckTime = None
+    self.assertEqual(sorted(api.calls), sorted(hotCars.SEARCH_QUERIES))
+    self.assertEqual(self.mentions_calls, [])
+
+if __name__ == '__main__':
+  unittest.main()
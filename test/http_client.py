@@ -0,0 +1,113 @@
+import unittest
+import setup
+import json
+import socket
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import requests
+from dcmetrometrics.common.httpClient import HttpClient
+
+class StubHandler(BaseHTTPRequestHandler):
+  """
+  Local stub server:
+    /etag: Returns an ETag, and 304 if it matches If-None-Match.
+    /flaky: Returns 503 for the first server.failures requests.
+  """
+  protocol_version = 'HTTP/1.1' # keep-alive
+
+  def log_message(self, *args):
+    pass
+
+  def respond(self, status, body = '', headers = {}):
+    self.send_response(status)
+    for k, v in headers.iteritems():
+      self.send_header(k, v)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    server = self.server
+    server.client_ports.add(self.client_address[1])
+    server.requests.append(self.path)
+    if self.path.startswith('/etag'):
+      if self.headers.get('If-None-Match', None) == '"v1"':
+        self.respond(304)
+      else:
+        self.respond(200, json.dumps({'value' : 1}), {'ETag' : '"v1"'})
+    elif self.path.startswith('/flaky'):
+      if server.failures > 0:
+        server.failures -= 1
+        self.respond(503)
+      else:
+        self.respond(200, json.dumps({'value' : 2}))
+    else:
+      self.respond(404)
+
+
+class TestHttpClient(unittest.TestCase):
+
+  def setUp(self):
+    self.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    self.server.client_ports = set()
+    self.server.requests = []
+    self.server.failures = 0
+    self.thread = threading.Thread(target = self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.base = 'http://127.0.0.1:%i'%self.server.server_address[1]
+    self.sleeps = []
+    self.client = HttpClient(retries = 2, sleep = self.sleeps.append, rand = lambda: 0.5)
+
+  def tearDown(self):
+    self.client.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_keep_alive(self):
+    for i in range(5):
+      r = self.client.get(self.base + '/flaky', params = {'i' : i})
+      self.assertEqual(r.json(), {'value' : 2})
+    self.assertEqual(len(self.server.client_ports), 1)
+
+  def test_conditional(self):
+    r1 = self.client.get(self.base + '/etag')
+    self.assertFalse(r1.not_modified)
+    r2 = self.client.get(self.base + '/etag')
+    self.assertTrue(r2.not_modified)
+    self.assertEqual(r2.json(), {'value' : 1})
+    self.assertEqual(self.client.stats()['127.0.0.1:%i/etag'%self.server.server_address[1]]['not_modified'], 1)
+    r3 = self.client.get(self.base + '/etag', conditional = False)
+    self.assertFalse(r3.not_modified)
+
+  def test_retries(self):
+    self.server.failures = 2
+    r = self.client.get(self.base + '/flaky', endpoint = 'flaky')
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(self.sleeps, [0.5, 1.0])
+    stats = self.client.stats()['flaky']
+    self.assertEqual(stats['requests'], 3)
+    self.assertEqual(stats['retries'], 2)
+    self.assertTrue(stats['latency_p50'] >= 0.0)
+
+  def test_retries_exhausted(self):
+    self.server.failures = 5
+    r = self.client.get(self.base + '/flaky')
+    self.assertEqual(r.status_code, 503)
+    self.assertEqual(len(self.server.requests), 3)
+
+  def test_connection_error(self):
+    # Find a port with nothing listening on it.
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    self.assertRaises(requests.exceptions.ConnectionError, self.client.get,
+      'http://127.0.0.1:%i/flaky'%port, timeout = 1.0, endpoint = 'closed')
+    self.assertEqual(len(self.sleeps), 2)
+    self.assertEqual(self.client.stats()['closed']['errors'], 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
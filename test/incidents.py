@@ -0,0 +1,34 @@
+import unittest
+import setup
+
+from dcmetrometrics.eles.Incident import incidents_digest
+
+class FakeIncident(object):
+  def __init__(self, unit_id, symptom_description):
+    self.UnitId = unit_id
+    self.SymptomDescription = symptom_description
+
+
+class TestIncidentsDigest(unittest.TestCase):
+
+  def setUp(self):
+    self.incidents = [FakeIncident('A01N01ESCALATOR', 'MINOR REPAIR'),
+                      FakeIncident('B02X03ELEVATOR', u'SAFETY INSPECTION'),
+                      FakeIncident('C03N02ESCALATOR', u'CALLBACK/REPAIR \u2013 A')]
+
+  def test_order_independent(self):
+    d = incidents_digest(self.incidents)
+    self.assertEqual(d, incidents_digest(self.incidents[::-1]))
+    # Duplicate incidents do not change the digest.
+    self.assertEqual(d, incidents_digest(self.incidents + self.incidents[:1]))
+
+  def test_changes(self):
+    d = incidents_digest(self.incidents)
+    self.assertNotEqual(d, incidents_digest(self.incidents[1:]))
+    changed = self.incidents[1:] + [FakeIncident('A01N01ESCALATOR', 'MAJOR REPAIR')]
+    self.assertNotEqual(d, incidents_digest(changed))
+    self.assertNotEqual(incidents_digest([]), d)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import setup
+
+import gevent
+from dcmetrometrics.common.JSONPublisher import JSONPublisher
+from dcmetrometrics.common.tickMetrics import TickProfiler
+
+class FakeUnit(object):
+  def __init__(self, unit_id):
+    self.unit_id = unit_id
+
+class FakeWriter(object):
+  """
+  Record the files written instead of writing them.
+  """
+  def __init__(self):
+    self.written = []
+    self.units = []
+    self.fail = set()
+
+  def write_unit(self, unit):
+    if unit.unit_id in self.fail:
+      raise IOError('Could not write %s'%unit.unit_id)
+    self.written.append(unit.unit_id)
+    self.units.append(unit)
+
+  def write_station_directory(self, units = None):
+    self.written.append('station_directory')
+    self.directory_units = units
+
+  def write_recent_updates(self):
+    self.written.append('recent_updates')
+
+
+class TestJSONPublisher(unittest.TestCase):
+
+  def setUp(self):
+    self.writer = FakeWriter()
+    self.profiler = TickProfiler('Test', write_interval = 0)
+    self.publisher = JSONPublisher(self.writer, min_interval = 0.05, profiler = self.profiler)
+
+  def tearDown(self):
+    self.publisher.stop(flush = False)
+
+  def mark_tick(self, unit_ids):
+    for unit_id in unit_ids:
+      self.publisher.unit_dirty(FakeUnit(unit_id))
+    self.publisher.directory_dirty()
+    self.publisher.recent_updates_dirty()
+
+  def test_coalesce(self):
+    self.mark_tick(['A01', 'A02'])
+    self.mark_tick(['A02', 'A03'])
+    self.assertEqual(self.writer.written, [])
+    self.assertEqual(self.publisher.publish(), 5)
+    self.assertEqual(self.writer.written, ['A01', 'A02', 'station_directory', 'recent_updates', 'A03'])
+    self.assertEqual(self.profiler.counters['json_files_written'], 5)
+
+  def test_greenlet(self):
+    self.publisher.start()
+    self.mark_tick(['A01'])
+    gevent.sleep(0.01)
+    self.assertEqual(len(self.writer.written), 3)
+    # A burst of changes within the interval is written in one round.
+    for i in range(5):
+      self.mark_tick(['A02', 'A03'])
+      gevent.sleep(0)
+    self.assertEqual(len(self.writer.written), 3)
+    gevent.sleep(0.1)
+    self.assertEqual(self.writer.written[3:], ['A02', 'A03', 'station_directory', 'recent_updates'])
+    self.assertEqual(len(self.publisher), 0)
+
+  def test_latest_unit(self):
+    # A unit marked dirty twice is written once, with the latest object.
+    stale, fresh = FakeUnit('A01'), FakeUnit('A01')
+    self.publisher.unit_dirty(stale)
+    self.publisher.unit_dirty(fresh)
+    self.assertEqual(self.publisher.publish(), 1)
+    self.assertEqual(self.writer.units, [fresh])
+
+  def test_directory_units(self):
+    units = [FakeUnit('A01'), FakeUnit('A02')]
+    self.publisher.directory_dirty()
+    self.publisher.directory_dirty(units)
+    self.assertEqual(self.publisher.publish(), 1)
+    self.assertEqual(self.writer.directory_units, units)
+
+  def test_failed_write(self):
+    self.writer.fail.add('A02')
+    self.mark_tick(['A01', 'A02'])
+    self.assertEqual(self.publisher.publish(), 3)
+    self.assertEqual(len(self.publisher), 1)
+    self.assertEqual(self.profiler.counters['json_publish_errors'], 1)
+    self.writer.fail.clear()
+    self.publisher.stop()
+    self.assertEqual(self.writer.written[-1], 'A02')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import setup
+import os
+import gzip
+import shutil
+import json
+import tempfile
+from datetime import datetime
+
+from dcmetrometrics.common import JSONifier
+from dcmetrometrics.common.JSONifier import JSONWriter, WebJSONEncoder, gzip_data, iter_json_array
+from dcmetrometrics.common.WebJSONMixin import WebJSONMixin
+from dcmetrometrics.common.metroTimes import tzutc
+
+class FakeStatus(WebJSONMixin):
+  web_json_fields = ['time', 'symptom']
+  def __init__(self, time, symptom):
+    self.time = time
+    self.symptom = symptom
+
+class FakeUnit(WebJSONMixin):
+  """
+  A unit whose statuses are held in memory, in descending order of time.
+  """
+  web_json_fields = ['unit_id', 'key_statuses', 'statuses']
+  def __init__(self, unit_id, statuses):
+    self.unit_id = unit_id
+    self.key_statuses = None
+    self.all_statuses = statuses
+  def get_statuses(self):
+    return list(self.all_statuses)
+  def get_statuses_since(self, start_time):
+    return [s for s in self.all_statuses if s.time >= start_time]
+
+class TestJSONWriter(unittest.TestCase):
+
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp()
+    self.outdir = os.path.join(self.basedir, 'json')
+    self.path = os.path.join(self.outdir, 'test.json')
+    self.writer = JSONWriter(self.basedir)
+
+  def tearDown(self):
+    shutil.rmtree(self.basedir)
+
+  def read(self, path):
+    with open(path, 'rb') as f:
+      return f.read()
+
+  def test_write(self):
+    self.assertTrue(self.writer.write_file(self.outdir, 'test.json', u'{"a": "\u2013"}'))
+    self.assertEqual(self.read(self.path), '{"a": "\xe2\x80\x93"}')
+    self.assertEqual(gzip.open(self.path + '.gz').read(), self.read(self.path))
+    # No temporary files are left behind.
+    self.assertEqual(sorted(os.listdir(self.outdir)), ['test.json', 'test.json.gz'])
+
+  def test_skip_unchanged(self):
+    self.writer.write_file(self.outdir, 'test.json', '{"a": 1}')
+    os.utime(self.path, (0, 0))
+    self.assertFalse(self.writer.write_file(self.outdir, 'test.json', '{"a": 1}'))
+    self.assertEqual(os.path.getmtime(self.path), 0)
+
+    # A new writer checks the file on disk.
+    writer = JSONWriter(self.basedir)
+    self.assertFalse(writer.write_file(self.outdir, 'test.json', '{"a": 1}'))
+
+    # The compressed copy is written if it is missing.
+    os.remove(self.path + '.gz')
+    self.assertTrue(writer.write_file(self.outdir, 'test.json', '{"a": 1}'))
+    self.assertTrue(os.path.exists(self.path + '.gz'))
+
+    # The file is written if it is missing, even if its digest is cached.
+    os.remove(self.path)
+    self.assertTrue(writer.write_file(self.outdir, 'test.json', '{"a": 1}'))
+    self.assertEqual(self.read(self.path), '{"a": 1}')
+
+    self.assertTrue(writer.write_file(self.outdir, 'test.json', '{"a": 2}'))
+    self.assertEqual(self.read(self.path), '{"a": 2}')
+    self.assertEqual((writer.num_written, writer.num_skipped), (3, 1))
+
+  def test_iter_json_array(self):
+    items = [{'a' : u'\u2013'}, datetime(2014, 1, 1, tzinfo = tzutc), FakeStatus(None, 'ON')]
+    self.assertEqual(''.join(iter_json_array(items)), json.dumps(items, cls = WebJSONEncoder))
+    self.assertEqual(''.join(iter_json_array(iter([]))), '[]')
+
+  def test_write_file_stream(self):
+    jdata = json.dumps(range(1000))
+    self.assertTrue(self.writer.write_file_stream(self.outdir, 'test.json', iter_json_array(xrange(1000))))
+    self.assertEqual(self.read(self.path), jdata)
+    self.assertEqual(gzip.open(self.path + '.gz').read(), jdata)
+    self.assertEqual(sorted(os.listdir(self.outdir)), ['test.json', 'test.json.gz'])
+
+    # Unchanged content is not rewritten, by either write method.
+    os.utime(self.path, (0, 0))
+    self.assertFalse(self.writer.write_file_stream(self.outdir, 'test.json', iter_json_array(xrange(1000))))
+    self.assertFalse(JSONWriter(self.basedir).write_file(self.outdir, 'test.json', jdata))
+    self.assertEqual(os.path.getmtime(self.path), 0)
+    self.assertEqual(sorted(os.listdir(self.outdir)), ['test.json', 'test.json.gz'])
+
+  def test_write_file_stream_error(self):
+    self.writer.write_file(self.outdir, 'test.json', '[1]')
+    def chunks():
+      yield '[2'
+      raise ValueError()
+    self.assertRaises(ValueError, self.writer.write_file_stream, self.outdir, 'test.json', chunks())
+    self.assertEqual(self.read(self.path), '[1]')
+    self.assertEqual(sorted(os.listdir(self.outdir)), ['test.json', 'test.json.gz'])
+
+  def test_gzip_deterministic(self):
+    self.assertEqual(gzip_data('{"a": 1}'), gzip_data('{"a": 1}'))
+
+  def test_no_gzip(self):
+    writer = JSONWriter(self.basedir, write_gzip = False)
+    writer.write_file(self.outdir, 'test.json', '{}')
+    self.assertEqual(os.listdir(self.outdir), ['test.json'])
+    os.remove(self.path)
+    self.assertTrue(writer.write_file(self.outdir, 'test.json', '{}'))
+    self.assertEqual(os.listdir(self.outdir), ['test.json'])
+
+  def test_brotli(self):
+    if JSONifier.brotli is None:
+      self.assertRaises(ImportError, JSONWriter, self.basedir, write_brotli = True)
+    else:
+      writer = JSONWriter(self.basedir, write_brotli = True)
+      writer.write_file(self.outdir, 'test.json', '{}')
+      self.assertTrue(os.path.exists(self.path + '.br'))
+
+
+class TestWriteUnit(unittest.TestCase):
+
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp()
+    self.unitdir = os.path.join(self.basedir, 'json', 'units')
+    self.writer = JSONWriter(self.basedir, write_gzip = False)
+    self.statuses = [FakeStatus(datetime(2014, 3, 1, tzinfo = tzutc), 'BROKEN'),
+                     FakeStatus(datetime(2014, 1, 1, tzinfo = tzutc), 'ON'),
+                     FakeStatus(datetime(2013, 6, 1, tzinfo = tzutc), 'OFF')]
+    self.unit = FakeUnit('A01X01', self.statuses)
+
+  def tearDown(self):
+    shutil.rmtree(self.basedir)
+
+  def load(self, *path):
+    with open(os.path.join(self.unitdir, *path)) as f:
+      return json.load(f)
+
+  def load_statuses(self, summary):
+    ret = []
+    for chunk in summary['history']:
+      ret.extend(self.load(*chunk['url'].split('/')[3:])['statuses'])
+    return [s['symptom'] for s in ret]
+
+  def test_write_unit(self):
+    self.writer.write_unit(self.unit, self.statuses)
+    summary = self.load('A01X01.json')
+    self.assertFalse('statuses' in summary)
+    self.assertEqual([c['year'] for c in summary['history']], [2014, 2013])
+    self.assertEqual(summary['history'][0]['url'], '/json/units/A01X01/2014.json')
+    self.assertEqual(summary['history'][0]['num_statuses'], 2)
+    self.assertEqual(summary['history'][0]['first_time'], '2014-01-01T00:00:00+00:00')
+    self.assertEqual(self.load_statuses(summary), ['BROKEN', 'ON', 'OFF'])
+
+  def test_incremental(self):
+    self.writer.write_unit(self.unit, self.statuses)
+    old_chunk = os.path.join(self.unitdir, 'A01X01', '2013.json')
+    os.utime(old_chunk, (0, 0))
+
+    # Only the current chunk, and any newer chunks, are rewritten.
+    self.statuses.insert(0, FakeStatus(datetime(2015, 2, 1, tzinfo = tzutc), 'ON'))
+    self.writer.write_unit(self.unit)
+    summary = self.load('A01X01.json')
+    self.assertEqual([c['year'] for c in summary['history']], [2015, 2014, 2013])
+    self.assertEqual(self.load_statuses(summary), ['ON', 'BROKEN', 'ON', 'OFF'])
+    self.assertEqual(os.path.getmtime(old_chunk), 0)
+
+  def test_no_manifest(self):
+    self.writer.write_unit(self.unit)
+    self.assertEqual(self.load_statuses(self.load('A01X01.json')), ['BROKEN', 'ON', 'OFF'])
+
+
+if __name__ == '__main__':
+  unittest.main()
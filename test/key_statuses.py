@@ -0,0 +1,89 @@
+import unittest
+import setup
+import random
+
+from dcmetrometrics.eles.models import KeyStatuses
+from dcmetrometrics.eles.StatusRecord import StatusRecord
+from dcmetrometrics.common.metroTimes import tzutc
+from bson.objectid import ObjectId
+from bson.dbref import DBRef
+from datetime import timedelta, datetime
+
+CATEGORY_CHOICES = ['ON', 'ON', 'BROKEN', 'BROKEN', 'INSPECTION', 'OFF', 'REHAB']
+
+KEYS = ['lastFixStatus', 'lastBreakStatus', 'lastInspectionStatus',
+        'lastOperationalStatus', 'lastStatus', 'currentBreakStatus']
+
+def make_statuses(num, rand, max_gap = 3600):
+  """
+  Generate a random status history in random order. A max_gap of 0 gives
+  statuses with the same time.
+  """
+  t = datetime(2014, 6, 1, tzinfo = tzutc)
+  statuses = []
+  for i in range(num):
+    t = t + timedelta(seconds = rand.randint(0, max_gap))
+    c = rand.choice(CATEGORY_CHOICES)
+    statuses.append(StatusRecord(unit_id = 'A01N01ESCALATOR', time = t,
+      symptom_description = '%s %i'%(c, i), symptom_category = c, pk = ObjectId()))
+  rand.shuffle(statuses)
+  return statuses
+
+
+class TestSelectKeyStatuses(unittest.TestCase):
+
+  def check(self, statuses):
+    ks = KeyStatuses.select_key_statuses(statuses)
+    ks_old = KeyStatuses.select_key_statuses_OLD(statuses)
+    for k in KEYS:
+      s, s_old = getattr(ks, k), getattr(ks_old, k)
+      if s_old is None:
+        self.assertTrue(s is None, k)
+      else:
+        self.assertEqual(s.pk, s_old.pk, k)
+
+  def test_random(self):
+    rand = random.Random(3)
+    for i in range(200):
+      self.check(make_statuses(rand.randint(1, 40), rand))
+
+  def test_same_times(self):
+    rand = random.Random(4)
+    for i in range(200):
+      self.check(make_statuses(rand.randint(1, 40), rand, max_gap = rand.choice([0, 1, 2])))
+
+  def test_long_history(self):
+    rand = random.Random(5)
+    self.check(make_statuses(2000, rand))
+
+  def test_break_fix(self):
+    t = datetime(2014, 6, 1, tzinfo = tzutc)
+    categories = ['ON', 'BROKEN', 'BROKEN', 'ON', 'INSPECTION', 'ON', 'BROKEN']
+    statuses = [StatusRecord(unit_id = 'A01N01ESCALATOR', time = t + timedelta(hours = i),
+                             symptom_category = c, pk = ObjectId()) for i, c in enumerate(categories)]
+    pks = [s.pk for s in statuses]
+    ks = KeyStatuses.select_key_statuses(statuses)
+    # The lastBreakStatus is the first break after the most recent operational
+    # status that is followed by a break.
+    self.assertEqual(pks.index(ks.lastBreakStatus.pk), 6)
+    self.assertEqual(pks.index(ks.lastFixStatus.pk), 3)
+    self.assertEqual(pks.index(ks.lastInspectionStatus.pk), 4)
+    self.assertEqual(pks.index(ks.lastOperationalStatus.pk), 5)
+    self.assertEqual(pks.index(ks.currentBreakStatus.pk), 6)
+    self.assertEqual(pks.index(ks.lastStatus.pk), 6)
+
+class TestCopy(unittest.TestCase):
+
+  def test_copy_references(self):
+    ref = DBRef('escalator_statuses', ObjectId())
+    ks = KeyStatuses(unit_id = 'A01N01ESCALATOR', lastFixStatus = ref)
+    ks_copy = ks.copy()
+    self.assertFalse(ks_copy is ks)
+    # The references are not dereferenced.
+    self.assertTrue(ks_copy._data['lastFixStatus'] is ref)
+    self.assertTrue(ks_copy._data['lastStatus'] is None)
+    self.assertEqual(ks_copy.unit_id, 'A01N01ESCALATOR')
+
+
+if __name__ == '__main__':
+  unittest.main()
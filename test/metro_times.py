@@ -0,0 +1,83 @@
+import unittest
+import setup
+import random
+
+from dcmetrometrics.common import metroTimes
+from dcmetrometrics.common.metroTimes import (TimeRange, MetroOpenTable, nytz, tzutc, toUtc,
+  dateToOpen, dateToClose, toEpochMicros, metroOpenSecondsArray)
+from datetime import timedelta, datetime, date
+
+def brute_force_open_time(start, end):
+  """
+  Compute the metro open time between start and end by adding up
+  the overlap with each metro day.
+  """
+  seconds = 0.0
+  d = toUtc(start).date() - timedelta(days = 2)
+  while dateToOpen(d) < end:
+    o = toUtc(max(dateToOpen(d), start))
+    c = toUtc(min(dateToClose(d), end))
+    if c > o:
+      seconds += (c - o).total_seconds()
+    d += timedelta(days = 1)
+  return seconds
+
+class TestMetroOpenTime(unittest.TestCase):
+
+  def test_normal_day(self):
+    # Monday - Thursday: 5 AM to midnight
+    start = datetime(2015, 2, 16, 0, tzinfo = nytz)
+    end = datetime(2015, 2, 17, 0, tzinfo = nytz)
+    self.assertEqual(TimeRange(start, end).metroOpenTime, 19*3600.0)
+
+  def test_daylight_savings_start(self):
+    # Saturday service runs 7 AM to 3 AM, but 2 AM to 3 AM is skipped
+    start = datetime(2015, 3, 7, 6, tzinfo = nytz)
+    end = datetime(2015, 3, 8, 6, tzinfo = nytz)
+    self.assertEqual(TimeRange(start, end).metroOpenTime, 19*3600.0)
+    self.assertEqual(TimeRange(start, end).metroOpenTime_NODST(), 20*3600.0)
+
+  def test_daylight_savings_end(self):
+    # Saturday service runs 7 AM to 3 AM, and 1 AM to 2 AM happens twice
+    start = datetime(2015, 10, 31, 6, tzinfo = nytz)
+    end = datetime(2015, 11, 1, 6, tzinfo = nytz)
+    self.assertEqual(TimeRange(start, end).metroOpenTime, 21*3600.0)
+
+  def test_closed(self):
+    start = datetime(2015, 2, 17, 1, tzinfo = nytz)
+    end = datetime(2015, 2, 17, 4, 59, tzinfo = nytz)
+    self.assertEqual(TimeRange(start, end).metroOpenTime, 0.0)
+
+  def test_random_ranges(self):
+    rand = random.Random(0)
+    base = datetime(2014, 1, 1, tzinfo = tzutc)
+    for i in range(300):
+      start = base + timedelta(seconds = rand.randint(0, 700*24*3600))
+      end = start + timedelta(seconds = rand.randint(0, 20*24*3600), microseconds = rand.randint(0, 999999))
+      self.assertAlmostEqual(TimeRange(start, end).metroOpenTime, brute_force_open_time(start, end), places = 6)
+
+  def test_bulk(self):
+    rand = random.Random(1)
+    base = datetime(2013, 6, 1, tzinfo = tzutc)
+    ranges = []
+    for i in range(300):
+      start = base + timedelta(seconds = rand.randint(0, 900*24*3600))
+      end = start + timedelta(seconds = rand.randint(0, 30*24*3600), microseconds = rand.randint(0, 999999))
+      ranges.append((start, end))
+    starts = [toEpochMicros(s) for s, e in ranges]
+    ends = [toEpochMicros(e) for s, e in ranges]
+    expected = [TimeRange(s, e).metroOpenTime for s, e in ranges]
+    self.assertEqual(list(metroOpenSecondsArray(starts, ends)), expected)
+
+  def test_table_extends(self):
+    table = MetroOpenTable(first_day = date(2015, 1, 1), last_day = date(2015, 2, 1))
+    start = toEpochMicros(datetime(2001, 5, 1, tzinfo = nytz))
+    end = toEpochMicros(datetime(2040, 5, 1, tzinfo = nytz))
+    seconds = (table.openTimeBefore(end) - table.openTimeBefore(start))/1E6
+    self.assertTrue(table.first_day <= date(2001, 5, 1))
+    self.assertTrue(table.last_day >= date(2040, 5, 1))
+    self.assertEqual(seconds, metroTimes.metroOpenSeconds(start, end))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import setup
+import os
+import shutil
+import tempfile
+
+from dcmetrometrics.common.parallel import shard, run_sharded, Checkpoint
+
+def mark_units(unit_ids, checkpoint_path):
+  checkpoint = Checkpoint(checkpoint_path)
+  for unit_id in unit_ids:
+    checkpoint.mark(unit_id, pid = os.getpid())
+  return unit_ids
+
+
+class TestParallel(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'checkpoint.json')
+    self.unit_ids = ['A%02iN01ESCALATOR'%i for i in range(50)]
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_shard(self):
+    shards = shard(self.unit_ids, 3)
+    self.assertEqual(len(shards), 3)
+    self.assertEqual(sorted(u for s in shards for u in s), self.unit_ids)
+    self.assertTrue(max(len(s) for s in shards) - min(len(s) for s in shards) <= 1)
+
+  def test_serial(self):
+    results = run_sharded(mark_units, self.unit_ids, workers = 1, args = (self.path,))
+    self.assertEqual(results, [self.unit_ids])
+    self.assertEqual(sorted(Checkpoint(self.path).completed()), self.unit_ids)
+
+  def test_workers(self):
+    # Skip the database connection in the workers.
+    results = run_sharded(mark_units, self.unit_ids, workers = 4, args = (self.path,),
+      initializer = None)
+    self.assertEqual(len(results), 4)
+    completed = Checkpoint(self.path).completed()
+    self.assertEqual(sorted(completed), self.unit_ids)
+    self.assertFalse(os.getpid() in set(rec['pid'] for rec in completed.itervalues()))
+
+  def test_resume(self):
+    checkpoint = Checkpoint(self.path)
+    self.assertEqual(checkpoint.completed(), {})
+    checkpoint.mark('A01N01ESCALATOR', start_day = '2015-01-01')
+    # A partially written record from a crash is ignored.
+    with open(self.path, 'a') as f:
+      f.write('{"unit_id": "A02N0')
+    completed = checkpoint.completed()
+    self.assertEqual(completed.keys(), ['A01N01ESCALATOR'])
+    self.assertEqual(completed['A01N01ESCALATOR']['start_day'], '2015-01-01')
+    checkpoint.remove()
+    self.assertFalse(os.path.exists(self.path))
+
+  def test_phases(self):
+    checkpoint = Checkpoint(self.path)
+    self.assertEqual(checkpoint.completed_phases(), set())
+    checkpoint.mark_phase('key_statuses')
+    checkpoint.mark('A01N01ESCALATOR')
+    self.assertEqual(checkpoint.completed_phases(), set(['key_statuses']))
+    # Phases are not units.
+    self.assertEqual(checkpoint.completed().keys(), ['A01N01ESCALATOR'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import setup
+import random
+
+from dcmetrometrics.eles import models
+from dcmetrometrics.eles.PerformanceTracker import PerformanceTracker, UnitPerformanceTracker, compare_summaries
+from dcmetrometrics.common.metroTimes import nytz, tzutc
+from datetime import timedelta, datetime
+
+CATEGORIES = ['ON', 'ON', 'ON', 'BROKEN', 'BROKEN', 'INSPECTION', 'OFF', 'REHAB']
+
+def make_statuses(start, num, seed, active = True):
+  """
+  Generate a random status history for a unit, in ascending order.
+  """
+  rand = random.Random(seed)
+  times = [start]
+  for i in range(num - 1):
+    times.append(times[-1] + timedelta(minutes = rand.randint(1, 3*24*60)))
+  end_times = times[1:] + [None if active else times[-1] + timedelta(hours = 5)]
+  statuses = []
+  for t, te in zip(times, end_times):
+    s = models.UnitStatus(unit_id = 'A01N01ESCALATOR',
+                          time = t.astimezone(tzutc),
+                          end_time = te.astimezone(tzutc) if te else None,
+                          symptom_category = rand.choice(CATEGORIES))
+    statuses.append(s)
+  return statuses
+
+
+class TestPerformanceTracker(unittest.TestCase):
+
+  def check(self, statuses, end_time, tracker = None):
+    unit = models.Unit(unit_id = 'A01N01ESCALATOR')
+    if tracker is None:
+      tracker = PerformanceTracker()
+    expected = unit.compute_performance_summary(statuses = statuses, end_time = end_time)
+    actual = tracker.summarize(unit, end_time = end_time, statuses = statuses)
+    diffs = compare_summaries(expected, actual)
+    self.assertEqual(diffs, [])
+
+  def test_random_histories(self):
+    start = datetime(2014, 10, 20, 8, tzinfo = nytz)
+    for seed in range(10):
+      statuses = make_statuses(start, 60, seed)
+      end_time = statuses[-1].time + timedelta(hours = 7)
+      self.check(statuses, end_time)
+
+  def test_closed_last_status(self):
+    start = datetime(2015, 5, 1, 22, tzinfo = nytz)
+    statuses = make_statuses(start, 40, 100, active = False)
+    end_time = statuses[-1].end_time - timedelta(hours = 1)
+    self.check(statuses, end_time)
+
+  def test_incremental(self):
+    """
+    Statuses added one at a time should give the same summary as
+    a full recompute.
+    """
+    start = datetime(2015, 3, 1, 4, tzinfo = nytz)
+    statuses = make_statuses(start, 50, 7)
+    unit = models.Unit(unit_id = 'A01N01ESCALATOR')
+    tracker = PerformanceTracker()
+    tracker.load_unit(unit, statuses[:20])
+    for s in statuses[20:]:
+      tracker.add_status(s)
+    self.check(statuses, statuses[-1].time + timedelta(hours = 1), tracker)
+
+  def test_new_status_at_end_time(self):
+    start = datetime(2015, 2, 16, 22, tzinfo = nytz)
+    t2 = datetime(2015, 2, 17, 3, tzinfo = nytz)
+    t3 = datetime(2015, 2, 21, 4, tzinfo = nytz)
+    s1 = models.UnitStatus(time = start, end_time = t2, symptom_category = "INSPECTION")
+    s2 = models.UnitStatus(time = t2, end_time = t3, symptom_category = "OFF")
+    s3 = models.UnitStatus(time = t3, end_time = None, symptom_category = "BROKEN")
+    self.check([s1, s2, s3], t3)
+
+  def test_out_of_order(self):
+    start = datetime(2015, 2, 16, 22, tzinfo = nytz)
+    statuses = make_statuses(start, 3, 1)
+    tracker = UnitPerformanceTracker('A01N01ESCALATOR')
+    tracker.add_status(statuses[1])
+    self.assertRaises(RuntimeError, tracker.add_status, statuses[0])
+
+
+if __name__ == '__main__':
+  unittest.main()
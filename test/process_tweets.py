@@ -0,0 +1,71 @@
+import unittest
+import setup
+
+from dcmetrometrics.hotcars import process_tweets
+from dcmetrometrics.hotcars.process_tweets import (parseText, parseTweet, tokenize, preprocessText,
+  getHotCarDataFromText, getHotCarDataFromText_OLD, tweetIsValidReport)
+
+TEXTS = [u'I know it\'s winter but red line 1161 is too hot! @unsuckdcmetro @MetroHotCars',
+         u'@MetroHotCars no joke car 1191 redline to shady grove is unreal hot! @unsuckdcmetro',
+         u'Car number #1009 is a #HOTcar filled with LOUD people. #wmata',
+         u'@WMATA car 5012 on the SV line, 6000 series cars are cooler',
+         u'Silver Spring bound 3004 is an oven \u2013 #wmata #hotcar',
+         u'RD1234GL and 2000SERIES 11000 SERIESX',
+         u'7001 hot on BART, not #wmata',
+         u'1000 SERIES',
+         u'']
+
+class FakeUser(object):
+  screen_name = 'rider'
+
+class FakeTweet(object):
+  retweeted_status = None
+  user = FakeUser()
+  def __init__(self, tweet_id, text):
+    self.id = tweet_id
+    self.text = text
+
+class TestParseText(unittest.TestCase):
+
+  def test_same_as_preprocessed(self):
+    for text in TEXTS:
+      self.assertEqual(tokenize(text), preprocessText(text).split())
+      self.assertEqual(getHotCarDataFromText(text), getHotCarDataFromText_OLD(text))
+
+  def test_parse(self):
+    parsed = parseText(TEXTS[3])
+    self.assertEqual(parsed.cars, [5012])
+    self.assertEqual(parsed.colors, ['SILVER'])
+    self.assertFalse(parsed.has_excluded_word)
+    self.assertEqual(parseText(TEXTS[4]).colors, [])
+    self.assertEqual(parseText(TEXTS[5]).cars, [1234])
+    self.assertTrue(parseText(TEXTS[6]).has_excluded_word)
+
+  def test_parse_tweet(self):
+    tweet = FakeTweet(1, TEXTS[0])
+    parsed = parseTweet(tweet)
+    self.assertEqual(parsed.cars, [1161])
+    # The parse is memoized by tweet id.
+    tweet.text = TEXTS[1]
+    self.assertTrue(parseTweet(tweet) is parsed)
+
+  def test_valid_report(self):
+    tweet = FakeTweet(2, TEXTS[6])
+    self.assertFalse(tweetIsValidReport(tweet, getHotCarDataFromText(tweet.text)))
+    tweet = FakeTweet(3, TEXTS[0])
+    self.assertTrue(tweetIsValidReport(tweet, getHotCarDataFromText(tweet.text)))
+
+  def test_cache_size(self):
+    size = process_tweets.PARSED_TWEETS_CACHE_SIZE
+    try:
+      process_tweets.PARSED_TWEETS_CACHE_SIZE = 2
+      for i in range(10, 15):
+        parseTweet(FakeTweet(i, TEXTS[0]))
+      self.assertEqual(process_tweets._parsed_tweets.keys()[-2:], [13, 14])
+      self.assertTrue(len(process_tweets._parsed_tweets) <= 2)
+    finally:
+      process_tweets.PARSED_TWEETS_CACHE_SIZE = size
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import setup
+from json import dumps
+from datetime import datetime
+from bson import ObjectId
+
+from dcmetrometrics.common.JSONifier import WebJSONEncoder
+from dcmetrometrics.common.rawWebJSON import WebJSONProjection, format_datetime
+from dcmetrometrics.common.metroTimes import tzutc
+from dcmetrometrics.eles.models import Unit, UnitStatus
+from dcmetrometrics.hotcars.models import HotCarReport, HotCarTweet, HotCarTweeter
+
+def encode(o):
+  return dumps(o, cls = WebJSONEncoder)
+
+class TestWebJSONProjection(unittest.TestCase):
+
+  def setUp(self):
+    self.status_sons = [
+      {'_id' : ObjectId(), 'escalator_id' : ObjectId(), 'unit_id' : 'A01X01', 'time' : datetime(2014, 6, 1, 12, 30),
+       'end_time' : datetime(2014, 6, 2, 1, 2, 3, 456000), 'metro_open_time' : 60, 'tickDelta' : 5,
+       'update_type' : 'Break', 'symptom_description' : u'Minor Repair \u2013 Hold', 'symptom_category' : 'BROKEN'},
+      # Missing fields take their default, and an explicit null stays null.
+      {'_id' : ObjectId(), 'unit_id' : 'A01X02', 'time' : datetime(2014, 6, 1), 'end_time' : None,
+       'symptom_description' : 'Operational', 'symptom_category' : 'ON'}]
+
+  def test_format_datetime(self):
+    for t in [datetime(2014, 6, 1), datetime(2014, 6, 1, 1, 2, 3, 4000), datetime(2014, 6, 1, tzinfo = tzutc)]:
+      self.assertEqual(format_datetime(t), encode(t)[1:-1])
+
+  def test_unit_status(self):
+    projection = WebJSONProjection(UnitStatus)
+    self.assertEqual(projection.fields, ['unit_id', 'time', 'end_time', 'metro_open_time', 'update_type',
+                                         'tickDelta', 'symptom_description', 'symptom_category'])
+    for son in self.status_sons:
+      doc = UnitStatus._from_son(son)
+      self.assertEqual(encode(projection.convert(son)), encode(doc))
+      self.assertEqual(encode(projection.convert_document(doc)), encode(doc))
+      doc._add_timezones()
+      self.assertEqual(encode(projection.convert_document(doc)), encode(doc))
+
+  def test_references(self):
+    user_son = {'_id' : 10L, 'handle' : 'rider'}
+    tweet_son = {'_id' : 20L, 'ack' : True, 'embed_html' : '<p/>', 'text' : 'hot car 1000',
+                 'time' : datetime(2014, 7, 1), 'user_id' : 10L, 'handle' : 'rider'}
+    report_son = {'_id' : ObjectId(), 'tweet_id' : 20L, 'car_number' : 1000, 'color' : 'RED', 'time' : datetime(2014, 7, 1)}
+
+    tweet = HotCarTweet._from_son(tweet_son)
+    tweet.user = HotCarTweeter._from_son(user_son)
+    report = HotCarReport._from_son(report_son)
+    report.tweet = tweet
+
+    projection = WebJSONProjection(HotCarReport)
+    tweets = projection.references['tweet']
+    tweets.references['user'].find_by_ids = lambda ids: {10L : tweets.references['user'].convert(user_son)}
+    tweets.find_by_ids = lambda ids: {20L : tweets.resolve([tweets.convert(tweet_son)])[0]}
+    converted = projection.resolve([projection.convert(report_son)])
+    self.assertEqual(encode(converted), encode([report]))
+
+  def test_unsupported(self):
+    # Unit has embedded documents, and statuses is not a database field.
+    self.assertRaises(ValueError, WebJSONProjection, Unit)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import setup
+
+from dcmetrometrics.eles.dbUtils import pad_status_docs, unit_status_from_son
+from dcmetrometrics.common.metroTimes import nytz, tzutc
+from datetime import timedelta, datetime
+
+class TestPadStatusDocs(unittest.TestCase):
+
+  def setUp(self):
+    # Statuses are stored with naive UTC times, and loaded in descending order of time.
+    t0 = datetime(2015, 2, 1, 12)
+    categories = ['ON', 'BROKEN', 'OFF', 'ON', 'BROKEN', 'INSPECTION', 'ON', 'BROKEN', 'ON', 'OFF']
+    docs = []
+    for i, c in enumerate(categories):
+      docs.append({'unit_id' : 'A01N01ESCALATOR',
+                   'time' : t0 + timedelta(days = i),
+                   'symptom_category' : c})
+    self.docs = docs[::-1]
+    self.t0 = t0.replace(tzinfo = tzutc)
+
+  def times(self, docs):
+    return [(d['time'] - self.t0.replace(tzinfo = None)).days for d in docs]
+
+  def test_no_window(self):
+    self.assertEqual(pad_status_docs(self.docs), self.docs)
+
+  def test_pad_preceeding(self):
+    # The first status in the window is BROKEN, so pad back to the ON status on day 3
+    start_time = self.t0 + timedelta(days = 4)
+    docs = pad_status_docs(self.docs, start_time = start_time)
+    self.assertEqual(self.times(docs), [9, 8, 7, 6, 5, 4, 3])
+
+  def test_no_pad_when_operational(self):
+    start_time = self.t0 + timedelta(days = 6)
+    docs = pad_status_docs(self.docs, start_time = start_time)
+    self.assertEqual(self.times(docs), [9, 8, 7, 6])
+
+  def test_pad_following(self):
+    # The last status in the window is INSPECTION, so pad forward to the ON status on day 6
+    end_time = (self.t0 + timedelta(days = 5, hours = 1)).astimezone(nytz)
+    start_time = self.t0 + timedelta(days = 4)
+    docs = pad_status_docs(self.docs, start_time = start_time, end_time = end_time)
+    self.assertEqual(self.times(docs), [6, 5, 4, 3])
+
+  def test_empty_window(self):
+    start_time = self.t0 + timedelta(days = 4, hours = 1)
+    end_time = self.t0 + timedelta(days = 4, hours = 2)
+    docs = pad_status_docs(self.docs, start_time = start_time, end_time = end_time)
+    self.assertEqual(self.times(docs), [6, 5, 4, 3])
+
+  def test_factory(self):
+    son = dict(self.docs[0])
+    son['end_time'] = son['time'] + timedelta(hours = 1)
+    status = unit_status_from_son(son)
+    self.assertEqual(status.unit_id, 'A01N01ESCALATOR')
+    self.assertEqual(status.time, son['time'].replace(tzinfo = tzutc))
+    self.assertEqual(status.end_time.tzinfo, tzutc)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+import setup
+import random
+import pickle
+from copy import deepcopy
+
+from dcmetrometrics.eles import models
+from dcmetrometrics.eles.StatusGroup import StatusGroup
+from dcmetrometrics.eles.StatusRecord import StatusRecord, to_status_records
+from dcmetrometrics.common.metroTimes import nytz, tzutc
+from bson.objectid import ObjectId
+from datetime import timedelta, datetime, date
+
+CATEGORY_CHOICES = ['ON', 'ON', 'ON', 'BROKEN', 'BROKEN', 'INSPECTION', 'OFF', 'REHAB']
+
+def make_statuses(unit_id, start, num, rand):
+  """
+  Generate a random status history for a unit, in ascending order.
+  The last status is still active.
+  """
+  times = [start]
+  for i in range(num - 1):
+    times.append(times[-1] + timedelta(seconds = rand.randint(1, 2*24*3600)))
+  end_times = times[1:] + [None]
+  statuses = []
+  for i, (t, te) in enumerate(zip(times, end_times)):
+    c = rand.choice(CATEGORY_CHOICES)
+    s = models.UnitStatus(id = ObjectId(),
+                          unit_id = unit_id,
+                          time = t.astimezone(tzutc),
+                          end_time = te.astimezone(tzutc) if te else None,
+                          symptom_description = '%s %i'%(c, i),
+                          symptom_category = c)
+    statuses.append(s)
+  return statuses
+
+def times(statuses):
+  return [(s.time, s.end_time) for s in statuses]
+
+
+class TestStatusRecord(unittest.TestCase):
+
+  def setUp(self):
+    self.t = datetime(2015, 3, 1, 12, tzinfo = nytz)
+    self.record = StatusRecord(unit_id = 'A01N01ESCALATOR', time = self.t,
+                               symptom_description = 'CALLBACK/REPAIR',
+                               symptom_category = 'BROKEN', pk = ObjectId())
+
+  def test_times_utc(self):
+    self.assertEqual(self.record.time, self.t)
+    self.assertEqual(self.record.time.tzinfo, tzutc)
+    naive = StatusRecord(time = datetime(2015, 3, 1, 17))
+    self.assertEqual(naive.time, self.t)
+
+  def test_immutable(self):
+    def set_time():
+      self.record.time = self.t
+    self.assertRaises(AttributeError, set_time)
+    self.assertTrue(deepcopy(self.record) is self.record)
+    end_time = self.t + timedelta(hours = 1)
+    r = self.record.replace(end_time = end_time)
+    self.assertEqual(r.end_time, end_time)
+    self.assertEqual(r.pk, self.record.pk)
+    self.assertTrue(self.record.end_time is None)
+    self.assertRaises(AttributeError, self.record.replace, station_code = 'A01')
+
+  def test_document_interface(self):
+    self.assertTrue(self.record.is_active)
+    self.assertFalse('end_time' in self.record)
+    self.assertTrue('time' in self.record)
+    self.assertEqual(self.record['time'], self.t)
+    self.assertRaises(KeyError, self.record.__getitem__, 'station_code')
+
+  def test_pickle(self):
+    r = pickle.loads(pickle.dumps(self.record, 2))
+    self.assertEqual(r, self.record)
+    r = pickle.loads(pickle.dumps(self.record))
+    self.assertEqual(r, self.record)
+
+  def test_unit_status_round_trip(self):
+    doc = self.record.to_unit_status()
+    self.assertEqual(doc.pk, self.record.pk)
+    self.assertEqual(StatusRecord.from_unit_status(doc), self.record)
+
+  def test_from_son(self):
+    son = {'_id' : self.record.pk,
+           'unit_id' : 'A01N01ESCALATOR',
+           'time' : datetime(2015, 3, 1, 17),
+           'symptom_description' : 'CALLBACK/REPAIR',
+           'symptom_category' : 'BROKEN'}
+    self.assertEqual(StatusRecord.from_son(son), self.record)
+
+
+class TestStatusGroupWithRecords(unittest.TestCase):
+
+  def setUp(self):
+    rand = random.Random(2)
+    start = datetime(2015, 1, 5, 8, tzinfo = nytz)
+    self.statuses = make_statuses('A01N01ESCALATOR', start, 80, rand)
+    self.records = to_status_records(self.statuses)
+
+  def check(self, start_time, end_time):
+    sg1 = StatusGroup(self.statuses, start_time, end_time)
+    sg2 = StatusGroup(self.records, start_time, end_time)
+    self.assertEqual(times(sg1.statuses_trimmed), times(sg2.statuses_trimmed))
+    self.assertEqual(sg1.availability, sg2.availability)
+    self.assertEqual(sg1.brokenTimePercentage, sg2.brokenTimePercentage)
+    self.assertEqual(times(sg1.breakStatuses), times(sg2.breakStatuses))
+    self.assertEqual(times(sg1.inspectionStatuses), times(sg2.inspectionStatuses))
+    self.assertEqual(times(sg1.fixStatuses), times(sg2.fixStatuses))
+    self.assertEqual(sg1.break_days, sg2.break_days)
+    self.assertEqual(dict(sg1.day_to_break_count), dict(sg2.day_to_break_count))
+    self.assertEqual([o.is_active for o in sg1.outageStatuses],
+                     [o.is_active for o in sg2.outageStatuses])
+
+  def test_all_time(self):
+    self.check(None, None)
+
+  def test_windows(self):
+    end_time = self.statuses[-10].time + timedelta(hours = 3)
+    for days in [1, 3, 7, 30]:
+      self.check(end_time - timedelta(days = days), end_time)
+
+  def test_records_not_modified(self):
+    records = list(self.records)
+    StatusGroup(self.records, self.records[3].time + timedelta(seconds = 1), None).outageStatuses
+    self.assertEqual(records, self.records)
+    self.assertTrue(self.records[-1].end_time is None)
+
+  def test_key_statuses(self):
+    ks1 = models.KeyStatuses.select_key_statuses(self.statuses)
+    ks2 = models.KeyStatuses.select_key_statuses(self.records)
+    for k in ['lastFixStatus', 'lastBreakStatus', 'lastInspectionStatus',
+              'lastOperationalStatus', 'lastStatus', 'currentBreakStatus']:
+      s1, s2 = getattr(ks1, k), getattr(ks2, k)
+      if s1 is None:
+        self.assertTrue(s2 is None)
+      else:
+        self.assertTrue(isinstance(s2, models.UnitStatus))
+        self.assertEqual(s1.pk, s2.pk)
+
+  def test_daily_service_report(self):
+    unit = models.Unit(unit_id = 'A01N01ESCALATOR')
+    for day in [date(2015, 1, 5), date(2015, 1, 20), date(2015, 2, 1)]:
+      r1 = models.DailyServiceReport.compute_for_unit(unit, day, statuses = self.statuses)
+      r2 = models.DailyServiceReport.compute_for_unit(unit, day, statuses = self.records)
+      for k in ['availability', 'broken_time_percentage', 'num_breaks', 'num_inspections', 'num_fixes']:
+        self.assertEqual(getattr(r1, k), getattr(r2, k))
+      self.assertEqual([s.pk for s in r1.statuses], [s.pk for s in r2.statuses])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import setup
+import random
+
+from dcmetrometrics.eles import models
+from dcmetrometrics.eles.StatusGroup import StatusGroup
+from dcmetrometrics.eles.StatusStore import StatusStore, CATEGORIES
+from dcmetrometrics.common.metroTimes import nytz, tzutc, toEpochMicros
+from datetime import timedelta, datetime
+
+CATEGORY_CHOICES = ['ON', 'ON', 'ON', 'BROKEN', 'BROKEN', 'INSPECTION', 'INSPECTION', 'OFF', 'REHAB']
+
+def make_statuses(unit_id, start, num, rand):
+  """
+  Generate a random status history for a unit, in ascending order.
+  The last status is still active.
+  """
+  times = [start]
+  for i in range(num - 1):
+    times.append(times[-1] + timedelta(seconds = rand.randint(1, 3*24*3600), microseconds = 1000*rand.randint(0, 999)))
+  end_times = times[1:] + [None]
+  statuses = []
+  for t, te in zip(times, end_times):
+    s = models.UnitStatus(unit_id = unit_id,
+                          time = t.astimezone(tzutc),
+                          end_time = te.astimezone(tzutc) if te else None,
+                          symptom_category = rand.choice(CATEGORY_CHOICES))
+    statuses.append(s)
+  return statuses
+
+
+class TestStatusStore(unittest.TestCase):
+
+  def setUp(self):
+    rand = random.Random(1)
+    self.unit_ids = ['A%02iN01ESCALATOR'%i for i in range(12)]
+    self.unit_statuses = {}
+    for unit_id in self.unit_ids[:-1]:
+      start = datetime(2014, 3, rand.randint(1, 28), rand.randint(0, 23), tzinfo = nytz)
+      self.unit_statuses[unit_id] = make_statuses(unit_id, start, rand.randint(1, 60), rand)
+    # The last unit has no statuses.
+    self.unit_statuses[self.unit_ids[-1]] = []
+    all_statuses = [s for statuses in self.unit_statuses.values() for s in statuses]
+    rand.shuffle(all_statuses)
+    self.store = StatusStore.from_statuses(all_statuses, unit_ids = self.unit_ids)
+
+  def check_window(self, start_time, end_time):
+    window = self.store.window(start_time, end_time)
+    for i, unit_id in enumerate(self.unit_ids):
+      statuses = self.unit_statuses[unit_id]
+      if not statuses:
+        self.assertEqual(window.availability[i], 0.0)
+        self.assertEqual(window.num_breaks[i], 0)
+        continue
+      sg = StatusGroup(statuses, start_time, end_time)
+      self.assertEqual(window.availability[i], sg.availability)
+      self.assertEqual(window.brokenTimePercentage[i], sg.brokenTimePercentage)
+      time_allocation = window.unit_time_allocation(unit_id)
+      for c in CATEGORIES:
+        self.assertEqual(time_allocation.get(c, 0.0), sg.timeAllocation.get(c, 0.0))
+      self.assertEqual(window.num_breaks[i], len(sg.breakStatuses))
+      self.assertEqual(window.num_inspections[i], len(sg.inspectionStatuses))
+
+      # The break statuses are the same statuses
+      store_times = set(window.store.time[window.breakStatuses & (window.store.unit == i)])
+      sg_times = set(toEpochMicros(b.time) for b in sg.breakStatuses)
+      self.assertEqual(store_times, sg_times)
+
+  def test_all_time(self):
+    self.check_window(None, datetime(2014, 9, 1, tzinfo = nytz))
+
+  def test_windows(self):
+    end_time = datetime(2014, 5, 20, 13, 30, tzinfo = nytz)
+    for days in [1, 3, 7, 14, 30]:
+      self.check_window(end_time - timedelta(days = days), end_time)
+
+  def test_window_before_statuses(self):
+    end_time = datetime(2014, 2, 1, tzinfo = nytz)
+    window = self.store.window(end_time - timedelta(days = 3), end_time)
+    self.assertTrue(all(window.empty))
+    self.assertEqual(list(window.availability), [0.0]*len(self.unit_ids))
+
+  def test_unsorted(self):
+    store = self.store
+    self.assertRaises(RuntimeError, StatusStore, store.unit_ids, store.unit[::-1], store.time[::-1],
+      store.end_time[::-1], store.has_end_time[::-1], store.category[::-1])
+
+
+if __name__ == '__main__':
+  unittest.main()
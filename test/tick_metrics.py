@@ -0,0 +1,115 @@
+import unittest
+import setup
+import os
+import json
+import shutil
+import tempfile
+
+import gevent
+
+from dcmetrometrics.common import tickMetrics
+from dcmetrometrics.common.tickMetrics import TickProfiler, percentile, monotonic
+
+class TestTickProfiler(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'metrics.json')
+    self.clock = [0.0]
+    self._monotonic = tickMetrics.monotonic
+    tickMetrics.monotonic = lambda: self.clock[0]
+
+  def tearDown(self):
+    tickMetrics.monotonic = self._monotonic
+    shutil.rmtree(self.tmpdir)
+
+  def advance(self, seconds):
+    self.clock[0] += seconds
+
+  def run_tick(self, profiler, fetch, process):
+    with profiler.tick():
+      with profiler.span('fetch'):
+        self.advance(fetch)
+      # A phase which runs twice in a tick is added up.
+      for i in range(2):
+        with profiler.span('process'):
+          self.advance(process/2.0)
+
+  def test_percentiles(self):
+    self.assertEqual(percentile(range(1, 101), 50), 51)
+    self.assertEqual(percentile(range(1, 101), 95), 95)
+    self.assertEqual(percentile([3], 95), 3)
+    self.assertTrue(percentile([], 50) is None)
+
+  def test_ticks(self):
+    profiler = TickProfiler('Test', history = 10, metrics_path = self.path, write_interval = 5)
+    for i in range(20):
+      self.run_tick(profiler, i, 2*i)
+    self.assertEqual(profiler.num_ticks, 20)
+    self.assertEqual(profiler.phases.keys(), ['fetch', 'process', 'total'])
+    fetch = profiler.summarize('fetch')
+    self.assertEqual(fetch['n'], 10)
+    self.assertEqual(fetch['p50'], 15)
+    self.assertEqual(fetch['p95'], 19)
+    self.assertEqual(profiler.summarize('process')['last'], 38)
+    self.assertEqual(profiler.summarize('total')['last'], 57)
+    self.assertEqual(profiler.summarize('fetch')['mongo_ops_last'], 0)
+
+    with open(self.path) as f:
+      metrics = json.load(f)
+    self.assertEqual(metrics['num_ticks'], 20)
+    self.assertEqual(metrics['phases']['process']['p95'], 38)
+    self.assertFalse(os.path.exists(self.path + '.tmp'))
+    self.assertTrue('fetch' in profiler.report())
+
+  def test_failed_tick(self):
+    profiler = TickProfiler('Test', write_interval = 0)
+    def fail():
+      with profiler.tick():
+        with profiler.span('fetch'):
+          self.advance(1.0)
+          raise ValueError()
+    self.assertRaises(ValueError, fail)
+    self.assertEqual(profiler.summarize('fetch')['last'], 1.0)
+    self.assertEqual(profiler.summarize('total')['n'], 1)
+
+  def test_counters(self):
+    profiler = TickProfiler('Test', write_interval = 0)
+    profiler.count('ticks_skipped')
+    profiler.count('ticks_skipped')
+    profiler.count('ticks_processed')
+    self.assertEqual(profiler.summary()['counters'], {'ticks_skipped' : 2, 'ticks_processed' : 1})
+    self.assertTrue('ticks_skipped: 2' in profiler.report())
+
+  def test_greenlets(self):
+    profiler = TickProfiler('Test', write_interval = 0)
+    send = tickMetrics._counted(lambda: None)
+    def worker():
+      # The operations and spans of a worker are not part of the tick.
+      with profiler.span('publish'):
+        send()
+        send()
+    with profiler.tick():
+      with profiler.span('fetch'):
+        send()
+        gevent.spawn(worker).join()
+    self.assertEqual(profiler.summarize('fetch')['mongo_ops_last'], 1)
+    self.assertEqual(profiler.summarize('total')['mongo_ops_last'], 1)
+    self.assertEqual(profiler.summarize('publish')['mongo_ops_last'], 2)
+
+  def test_monotonic(self):
+    t1 = monotonic()
+    t2 = monotonic()
+    self.assertTrue(t2 >= t1)
+
+  def test_mongo_op_counter(self):
+    from pymongo.mongo_client import MongoClient
+    tickMetrics.install_mongo_op_counter()
+    method = MongoClient._send_message
+    tickMetrics.install_mongo_op_counter()
+    self.assertTrue(MongoClient._send_message.im_func is method.im_func)
+    self.assertTrue(MongoClient._send_message_with_response._counted)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import setup
+
+import gevent
+from twitter import TwitterError
+from dcmetrometrics.hotcars.twitterFanout import TwitterFanout
+from dcmetrometrics.common.tickMetrics import monotonic
+
+class StubTwitterApi(object):
+  """
+  Stub of the python-twitter Api. GetSearch sleeps for delays[term] seconds,
+  fails for the terms in failures, and records the concurrent calls.
+  """
+  def __init__(self, delays = None, failures = ()):
+    self.delays = dict(delays or {})
+    self.failures = set(failures)
+    self.calls = []
+    self.active = 0
+    self.max_active = 0
+
+  def GetSearch(self, term, since_id = None, **kwargs):
+    self.calls.append((term, since_id))
+    self.active += 1
+    self.max_active = max(self.max_active, self.active)
+    try:
+      gevent.sleep(self.delays.get(term, 0.01))
+      if term in self.failures:
+        raise TwitterError('Over capacity')
+      return [term]
+    finally:
+      self.active -= 1
+
+def search_requests(api, terms, since_id = 0):
+  return [(t, lambda t = t: api.GetSearch(t, since_id = since_id)) for t in terms]
+
+
+class TestTwitterFanout(unittest.TestCase):
+
+  def test_concurrent(self):
+    api = StubTwitterApi(delays = {'a' : 0.1, 'b' : 0.1, 'c' : 0.1})
+    fanout = TwitterFanout(pool_size = 3, timeout = 1.0)
+    start = monotonic()
+    results = fanout.run(search_requests(api, ['a', 'b', 'c'], since_id = 5))
+    self.assertLess(monotonic() - start, 0.25)
+    self.assertEqual(api.max_active, 3)
+    self.assertEqual(results, {'a' : ['a'], 'b' : ['b'], 'c' : ['c']})
+    self.assertEqual(sorted(api.calls), [('a', 5), ('b', 5), ('c', 5)])
+
+  def test_bounded_pool(self):
+    api = StubTwitterApi()
+    fanout = TwitterFanout(pool_size = 2, timeout = 1.0)
+    results = fanout.run(search_requests(api, ['a', 'b', 'c', 'd', 'e']))
+    self.assertEqual(len(results), 5)
+    self.assertEqual(api.max_active, 2)
+
+  def test_timeout(self):
+    # A slow request is abandoned without delaying the others.
+    api = StubTwitterApi(delays = {'slow' : 5.0})
+    fanout = TwitterFanout(pool_size = 4, timeout = 0.1)
+    start = monotonic()
+    results = fanout.run(search_requests(api, ['slow', 'a', 'b']))
+    self.assertLess(monotonic() - start, 1.0)
+    self.assertEqual(results, {'a' : ['a'], 'b' : ['b']})
+    self.assertTrue('slow' in fanout.elapsed)
+
+  def test_failure(self):
+    api = StubTwitterApi(failures = ['b'])
+    fanout = TwitterFanout(timeout = 1.0)
+    results = fanout.run(search_requests(api, ['a', 'b']))
+    self.assertEqual(results, {'a' : ['a']})
+
+  def test_outer_timeout(self):
+    # A timeout of the caller is not swallowed by the fanout.
+    api = StubTwitterApi(delays = {'a' : 5.0})
+    fanout = TwitterFanout(timeout = 10.0)
+    with gevent.Timeout(0.1, False):
+      fanout.run(search_requests(api, ['a']))
+      self.fail('The outer timeout was swallowed')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import setup
+
+from dcmetrometrics.eles import models
+from dcmetrometrics.eles.UnitStateCache import UnitStateCache, UnitState
+from dcmetrometrics.common.metroTimes import tzutc
+from bson.objectid import ObjectId
+from datetime import timedelta, datetime
+
+class FakeIncident(object):
+  def __init__(self, unit_id, symptom_description):
+    self.UnitId = unit_id
+    self.SymptomDescription = symptom_description
+
+def make_status(time, description, category):
+  return models.UnitStatus(id = ObjectId(), unit_id = 'A01N01ESCALATOR', time = time,
+    symptom_description = description, symptom_category = category)
+
+
+class TestUnitStateCache(unittest.TestCase):
+
+  def setUp(self):
+    self.t0 = datetime(2015, 5, 1, 12, tzinfo = tzutc)
+    op = make_status(self.t0, 'OPERATIONAL', 'ON')
+    self.unit = models.Unit(id = ObjectId(), unit_id = 'A01N01ESCALATOR')
+    self.unit.key_statuses = models.KeyStatuses(unit_id = 'A01N01ESCALATOR',
+      lastStatus = op, lastOperationalStatus = op)
+    self.cache = UnitStateCache()
+    self.cache.version = 3
+    self.cache.symptoms['OPERATIONAL'] = models.SymptomCode(description = 'OPERATIONAL', category = 'ON')
+    self.cache.update(self.unit)
+
+  def test_from_unit(self):
+    state = self.cache.get('A01N01ESCALATOR')
+    op = self.unit.key_statuses.lastStatus
+    self.assertEqual(state.pk, self.unit.pk)
+    self.assertEqual(state.symptom_description, 'OPERATIONAL')
+    self.assertEqual(state.key_status_ids['lastStatus'], op.pk)
+    self.assertEqual(state.key_status_ids['lastOperationalStatus'], op.pk)
+    self.assertTrue(state.key_status_ids['currentBreakStatus'] is None)
+
+  def test_write_through(self):
+    broken = make_status(self.t0 + timedelta(hours = 1), 'CALLBACK/REPAIR', 'BROKEN')
+    self.unit.apply_update(broken)
+    self.cache.update(self.unit)
+    self.assertEqual(self.cache.last_symptom_descriptions(), {'A01N01ESCALATOR' : 'CALLBACK/REPAIR'})
+    state = self.cache.get('A01N01ESCALATOR')
+    self.assertEqual(state.symptom_category, 'BROKEN')
+    self.assertEqual(state.key_status_ids['currentBreakStatus'], broken.pk)
+
+  def test_known_incident(self):
+    # Known units and symptoms do not touch the database.
+    self.cache.add_from_incident(FakeIncident('A01N01ESCALATOR', 'OPERATIONAL'), self.t0)
+    self.assertEqual(len(self.cache), 1)
+
+  def test_version(self):
+    self.assertFalse(self.cache.refresh(3))
+    self.cache.invalidate()
+    self.assertFalse(self.cache.is_loaded)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import setup
+
+from dcmetrometrics.eles import models
+from dcmetrometrics.common.metroTimes import tzutc
+from bson.objectid import ObjectId
+from datetime import timedelta, datetime
+
+def make_status(time, description, category):
+  return models.UnitStatus(id = ObjectId(), unit_id = 'A01N01ESCALATOR', time = time,
+    symptom_description = description, symptom_category = category)
+
+
+class TestApplyUpdate(unittest.TestCase):
+
+  def setUp(self):
+    self.t0 = datetime(2015, 5, 1, 12, tzinfo = tzutc)
+    op = make_status(self.t0, 'OPERATIONAL', 'ON')
+    self.unit = models.Unit(unit_id = 'A01N01ESCALATOR')
+    self.unit.key_statuses = models.KeyStatuses(unit_id = 'A01N01ESCALATOR',
+      lastStatus = op, lastOperationalStatus = op)
+
+  def new_status(self, hours, description, category):
+    # New statuses have not been saved yet.
+    return models.UnitStatus(unit_id = 'A01N01ESCALATOR', time = self.t0 + timedelta(hours = hours),
+      symptom_description = description, symptom_category = category)
+
+  def test_break_and_fix(self):
+    unit = self.unit
+    op = unit.key_statuses.lastStatus
+
+    broken = self.new_status(1, 'CALLBACK/REPAIR', 'BROKEN')
+    self.assertTrue(unit.apply_update(broken) is op)
+    self.assertEqual(op.end_time, broken.time)
+    self.assertEqual(broken.update_type, 'Break')
+    self.assertTrue(unit.key_statuses.currentBreakStatus is broken)
+    self.assertTrue(unit.key_statuses.lastStatus is broken)
+
+    repair = self.new_status(2, 'MINOR REPAIR', 'BROKEN')
+    self.assertTrue(unit.apply_update(repair) is broken)
+    self.assertEqual(repair.update_type, 'Update')
+    self.assertTrue(unit.key_statuses.currentBreakStatus is broken)
+
+    fixed = self.new_status(3, 'OPERATIONAL', 'ON')
+    self.assertTrue(unit.apply_update(fixed) is repair)
+    self.assertEqual(fixed.update_type, 'Fix')
+    self.assertEqual(repair.end_time, fixed.time)
+    ks = unit.key_statuses
+    self.assertTrue(ks.currentBreakStatus is None)
+    self.assertTrue(ks.lastBreakStatus is broken)
+    self.assertTrue(ks.lastFixStatus is fixed)
+    self.assertTrue(ks.lastOperationalStatus is fixed)
+
+  def test_no_change(self):
+    op = self.new_status(1, 'OPERATIONAL', 'ON')
+    op.id = self.unit.key_statuses.lastStatus.pk
+    self.assertTrue(self.unit.apply_update(op) is None)
+    self.assertTrue(self.unit.key_statuses.lastStatus.end_time is None)
+
+  def test_wrong_unit(self):
+    status = self.new_status(1, 'CALLBACK/REPAIR', 'BROKEN')
+    status.unit_id = 'A02N01ESCALATOR'
+    self.assertRaises(RuntimeError, self.unit.apply_update, status)
+
+
+if __name__ == '__main__':
+  unittest.main()
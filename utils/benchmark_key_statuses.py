@@ -0,0 +1,83 @@
+"""
+Benchmark KeyStatuses.select_key_statuses against the original
+implementation (select_key_statuses_OLD) on synthetic status histories.
+
+No database connection is needed, but the dcmetrometrics environment
+variables must be set. Example:
+
+  python utils/benchmark_key_statuses.py --num-statuses 10000 --num-units 3
+"""
+import sys
+import random
+import time
+from datetime import datetime, timedelta
+
+from dcmetrometrics.eles.models import KeyStatuses
+from dcmetrometrics.eles.StatusRecord import StatusRecord
+from dcmetrometrics.common.metroTimes import tzutc
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark KeyStatuses.select_key_statuses.')
+parser.add_argument('--num-statuses', type = int, default = 10000,
+                   help='Number of statuses per unit.')
+parser.add_argument('--num-units', type = int, default = 3,
+                   help='Number of units.')
+parser.add_argument('--skip-old', action = 'store_true',
+                   help='Only time the new implementation.')
+parser.add_argument('--seed', type = int, default = 0)
+
+CATEGORY_CHOICES = ['ON', 'ON', 'ON', 'BROKEN', 'BROKEN', 'INSPECTION', 'OFF', 'REHAB']
+
+KEYS = ['lastFixStatus', 'lastBreakStatus', 'lastInspectionStatus',
+        'lastOperationalStatus', 'lastStatus', 'currentBreakStatus']
+
+def make_statuses(unit_id, num, rand):
+  """
+  Generate a random status history for a unit.
+  """
+  t = datetime(2013, 6, 1, tzinfo = tzutc)
+  statuses = []
+  for i in range(num):
+    t = t + timedelta(seconds = rand.randint(60, 2*24*3600))
+    c = rand.choice(CATEGORY_CHOICES)
+    statuses.append(StatusRecord(unit_id = unit_id, time = t,
+      symptom_description = '%s %i'%(c, i), symptom_category = c))
+  rand.shuffle(statuses)
+  return statuses
+
+def key_times(ks):
+  ret = []
+  for k in KEYS:
+    s = getattr(ks, k)
+    ret.append(s.time if s is not None else None)
+  return ret
+
+def timed(f, statuses):
+  start = time.time()
+  ret = f(statuses)
+  return ret, time.time() - start
+
+def run(num_statuses, num_units, skip_old = False, seed = 0):
+  rand = random.Random(seed)
+  total_new = 0.0
+  total_old = 0.0
+  for i in range(num_units):
+    unit_id = 'U%03iESCALATOR'%i
+    statuses = make_statuses(unit_id, num_statuses, rand)
+    ks, elapsed = timed(KeyStatuses.select_key_statuses, statuses)
+    total_new += elapsed
+    msg = '%s: %i statuses. new: %.3f sec'%(unit_id, num_statuses, elapsed)
+    if not skip_old:
+      ks_old, elapsed_old = timed(KeyStatuses.select_key_statuses_OLD, statuses)
+      total_old += elapsed_old
+      if key_times(ks) != key_times(ks_old):
+        raise RuntimeError('Key statuses do not match for unit %s'%unit_id)
+      msg += ' old: %.3f sec'%elapsed_old
+    print msg
+  print 'Total new: %.3f sec'%total_new
+  if not skip_old:
+    print 'Total old: %.3f sec (%.1fx)'%(total_old, total_old/max(total_new, 1E-9))
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  run(args.num_statuses, args.num_units, skip_old = args.skip_old, seed = args.seed)
@@ -0,0 +1,68 @@
+"""
+Benchmark Station.get_station_directory against the original
+implementation (get_station_directory_OLD).
+
+Reports the number of MongoDB operations and the wall time of each,
+and checks that both produce the same directory.
+
+This requires a database connection and the dcmetrometrics environment
+variables. Example:
+
+  python utils/benchmark_station_directory.py --repeat 3
+"""
+import time
+
+from dcmetrometrics.common import dbGlobals
+dbGlobals.connect()
+
+from dcmetrometrics.eles.models import Station
+from dcmetrometrics.common.tickMetrics import install_mongo_op_counter, mongo_op_count
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark Station.get_station_directory.')
+parser.add_argument('--repeat', type = int, default = 3,
+                   help='Number of times to build the directory with each implementation.')
+parser.add_argument('--skip-old', action = 'store_true',
+                   help='Only time the new implementation.')
+
+def directory_key(sd):
+  """
+  Summarize a station directory for comparison.
+  """
+  ret = {}
+  for name, d in sd.iteritems():
+    ret[name] = ([s.code for s in d['stations']],
+                 [u.unit_id for u in d['escalators']],
+                 [u.unit_id for u in d['elevators']],
+                 [s.time for s in d['recent_statuses']],
+                 [u.key_statuses.lastStatus.pk for u in d['escalators'] + d['elevators'] if u.key_statuses])
+  return ret
+
+def timed(f):
+  ops = mongo_op_count()
+  start = time.time()
+  sd = f()
+  # Touch the key statuses, as the json encoder does.
+  for d in sd.itervalues():
+    for u in d['escalators'] + d['elevators']:
+      if u.key_statuses:
+        u.key_statuses.to_web_json()
+  return sd, time.time() - start, mongo_op_count() - ops
+
+def run(repeat = 3, skip_old = False):
+  install_mongo_op_counter()
+  impls = [('new', Station.get_station_directory)]
+  if not skip_old:
+    impls.append(('old', Station.get_station_directory_OLD))
+  keys = {}
+  for name, f in impls:
+    for i in range(repeat):
+      sd, elapsed, ops = timed(f)
+      print '%s: %.3f sec, %i mongo operations'%(name, elapsed, ops)
+    keys[name] = directory_key(sd)
+  if not skip_old:
+    print 'Directories match: %s'%(keys['new'] == keys['old'])
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  run(repeat = args.repeat, skip_old = args.skip_old)
@@ -0,0 +1,62 @@
+"""
+Benchmark the single pass tweet parser (process_tweets.parseText) against
+preprocessText followed by getCarNums and getColors, and check that both
+give the same results.
+
+The corpus is either a mongoexport of the hotcars_tweets collection (one
+json document per line, see utils/exportDB.py), or the hotcar_reports.json
+written by the JSONWriter. Example:
+
+  python utils/benchmark_tweet_parser.py --corpus DCMetroMetricsData/hotcars_tweets.json
+"""
+import os
+import json
+import time
+
+from dcmetrometrics.hotcars.process_tweets import (parseText, getHotCarDataFromText_OLD,
+  preprocessText, EXCLUDED_WORDS)
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'client', 'app', 'json', 'hotcar_reports.json')
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark the tweet parser.')
+parser.add_argument('--corpus', default = DEFAULT_CORPUS,
+                   help='hotcars_tweets mongoexport or hotcar_reports.json file.')
+parser.add_argument('--repeat', type = int, default = 5,
+                   help='Number of passes over the corpus with each parser.')
+
+def load_texts(path):
+  with open(path) as f:
+    data = f.read()
+  if data.lstrip().startswith('['):
+    # hotcar_reports.json
+    return [r['tweet']['text'] for r in json.loads(data) if r.get('tweet')]
+  # mongoexport: one document per line
+  return [json.loads(line)['text'] for line in data.splitlines() if line.strip()]
+
+def parse_old(text):
+  hcd = getHotCarDataFromText_OLD(text)
+  excluded = any(w in EXCLUDED_WORDS for w in preprocessText(text).split())
+  return (hcd['cars'], hcd['colors'], excluded)
+
+def parse_new(text):
+  parsed = parseText(text)
+  return (parsed.cars, parsed.colors, parsed.has_excluded_word)
+
+def run(corpus = DEFAULT_CORPUS, repeat = 5):
+  texts = load_texts(corpus)
+  results = {}
+  for name, f in [('old', parse_old), ('new', parse_new)]:
+    best = None
+    for i in range(repeat):
+      start = time.time()
+      results[name] = [f(t) for t in texts]
+      elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+    print '%s: %.1f tweets/sec (%i tweets)'%(name, len(texts)/best, len(texts))
+  print 'Results identical: %s'%(results['old'] == results['new'])
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  run(corpus = args.corpus, repeat = args.repeat)
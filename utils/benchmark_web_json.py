@@ -0,0 +1,63 @@
+"""
+Benchmark the raw document json path (rawWebJSON.WebJSONProjection)
+against hydrating mongoengine documents and encoding them with to_web_json.
+
+Runs on synthetic escalator_statuses documents, so it does not need a
+database. Checks that both paths produce the same json. Example:
+
+  python utils/benchmark_web_json.py --n 100000
+"""
+import time
+import random
+from json import dumps
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from dcmetrometrics.common.JSONifier import WebJSONEncoder, iter_json_array
+from dcmetrometrics.common.rawWebJSON import WebJSONProjection
+from dcmetrometrics.eles.models import UnitStatus
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark the raw document json path.')
+parser.add_argument('--n', type = int, default = 50000,
+                   help='Number of status documents.')
+parser.add_argument('--repeat', type = int, default = 3,
+                   help='Number of times to encode the documents with each path.')
+
+def make_sons(n):
+  start = datetime(2013, 1, 1)
+  categories = [('ON', 'Operational', 'On'), ('BROKEN', 'Minor Repair', 'Break'), ('OFF', 'Preventive Maintenance Inspection', 'Off')]
+  sons = []
+  for i in range(n):
+    category, description, update_type = random.choice(categories)
+    time = start + timedelta(seconds = 600*i)
+    sons.append({'_id' : ObjectId(), 'escalator_id' : ObjectId(), 'unit_id' : 'A%02iX%02i'%(i%20, i%7),
+                 'time' : time, 'end_time' : time + timedelta(seconds = 600), 'metro_open_time' : 600.0,
+                 'tickDelta' : 60.0, 'update_type' : update_type,
+                 'symptom_description' : description, 'symptom_category' : category})
+  return sons
+
+def encode_documents(sons):
+  return ''.join(iter_json_array(UnitStatus._from_son(son) for son in sons))
+
+def encode_raw(sons):
+  projection = WebJSONProjection(UnitStatus)
+  return ''.join(iter_json_array(projection.convert(son) for son in sons))
+
+def run(n = 50000, repeat = 3):
+  sons = make_sons(n)
+  outputs = {}
+  for name, f in [('documents', encode_documents), ('raw', encode_raw)]:
+    best = None
+    for i in range(repeat):
+      start = time.time()
+      outputs[name] = f(sons)
+      elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+    print '%s: %.3f sec for %i statuses'%(name, best, n)
+  print 'Output identical: %s'%(outputs['documents'] == outputs['raw'])
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  run(n = args.n, repeat = args.repeat)
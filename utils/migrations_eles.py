@@ -314,7 +314,7 @@ def delete_recent_statuses(time_delta = timedelta(hours = 2)):
   Recompute keystatuses for affected units"""
   from dcmetrometrics.common import metroTimes
 
-  from dcmetrometrics.eles.models import UnitStatus
+  from dcmetrometrics.eles.models import UnitStatus, EscalatorAppState
   t0 = metroTimes.utcnow() - time_delta
   statuses = UnitStatus.objects(time__gt = t0)
   units = set(s.unit for s in statuses)
@@ -326,11 +326,14 @@ def delete_recent_statuses(time_delta = timedelta(hours = 2)):
     print "computing key statuses for unit: %s"%u.unit_id
     u.compute_key_statuses(save=True)
 
+  # Have a running app reload its unit state cache.
+  EscalatorAppState.bump_unit_state_version()
+
 def delete_last_n_statuses(n):
   """Delete the last n statuses"""
   from dcmetrometrics.common import metroTimes
 
-  from dcmetrometrics.eles.models import UnitStatus
+  from dcmetrometrics.eles.models import UnitStatus, EscalatorAppState
 
   statuses = UnitStatus.objects().order_by('-time').limit(n)
   units = set(s.unit for s in statuses)
@@ -342,16 +345,22 @@ def delete_last_n_statuses(n):
     print "computing key statuses for unit: %s"%u.unit_id
     u.compute_key_statuses(save=True)
 
+  # Have a running app reload its unit state cache.
+  EscalatorAppState.bump_unit_state_version()
+
 
 def recompute_key_statuses():
   """Recompute key statuses for all units"""
-  from dcmetrometrics.eles.models import Unit, KeyStatuses
+  from dcmetrometrics.eles.models import Unit, KeyStatuses, EscalatorAppState
   units = Unit.objects.no_cache()
   start = datetime.now()
   n = units.count()
   for i, unit in enumerate(units):
     print "Computing key statuses for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n)
     unit.compute_key_statuses(save=True)
+
+  # Have a running app reload its unit state cache.
+  EscalatorAppState.bump_unit_state_version()
     
   elapsed = (datetime.now() - start).total_seconds()
   print "%.2f seconds elapsed"%elapsed
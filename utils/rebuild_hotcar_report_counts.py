@@ -0,0 +1,30 @@
+"""
+Check or rebuild the hot car report counts by car and year (HotCarReportCount),
+which are maintained by the HotCarApp as reports are saved.
+
+  python utils/rebuild_hotcar_report_counts.py --check
+  python utils/rebuild_hotcar_report_counts.py
+"""
+from dcmetrometrics.common import dbGlobals
+dbGlobals.connect()
+
+from dcmetrometrics.hotcars.models import HotCarReportCount
+
+import argparse
+parser = argparse.ArgumentParser(description='Check or rebuild the hot car report counts.')
+parser.add_argument('--check', action = 'store_true',
+                   help='Only report the counts which differ from the reports.')
+
+def run(check = False):
+  if check:
+    mismatches = HotCarReportCount.check()
+    for car_number, year, stored, computed in mismatches:
+      print 'Car %i, %i: stored %i, computed %i'%(car_number, year, stored, computed)
+    print '%i counts differ from the reports.'%len(mismatches)
+  else:
+    n = HotCarReportCount.rebuild()
+    print 'Updated %i counts.'%n
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  run(check = args.check)
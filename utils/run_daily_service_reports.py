@@ -16,7 +16,9 @@ from operator import attrgetter
 from dcmetrometrics.common.dbGlobals import G
 from dcmetrometrics.eles import dbUtils
 from dcmetrometrics.common.metroTimes import getLastOpenTime
-from dcmetrometrics.eles.models import Unit, SymptomCode, UnitStatus, SystemServiceReport
+from dcmetrometrics.eles.models import Unit, SymptomCode, UnitStatus, SystemServiceReport, DailyServiceReport
+from dcmetrometrics.eles.StatusRecord import StatusRecord
+from dcmetrometrics.common.parallel import run_sharded, Checkpoint
 from dcmetrometrics.common.globals import WWW_DIR
 from dcmetrometrics.common.utils import gen_days
 from dcmetrometrics.common.JSONifier import JSONWriter
@@ -25,6 +27,10 @@ import argparse
 parser = argparse.ArgumentParser(description='Run daily service reports.')
 parser.add_argument('--all', action = 'store_true',
                    help='Compute all, instead of a one day update.')
+parser.add_argument('--workers', type = int, default = 1,
+                   help='Number of worker processes.')
+parser.add_argument('--checkpoint', default = None,
+                   help='Checkpoint file used to resume a crashed run. Rerun with the same arguments to resume.')
 
 
 ##########################################
@@ -143,37 +149,53 @@ def fix_all_end_times_and_merge_consecutive():
       status.save()
       status_after = status
 
-def compute_daily_service_reports(start_day = None, end_day = None, force_min_start_day = None):
-  """
-  Compute daily service reports for all units, and write json.
-   - start_day: The starting day for which to compute. This can be overridden by long running outages. 
-      Computation will be unit dependent, depending on when its current outage goes back to.
-   - end_day: The last day to compute, exclusive. By default this is today.
-   - force_min_start_day: Force a minimum starting day for all computation. This overrides start_day or
-     whatever the current outage suggest to do.
+# Number of daily service reports to accumulate before inserting into the database.
+REPORT_BATCH_SIZE = 5000
+
+def compute_unit_daily_service_reports(unit_ids, start_day, end_day, force_min_start_day = None,
+  checkpoint_path = None, batch_size = REPORT_BATCH_SIZE):
   """
+  Compute and save the daily service reports for a list of units. This runs
+  in a worker process when computing in parallel.
 
-  if not start_day:
-    start_day = date(2013, 6, 1)
+  Reports are inserted in batches. If checkpoint_path is provided, units are
+  recorded in the checkpoint once their reports have been inserted.
 
-  if not end_day:
-    end_day = date.today() # exclusive
-
-  assert(end_day > start_day)
-
-  num_units = Unit.objects.no_cache().count()
-  sys.stderr.write("Have %i units\n"%num_units)
+  Return a dictionary from unit_id to the first day computed for the unit.
+  """
+  checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
 
   GARBAGE_COLLECT_INTERVAL = 20
 
-  min_start_day = force_min_start_day if force_min_start_day else start_day
-
-  # This long loop was raising Exceptions like:
-  # pymongo.errors.OperationFailure: cursor id 'XXXX' not valid at server
-  # Solution is to not timeout the cursor and explicitly close it ourselves
-  units = Unit.objects.timeout(False).no_cache()
-
-  for i, unit in enumerate(units):
+  unit_id_to_unit = dict((unit.unit_id, unit) for unit in Unit.objects(unit_id__in = unit_ids).no_cache())
+  num_units = len(unit_id_to_unit)
+
+  unit_start_days = {}
+  pending_docs = []
+  pending_unit_ids = []
+
+  def flush():
+    if pending_docs:
+      DEBUG("Inserting %i daily service reports"%len(pending_docs))
+      DailyServiceReport.objects.insert(pending_docs, load_bulk = False)
+    if checkpoint:
+      for unit_id in pending_unit_ids:
+        checkpoint.mark(unit_id, start_day = unit_start_days[unit_id].strftime("%Y-%m-%d"))
+    del pending_docs[:]
+    del pending_unit_ids[:]
+
+  # Load the statuses for the units with a single query. The loader does
+  # not timeout its cursor, and closes it when done. The daily service reports
+  # only need lightweight StatusRecords.
+  statuses_iter = dbUtils.iter_unit_statuses(unit_ids = unit_ids,
+                                             factory = StatusRecord.from_son,
+                                             fields = StatusRecord.db_fields)
+  for i, (unit_id, unit_statuses) in enumerate(statuses_iter):
+
+    unit = unit_id_to_unit.get(unit_id, None)
+    if unit is None:
+      WARNING('Have statuses for unknown unit %s'%unit_id)
+      continue
 
     INFO('Computing daily service report unit %s\n (%i of %i)'%(unit.unit_id, i, num_units))
 
@@ -182,8 +204,6 @@ def compute_daily_service_reports(start_day = None, end_day = None, force_min_st
       count = gc.collect()
       DEBUG("Garbage collect returned %i"%count)
 
-    unit_statuses = sorted(unit.get_statuses(), key = attrgetter('time'), reverse = True)
-
     if not unit_statuses:
       continue
 
@@ -202,17 +222,69 @@ def compute_daily_service_reports(start_day = None, end_day = None, force_min_st
     if force_min_start_day:
       unit_start_day = force_min_start_day
 
-    unit.compute_daily_service_reports(start_day = unit_start_day, last_day = end_day,
-      statuses = unit_statuses, save = True)
+    # Erase any existing daily service reports on these days
+    unit.delete_daily_service_reports(unit_start_day, end_day)
+    docs = unit.compute_daily_service_reports(start_day = unit_start_day, last_day = end_day,
+      statuses = unit_statuses, save = False)
 
-    min_start_day = min(min_start_day, unit_start_day)
+    unit_start_days[unit_id] = unit_start_day
+    pending_docs.extend(docs)
+    pending_unit_ids.append(unit_id)
+    if len(pending_docs) >= batch_size:
+      flush()
 
-  if force_min_start_day:
-    min_start_day = force_min_start_day
+  flush()
 
-  # We are done with the units query set, so close the cursor.
-  units._cursor.close()
+  return unit_start_days
 
+def compute_daily_service_reports(start_day = None, end_day = None, force_min_start_day = None,
+  workers = 1, checkpoint_path = None):
+  """
+  Compute daily service reports for all units, and write json.
+   - start_day: The starting day for which to compute. This can be overridden by long running outages. 
+      Computation will be unit dependent, depending on when its current outage goes back to.
+   - end_day: The last day to compute, exclusive. By default this is today.
+   - force_min_start_day: Force a minimum starting day for all computation. This overrides start_day or
+     whatever the current outage suggest to do.
+   - workers: Number of worker processes. Each worker computes the reports for a shard of units.
+   - checkpoint_path: File recording the units which have been completed. If the file exists,
+     those units are skipped, so that a crashed run can be resumed with the same arguments.
+     The file is removed when the run completes.
+  """
+
+  if not start_day:
+    start_day = date(2013, 6, 1)
+
+  if not end_day:
+    end_day = date.today() # exclusive
+
+  assert(end_day > start_day)
+
+  unit_ids = sorted(Unit.objects.no_cache().scalar('unit_id'))
+  sys.stderr.write("Have %i units\n"%len(unit_ids))
+
+  unit_start_days = {}
+
+  checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+  if checkpoint:
+    completed = checkpoint.completed()
+    if completed:
+      INFO('Resuming from checkpoint %s: skipping %i completed units'%(checkpoint_path, len(completed)))
+    for unit_id, rec in completed.iteritems():
+      unit_start_days[unit_id] = datetime.strptime(rec['start_day'], "%Y-%m-%d").date()
+    unit_ids = [unit_id for unit_id in unit_ids if unit_id not in completed]
+
+  results = run_sharded(compute_unit_daily_service_reports, unit_ids, workers = workers,
+    args = (start_day, end_day, force_min_start_day, checkpoint_path))
+
+  # Merge the results from all workers before computing the system service reports.
+  for r in results:
+    unit_start_days.update(r)
+
+  min_start_day = min([start_day] + unit_start_days.values())
+
+  if force_min_start_day:
+    min_start_day = force_min_start_day
 
   jwriter = JSONWriter(WWW_DIR)
   for day in gen_days(min_start_day, end_day):
@@ -220,6 +292,9 @@ def compute_daily_service_reports(start_day = None, end_day = None, force_min_st
     report = SystemServiceReport.compute_for_day(day, save = True)
     jwriter.write_daily_system_service_report(report = report)
 
+  if checkpoint:
+    checkpoint.remove()
+
 
 
 def write_json():
@@ -231,11 +306,8 @@ def write_json():
   jwriter = JSONWriter(WWW_DIR)
   # jwriter = JSONWriter(basedir = os.path.join('client', 'app'))
 
-  from dcmetrometrics.eles.models import Unit
-  num_units = Unit.objects.no_cache().count()
-  for i, unit in enumerate(Unit.objects.no_cache()):
-    logger.info('Writing unit %i of %i: %s'%(i, num_units, unit.unit_id))
-    jwriter.write_unit(unit)
+  logger.info('Writing units')
+  jwriter.write_units()
 
   # Write the station directory
   jwriter.write_station_directory()
@@ -251,32 +323,36 @@ def write_json():
   elapsed = (datetime.now() - start).total_seconds()
   print "%.2f seconds elapsed"%elapsed
 
-def run_all():
+def run_all(workers = 1, checkpoint_path = None):
   start_day = date(2013, 6, 1)
   end_day = date.today() - timedelta(days = 1)
 
   compute_daily_service_reports(
     start_day = start_day,
     end_day = end_day,
-    force_min_start_day = start_day)
+    force_min_start_day = start_day,
+    workers = workers,
+    checkpoint_path = checkpoint_path)
 
-def run_update():
+def run_update(workers = 1, checkpoint_path = None):
   start_day = date.today() - timedelta(days = 1)
   end_day = date.today()
 
   compute_daily_service_reports(
     start_day = start_day,
-    end_day = end_day)
+    end_day = end_day,
+    workers = workers,
+    checkpoint_path = checkpoint_path)
 
 if __name__ == '__main__':
   args = parser.parse_args()
   start_time = datetime.now()
   if args.all:
     logger.info("Running all.")
-    run_all()
+    run_all(workers = args.workers, checkpoint_path = args.checkpoint)
   else:
     logger.info("Running one day update.")
-    run_update()
+    run_update(workers = args.workers, checkpoint_path = args.checkpoint)
   end_time = datetime.now()
   run_time = (end_time - start_time).total_seconds()
-  logger.info("%.2f seconds elapsed"%run_time)
\ No newline at end of file
+  logger.info("%.2f seconds elapsed"%run_time)
@@ -34,6 +34,17 @@ from datetime import timedelta
 from dcmetrometrics.common.globals import WWW_DIR
 from dcmetrometrics.common.utils import gen_days
 from dcmetrometrics.common.JSONifier import JSONWriter
+from dcmetrometrics.common.parallel import run_sharded, Checkpoint
+from dcmetrometrics.common import descriptors
+
+import argparse
+parser = argparse.ArgumentParser(description='Recompute key statuses and performance summaries.')
+parser.add_argument('--workers', type = int, default = 1,
+                   help='Number of worker processes used to recompute performance summaries.')
+parser.add_argument('--checkpoint', default = None,
+                   help='Checkpoint file used to resume a crashed run.')
+parser.add_argument('--profile-properties', action = 'store_true',
+                   help='Report cache hits, misses and compute time of StatusGroup properties.')
 
 
 
@@ -200,31 +211,113 @@ def compute_daily_service_reports(start_day = None, end_day = None, force_min_st
 
 
 
-def recompute_performance_summaries():
-  """Recompute performance summaries for all units"""
+def recompute_unit_performance_summaries(unit_ids, checkpoint_path = None):
+  """
+  Recompute performance summaries and write the unit json for a list of units.
+  This runs in a worker process when computing in parallel.
+
+  If checkpoint_path is provided, units are recorded in the checkpoint as they complete.
+  Return the list of unit_ids which were computed.
+  """
   from dcmetrometrics.eles.models import Unit
-  units = Unit.objects.no_cache()
-  start = datetime.now()
-  n =  units.count()
+  checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+  profiler = descriptors.get_profiler()
+  if profiler:
+    profiler.reset()
+  unit_id_to_unit = dict((unit.unit_id, unit) for unit in Unit.objects(unit_id__in = unit_ids).no_cache())
+  n = len(unit_id_to_unit)
   GARBAGE_COLLECT_INTERVAL = 10
   jwriter = JSONWriter(WWW_DIR)
-  for i, unit in enumerate(units):
+  computed = []
+  for i, (unit_id, statuses) in enumerate(dbUtils.iter_unit_statuses(unit_ids = unit_ids)):
+
+    unit = unit_id_to_unit.get(unit_id, None)
+    if unit is None:
+      WARNING("Have statuses for unknown unit %s"%unit_id)
+      continue
 
     INFO("Computing performance summary for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n))
-    unit.compute_performance_summary(save = True)
+    unit.compute_performance_summary(statuses = statuses, save = True)
 
     if i%GARBAGE_COLLECT_INTERVAL == 0:
       DEBUG("Running garbage collector after iteration over units.")
       count = gc.collect()
       DEBUG("Garbage collect returned %i"%count)
 
-    jwriter.write_unit(unit)
-    
-  # Write the station directory
+    jwriter.write_unit(unit, statuses)
+
+    if checkpoint:
+      checkpoint.mark(unit_id)
+    computed.append(unit_id)
+
+  # Each worker process reports on its own shard.
+  if profiler:
+    INFO("computeOnce profile for %i units:\n%s"%(len(computed), profiler.report()))
+
+  return computed
+
+def recompute_performance_summaries(workers = 1, checkpoint_path = None):
+  """
+  Recompute performance summaries for all units.
+   - workers: Number of worker processes. Each worker computes the summaries for a shard of units.
+   - checkpoint_path: File recording the units which have been completed. If the file exists,
+     those units are skipped, so that a crashed run can be resumed.
+     The file is removed when the run completes.
+  """
+  from dcmetrometrics.eles.models import Unit
+  start = datetime.now()
+  unit_ids = sorted(Unit.objects.no_cache().scalar('unit_id'))
+
+  checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+  if checkpoint:
+    completed = checkpoint.completed()
+    if completed:
+      INFO('Resuming from checkpoint %s: skipping %i completed units'%(checkpoint_path, len(completed)))
+    unit_ids = [unit_id for unit_id in unit_ids if unit_id not in completed]
+
+  results = run_sharded(recompute_unit_performance_summaries, unit_ids, workers = workers,
+    args = (checkpoint_path,))
+  INFO("Computed performance summaries for %i units"%sum(len(r) for r in results))
+
+  # Write the station directory once all units are done.
+  jwriter = JSONWriter(WWW_DIR)
   jwriter.write_station_directory()
 
+  if checkpoint:
+    checkpoint.remove()
+
+  elapsed = (datetime.now() - start).total_seconds()
+  print "%.2f seconds elapsed"%elapsed
+
+def verify_performance_summaries():
+  """
+  Check the incremental performance summaries from the PerformanceTracker
+  against a full recompute for all units. Nothing is saved.
+  """
+  from dcmetrometrics.eles.models import Unit
+  from dcmetrometrics.eles.PerformanceTracker import PerformanceTracker, verify_unit
+  from dcmetrometrics.common.metroTimes import utcnow
+  unit_id_to_unit = dict((unit.unit_id, unit) for unit in Unit.objects.no_cache())
+  start = datetime.now()
+  end_time = utcnow()
+  n = len(unit_id_to_unit)
+  tracker = PerformanceTracker()
+  bad_units = []
+  for i, (unit_id, statuses) in enumerate(dbUtils.iter_unit_statuses()):
+    unit = unit_id_to_unit.get(unit_id, None)
+    if unit is None:
+      continue
+    INFO("Verifying performance summary for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n))
+    if verify_unit(tracker, unit, end_time = end_time, statuses = statuses):
+      bad_units.append(unit.unit_id)
+    tracker.invalidate(unit.unit_id)
+
+  print "have %i units with mismatched performance summaries"%len(bad_units)
+  print bad_units
+
   elapsed = (datetime.now() - start).total_seconds()
   print "%.2f seconds elapsed"%elapsed
+  return bad_units
 
 
 
@@ -237,11 +330,8 @@ def write_json():
   jwriter = JSONWriter(WWW_DIR)
   # jwriter = JSONWriter(basedir = os.path.join('client', 'app'))
 
-  from dcmetrometrics.eles.models import Unit
-  num_units = Unit.objects.no_cache().count()
-  for i, unit in enumerate(Unit.objects.no_cache()):
-    logger.info('Writing unit %i of %i: %s'%(i, num_units, unit.unit_id))
-    jwriter.write_unit(unit)
+  logger.info('Writing units')
+  jwriter.write_units()
 
   # Write the station directory
   jwriter.write_station_directory()
@@ -285,21 +375,41 @@ def fix_end_times():
 
 def recompute_key_statuses():
   """Recompute key statuses for all units"""
-  from dcmetrometrics.eles.models import Unit, KeyStatuses
+  from dcmetrometrics.eles.models import Unit, KeyStatuses, EscalatorAppState
   units = Unit.objects.no_cache()
   start = datetime.now()
   n = units.count()
   for i, unit in enumerate(units):
     print "Computing key statuses for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n)
     unit.compute_key_statuses(save=True)
-    
+
+  # Have a running app reload its unit state cache.
+  EscalatorAppState.bump_unit_state_version()
+
   elapsed = (datetime.now() - start).total_seconds()
   print "%.2f seconds elapsed"%elapsed
 
-def run():
-  recompute_key_statuses()
-  fix_end_times()
-  recompute_performance_summaries()
+def run(workers = 1, checkpoint_path = None):
+  """
+  Recompute the key statuses, fix the end times, and recompute the performance summaries.
+  With a checkpoint, the completed phases are recorded, and skipped when a crashed run is resumed.
+  """
+  checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+  completed_phases = checkpoint.completed_phases() if checkpoint else set()
+
+  for phase, func in [('key_statuses', recompute_key_statuses),
+                      ('end_times', fix_end_times)]:
+    if phase in completed_phases:
+      INFO('Resuming from checkpoint %s: skipping %s'%(checkpoint_path, phase))
+      continue
+    func()
+    if checkpoint:
+      checkpoint.mark_phase(phase)
+
+  recompute_performance_summaries(workers = workers, checkpoint_path = checkpoint_path)
 
 if __name__ == '__main__':
-  run()
+  args = parser.parse_args()
+  if args.profile_properties:
+    descriptors.enable_profiling()
+  run(workers = args.workers, checkpoint_path = args.checkpoint)